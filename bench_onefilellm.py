@@ -0,0 +1,317 @@
+"""Offline benchmarks for onefilellm.py.
+
+Run all benchmarks with `python bench_onefilellm.py`, or pass the names of the
+ones you want, e.g. `python bench_onefilellm.py github_modes`. Remote sources are
+served by the local fixtures in test_onefilellm.py, so no network access (and no
+real GITHUB_TOKEN) is needed.
+"""
+import io
+import os
+import re
+import sys
+import time
+from contextlib import redirect_stdout
+
+os.environ.setdefault("GITHUB_TOKEN", "benchmark")
+
+import onefilellm
+from test_onefilellm import (DEFERRED_IMPORTS, FakeDocsSite, FakeGitHubServer, make_test_diff, make_test_encoding,
+                             make_test_pdf, measure_import)
+
+# Benchmarks measure fetching, so never serve them from the persistent cache.
+onefilellm.configure_cache(enabled=False)
+
+
+def timed(fn, *args, **kwargs):
+    """Run fn once with its progress output suppressed; return (result, seconds)."""
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_github_modes(file_count=300, directory_count=30, latency=0.01):
+    """Compare the per-file Contents API walk with the tree and archive modes."""
+    files = {
+        f"pkg{i % directory_count}/module_{i}.py": f"def f_{i}():\n    return {i}\n" * 20
+        for i in range(file_count)
+    }
+    print(f"GitHub repository modes: {file_count} files in {directory_count} directories, {latency * 1000:.0f} ms latency")
+    with FakeGitHubServer(files, latency=latency) as server, server.patch():
+        for mode in onefilellm.GITHUB_REPO_MODES:
+            server.requests.clear()
+            _, elapsed = timed(onefilellm.process_github_repo, server.repo_url, mode=mode)
+            print(f"  {mode:<10} {elapsed:8.3f}s  {len(server.requests):5d} requests")
+
+
+def bench_filetype_classifier(count=1_000_000):
+    """Compare the compiled suffix-set classifier with the old linear endswith scan."""
+    extensions = [".py", ".md", ".png", ".json", ".lock", ".ts", ".pyc", ".example", "", ".min.js"]
+    names = [f"src/module_{i}/file_{i}{extensions[i % len(extensions)]}" for i in range(count)]
+    allowed = onefilellm.ALLOWED_EXTENSIONS
+    classifier = onefilellm.FileTypeClassifier()
+
+    def legacy(names):
+        return sum(any(name.endswith(ext) for ext in allowed) for name in names)
+
+    def compiled(names):
+        matches = classifier.matches
+        return sum(map(matches, names))
+
+    print(f"File type classifier: {count:,} synthetic file names")
+    legacy_matches, legacy_time = timed(legacy, names)
+    compiled_matches, compiled_time = timed(compiled, names)
+    assert legacy_matches == compiled_matches
+    print(f"  endswith scan {legacy_time:8.3f}s")
+    print(f"  suffix set    {compiled_time:8.3f}s  ({legacy_time / compiled_time:.1f}x faster)")
+
+
+def bench_token_count(size_mb=8):
+    """Compare the old per-call encoder lookup and 1000-char slices with the chunked batch counter."""
+    import re
+    line = '    def method(self, value):\n        return {"key": value, "items": [1, 2, 3]}  # comment\n'
+    text = '<file name="module.py">\n' + line * (size_mb * 1024 * 1024 // len(line)) + '</file>'
+    # The offline test encoding stands in for cl100k_base, which needs a download.
+    encoding = onefilellm._encoding = make_test_encoding()
+
+    def legacy(text, chunk_size=1000):
+        stripped = re.sub(r'<[^>]+>', '', text)
+        chunks = [stripped[i:i + chunk_size] for i in range(0, len(stripped), chunk_size)]
+        return sum(len(encoding.encode(chunk, disallowed_special=[])) for chunk in chunks)
+
+    print(f"Token counting: {len(text) / (1024 * 1024):.1f} MB of source")
+    legacy_count, legacy_time = timed(legacy, text)
+    count, elapsed = timed(onefilellm.get_token_count, text)
+    exact = len(encoding.encode_ordinary(onefilellm.TAG_PATTERN.sub('', text)))
+    print(f"  1000-char slices {legacy_time:8.3f}s  {legacy_count:>10} tokens")
+    print(f"  batched chunks   {elapsed:8.3f}s  {count:>10} tokens  (exact: {exact})")
+
+
+def bench_compressor(size_mb=20):
+    """Compare the old ElementTree round-trip in preprocess_text with the streaming compressor."""
+    import re
+    import tempfile
+    import tracemalloc
+    import xml.etree.ElementTree as ET
+
+    def process_text(text):
+        text = re.sub(r"[\n\r]+", "\n", text)
+        text = re.sub(r"[^a-zA-Z0-9\s_.,!?:;@#$%^&*()+\-=[\]{}|\\<>`~'\"/]+", "", text)
+        text = re.sub(r"\s+", " ", text)
+        return " ".join(word for word in text.lower().split() if word not in onefilellm.stop_words)
+
+    def legacy(input_file, output_file):
+        with open(input_file, "r", encoding="utf-8") as f:
+            root = ET.fromstring(f.read())
+        for elem in root.iter():
+            if elem.text:
+                elem.text = process_text(elem.text)
+            if elem.tail:
+                elem.tail = process_text(elem.tail)
+        ET.ElementTree(root).write(output_file, encoding="utf-8", xml_declaration=True)
+
+    block = "<file name=\"module_{}.py\">\n" + "The value of x &amp; y is returned to the caller when ready.\n" * 200 + "</file>"
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source = os.path.join(temp_dir, "uncompressed_output.txt")
+        with open(source, "w", encoding="utf-8") as f:
+            f.write('<source type="local_directory" path="bench">')
+            for i in range(size_mb * 1024 * 1024 // len(block)):
+                f.write("\n" + block.format(i))
+            f.write("\n</source>")
+        print(f"Compressor: {os.path.getsize(source) / (1024 * 1024):.1f} MB document")
+        for label, fn in (("ElementTree", legacy), ("streaming", onefilellm.preprocess_text)):
+            tracemalloc.start()
+            _, elapsed = timed(fn, source, os.path.join(temp_dir, f"{label}.txt"))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {label:<12} {elapsed:8.3f}s  peak {peak / (1024 * 1024):8.1f} MB")
+
+
+def bench_crawler(page_count=500, latency=0.01):
+    """Compare a one-at-a-time crawl with the concurrent crawler, following links and from a sitemap."""
+    pages = FakeDocsSite.generate(page_count, links_per_page=5)
+    print(f"Web crawler: {page_count} linked pages, {latency * 1000:.0f} ms latency")
+    with FakeDocsSite(pages, latency=latency) as site:
+        urls = "".join(f"<url><loc>{site.url}{path}</loc></url>" for path in pages)
+        site.pages["/sitemap.xml"] = ("application/xml", f"<urlset>{urls}</urlset>".encode("utf-8"))
+        for workers, plan in ((1, "links"), (onefilellm.DEFAULT_MAX_WORKERS, "links"), (32, "links"), (32, "sitemap")):
+            site.requests.clear()
+            result, elapsed = timed(onefilellm.crawl_and_extract_text, f"{site.url}/docs/", 4, False, True,
+                                    max_workers=workers, rate_limit=None, plan=plan)
+            print(f"  {workers:>2} workers, {plan:<7} {elapsed:8.3f}s  {len(result['processed_urls']):5d} pages  {len(site.requests):5d} requests")
+
+
+def bench_html_extractors(page_count=300):
+    """Compare the HTML extractor backends over a corpus of pages.
+
+    Set ONEFILELLM_BENCH_PAGES to a directory of saved .html files to use real
+    pages; otherwise pages are generated.
+    """
+    corpus_dir = os.getenv("ONEFILELLM_BENCH_PAGES")
+    if corpus_dir:
+        corpus = []
+        for name in sorted(os.listdir(corpus_dir)):
+            if name.endswith((".html", ".htm")):
+                with open(os.path.join(corpus_dir, name), "rb") as f:
+                    corpus.append(f.read())
+    else:
+        filler = "<div class='section'><h2>Heading</h2><p>Some <b>documentation</b> text &amp; an <a href='#x'>anchor</a>.</p></div>" * 40
+        corpus = [page.replace("</h1>", "</h1>" + filler).encode("utf-8")
+                  for page in FakeDocsSite.generate(page_count, links_per_page=20).values()]
+
+    print(f"HTML extractors: {len(corpus)} pages, {sum(map(len, corpus)) / (1024 * 1024):.1f} MB")
+    for name in onefilellm.available_html_extractors():
+        extractor = onefilellm.HTML_EXTRACTORS[name]
+        _, elapsed = timed(lambda: [extractor(page) for page in corpus])
+        print(f"  {name:<10} {elapsed:8.3f}s")
+
+
+def bench_pdf(page_count=400):
+    """Compare the old temp-file, page-by-page PDF extraction with the in-memory page-range pool."""
+    import tempfile
+    from PyPDF2 import PdfReader
+    data = make_test_pdf([f"Section {i} describes the results of experiment number {i}." for i in range(page_count)])
+
+    def legacy(data):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "temp.pdf")
+            with open(path, "wb") as f:
+                f.write(data)
+            text = ""
+            with open(path, "rb") as f:
+                reader = PdfReader(f)
+                for page in range(len(reader.pages)):
+                    text += reader.pages[page].extract_text()
+            return text
+
+    print(f"PDF extraction: {page_count} pages, backends available: {', '.join(onefilellm.available_pdf_backends())}")
+    _, elapsed = timed(legacy, data)
+    print(f"  temp file, serial     {elapsed:8.3f}s")
+    for jobs in sorted({1, os.cpu_count() or 1}):
+        _, elapsed = timed(onefilellm.extract_pdf_text, data, jobs=jobs)
+        print(f"  in memory, {jobs:>2} jobs   {elapsed:8.3f}s")
+    _, elapsed = timed(onefilellm.extract_pdf_text, data, max_pages=20)
+    print(f"  in memory, 20 pages   {elapsed:8.3f}s")
+
+
+def bench_pull_request_diff(file_count=100, hunk_lines=100):
+    """Compare the old diff_lines.index() interleaving with the position-indexed renderer."""
+    diff, comments = make_test_diff(file_count, hunk_lines=hunk_lines)
+    comments = comments[::7]
+
+    def legacy(diff, comments):
+        comments = sorted(comments, key=lambda comment: comment.get("position") or float("inf"))
+        text = ""
+        diff_lines = diff.split("\n")
+        comment_index = 0
+        for line in diff_lines:
+            text += f"{onefilellm.escape_xml(line)}\n"
+            while comment_index < len(comments) and comments[comment_index].get("position") == diff_lines.index(line):
+                text += onefilellm.render_review_comment(comments[comment_index])
+                comment_index += 1
+        return text
+
+    def misplaced(rendered):
+        wrong, line_number = 0, -1
+        for chunk in re.split(r"(<review_comment>\n.*?</review_comment>\n)", rendered, flags=re.S):
+            if chunk.startswith("<review_comment>"):
+                wrong += re.search(r"<content>(.*)</content>", chunk).group(1) != f"after line {line_number}"
+            else:
+                line_number += chunk.count("\n")
+        return wrong
+
+    print(f"Pull request diff: {diff.count(chr(10)) + 1:,} lines, {len(comments)} review comments")
+    for label, fn in (("index() scan", legacy), ("position dict", lambda d, c: "".join(onefilellm.render_pull_request_diff(d, c, [])))):
+        rendered, elapsed = timed(fn, diff, comments)
+        placed = rendered.count("<review_comment>")
+        print(f"  {label:<13} {elapsed:8.3f}s  {placed:5d} placed, {misplaced(rendered)} misplaced")
+
+
+def bench_github_issue(comment_count=500, latency=0.02):
+    """Time fetching every comment of a large issue: serial 30-item pages versus the paginated client."""
+    comments = [{"id": i, "user": {"login": "someone"}, "body": f"Comment {i}"} for i in range(comment_count)]
+    print(f"GitHub issue comments: {comment_count} comments, {latency * 1000:.0f} ms latency")
+    with FakeGitHubServer({}, issues={1: {"title": "t", "body": "b", "comments": comments}}, latency=latency) as server, server.patch():
+        url = f"{server.url}/repos/{server.owner}/{server.repo}/issues/1/comments"
+
+        def serial(url):
+            items = []
+            while url:
+                response = onefilellm.get_session().get(url, timeout=onefilellm.REQUEST_TIMEOUT)
+                items.extend(response.json())
+                url = response.links.get("next", {}).get("url")
+            return items
+
+        for label, fn in (("serial, 30/page", serial), ("client, 100/page", onefilellm.github_get_all)):
+            server.requests.clear()
+            items, elapsed = timed(fn, url)
+            assert len(items) == comment_count
+            print(f"  {label:<17} {elapsed:8.3f}s  {len(server.requests):3d} requests")
+
+
+def bench_import_time(runs=5):
+    """Compare importing onefilellm with importing every dependency it used to load up front."""
+    eager = "import " + ", ".join(name for name in DEFERRED_IMPORTS if name not in ("lxml", "selectolax", "pypdfium2", "pdfminer"))
+    print(f"Import time: best of {runs} fresh interpreters (python -X importtime)")
+    for label, statement in (("eager deps", f"{eager}; import onefilellm"), ("onefilellm", "import onefilellm")):
+        totals = [measure_import(statement)[2] for _ in range(runs)]
+        print(f"  {label:<11} {min(totals) / 1000:8.1f} ms")
+    _, modules, _ = measure_import()
+    slowest = sorted(((micros, name) for name, micros in modules.items() if name != "onefilellm"), reverse=True)
+    print("  slowest modules under onefilellm: " + ", ".join(f"{name} {micros / 1000:.1f} ms" for micros, name in slowest[:5]))
+
+def bench_chunked_output(file_count=2000, max_tokens=512):
+    """Compare writing the output and then re-reading and re-tokenizing it into chunks with chunking in the same pass."""
+    import shutil
+    import tempfile
+    onefilellm._encoding = make_test_encoding()
+    paragraph = "def method(self, value):\n    return {&quot;key&quot;: value}  # a comment about ab\n"
+    fragments = ['<source type="local_directory" path="bench">']
+    fragments += [f'<file name="pkg/module_{i}.py">\n' + "\n".join([paragraph] * (5 + i % 40)) + '\n</file>' for i in range(file_count)]
+    fragments.append('</source>')
+    work_dir = tempfile.mkdtemp()
+    output = os.path.join(work_dir, "out.txt")
+
+    def two_pass():
+        counter = onefilellm.TokenCounter()
+        with onefilellm.OutputWriter(output, [counter]) as writer:
+            for fragment in fragments:
+                writer.write(fragment)
+        chunker = onefilellm.ChunkWriter(os.path.join(work_dir, "two_pass"), max_tokens)
+        with open(output, "r", encoding="utf-8") as f:
+            for block in re.findall(r'<file name="[^"]*">.*?</file>', f.read(), re.S):
+                chunker.feed(block)
+        chunker.close()
+        return chunker.records
+
+    def one_pass():
+        chunker = onefilellm.ChunkWriter(os.path.join(work_dir, "one_pass"), max_tokens)
+        with onefilellm.OutputWriter(output, [chunker]) as writer:
+            for fragment in fragments:
+                writer.write(fragment)
+        return chunker.records
+
+    print(f"Chunked output: {file_count} files, {max_tokens}-token chunks")
+    for label, fn in (("write, re-read", two_pass), ("same pass", one_pass)):
+        records, elapsed = timed(fn)
+        print(f"  {label:<15} {elapsed:8.3f}s  {records} chunks")
+    shutil.rmtree(work_dir)
+
+BENCHMARKS = {
+    "github_modes": bench_github_modes,
+    "filetype_classifier": bench_filetype_classifier,
+    "token_count": bench_token_count,
+    "compressor": bench_compressor,
+    "crawler": bench_crawler,
+    "html_extractors": bench_html_extractors,
+    "pdf": bench_pdf,
+    "pull_request_diff": bench_pull_request_diff,
+    "github_issue": bench_github_issue,
+    "import_time": bench_import_time,
+    "chunked_output": bench_chunked_output,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -1,72 +1,844 @@
-import requests
-from bs4 import BeautifulSoup, Comment
-from urllib.parse import urljoin, urlparse
-from PyPDF2 import PdfReader
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse, quote, unquote, parse_qs, urlencode
 import os
+import importlib
+import importlib.util
+import random
+import posixpath
 import sys
-import tiktoken
-import nltk
-from nltk.corpus import stopwords
+import argparse
+import io
+import json
+import mmap
+import codecs
+import time
+import hashlib
+import shutil
+import tempfile
+import tarfile
+import zipfile
+import gzip
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from functools import partial
+from contextlib import nullcontext
 import re
+import threading
+import heapq
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
 from pathlib import Path
-import nbformat
-from nbconvert import PythonExporter
-from youtube_transcript_api import YouTubeTranscriptApi
-from youtube_transcript_api.formatters import TextFormatter
-import pyperclip
-import wget
-from tqdm import tqdm
 from time import sleep
 from rich import print
-from rich.console import Console
-from rich.panel import Panel
-from rich.text import Text
-from rich.prompt import Prompt
-from rich.style import Style
-from rich.syntax import Syntax
-from rich.traceback import install
-from rich.progress import Progress, TextColumn, BarColumn, TimeRemainingColumn
-import xml.etree.ElementTree as ET
+
+class LazyModule:
+    """A module that is imported the first time one of its attributes is used.
+
+    Most runs touch only one kind of source, so dependencies are loaded when
+    that source needs them rather than on every start.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+def module_available(name):
+    """Whether an optional dependency is installed, without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ImportError:
+        return False
+
+requests = LazyModule("requests")
+bs4 = LazyModule("bs4")
+PyPDF2 = LazyModule("PyPDF2")
+tiktoken = LazyModule("tiktoken")
+nbformat = LazyModule("nbformat")
+nbconvert = LazyModule("nbconvert")
+youtube_transcript_api = LazyModule("youtube_transcript_api")
+youtube_transcript_formatters = LazyModule("youtube_transcript_api.formatters")
+pyperclip = LazyModule("pyperclip")
+# Optional faster HTML parsers for web crawls.
+lxml_html = LazyModule("lxml.html")
+lxml_etree = LazyModule("lxml.etree")
+selectolax_parser = LazyModule("selectolax.parser")
+# Optional faster PDF text extraction backends.
+pdfium = LazyModule("pypdfium2")
+pdfminer_high_level = LazyModule("pdfminer.high_level")
+pdfminer_pdfpage = LazyModule("pdfminer.pdfpage")
 
 def safe_file_read(filepath, fallback_encoding='latin1'):
+    # Read once and decode in memory, rather than re-reading the whole file
+    # when UTF-8 decoding fails partway through.
+    with open(filepath, "rb") as file:
+        data = file.read()
     try:
-        with open(filepath, "r", encoding='utf-8') as file:
-            return file.read()
+        text = data.decode('utf-8')
     except UnicodeDecodeError:
-        with open(filepath, "r", encoding=fallback_encoding) as file:
-            return file.read()
-
-nltk.download("stopwords", quiet=True)
-stop_words = set(stopwords.words("english"))
+        text = data.decode(fallback_encoding)
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+# NLTK's English stopword list, bundled so compression needs no download.
+stop_words = frozenset("""
+i me my myself we our ours ourselves you you're you've you'll you'd your yours yourself yourselves he him his himself
+she she's her hers herself it it's its itself they them their theirs themselves what which who whom this that that'll
+these those am is are was were be been being have has had having do does did doing a an the and but if or because as
+until while of at by for with about against between into through during before after above below to from up down in
+out on off over under again further then once here there when where why how all any both each few more most other
+some such no nor not only own same so than too very s t can will just don don't should should've now d ll m o re ve
+y ain aren aren't couldn couldn't didn didn't doesn doesn't hadn hadn't hasn hasn't haven haven't isn isn't ma mightn
+mightn't mustn mustn't needn needn't shan shan't shouldn shouldn't wasn wasn't weren weren't won won't wouldn wouldn't
+""".split())
 
 TOKEN = os.getenv('GITHUB_TOKEN', 'default_token_here')
-if TOKEN == 'default_token_here':
-    raise EnvironmentError("GITHUB_TOKEN environment variable not set.")
 
-headers = {"Authorization": f"token {TOKEN}"}
+def github_headers():
+    """Authorization headers for GitHub requests.
+
+    The token is only required once something is fetched from GitHub, so
+    other sources work without it.
+    """
+    if TOKEN == 'default_token_here':
+        raise EnvironmentError("GITHUB_TOKEN environment variable not set.")
+    return {"Authorization": f"token {TOKEN}"}
+
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_RAW_URL = "https://raw.githubusercontent.com"
+
+# Number of concurrent requests used when fetching a GitHub repository.
+DEFAULT_MAX_WORKERS = 8
+# Connections kept alive per host by the shared session.
+HTTP_POOL_SIZE = 32
+REQUEST_TIMEOUT = 60
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Return the shared keep-alive session used for outgoing HTTP requests."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+# Failed requests are retried this many times, with exponential backoff from
+# RETRY_BACKOFF seconds (capped at MAX_RETRY_BACKOFF) and full jitter.
+DEFAULT_MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0
+MAX_RETRY_BACKOFF = 60.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Longest wait for a rate limit to reset before giving up on a request.
+DEFAULT_RATE_LIMIT_WAIT = 15 * 60
+# Requests left unused in each rate-limit window, for other tools sharing the token.
+RATE_LIMIT_RESERVE = 5
+
+class RateLimitExceeded(OSError):
+    """The rate limit ran out and would not reset within the allowed wait."""
+
+class RequestScheduler:
+    """Sends GET requests through the shared session, paced by rate limits and retried on failure.
+
+    The X-RateLimit-Remaining and X-RateLimit-Reset headers of each host's
+    responses are tracked. Once less than a quarter of the limit remains,
+    requests to that host are spread out so the rest lasts until the reset,
+    and at RATE_LIMIT_RESERVE they wait for it. Rate-limited 403s, 429s, 5xx
+    responses and connection errors are retried, honouring Retry-After.
+    """
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, max_wait=DEFAULT_RATE_LIMIT_WAIT, backoff=RETRY_BACKOFF):
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.backoff = backoff
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def _update(self, host, headers):
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        try:
+            limit = {
+                "limit": int(headers.get("X-RateLimit-Limit", 0)),
+                "remaining": int(headers["X-RateLimit-Remaining"]),
+                "reset": float(headers.get("X-RateLimit-Reset", 0)),
+            }
+        except ValueError:
+            return
+        with self._lock:
+            previous = self._limits.get(host)
+            # Responses to concurrent requests arrive out of order; keep the lowest count per window.
+            if previous and previous["reset"] == limit["reset"] and previous["remaining"] < limit["remaining"]:
+                return
+            self._limits[host] = dict(limit, next_at=previous["next_at"] if previous else 0.0)
+
+    def _pace(self, host):
+        with self._lock:
+            state = self._limits.get(host)
+            now = time.time()
+            if state is None or state["reset"] <= now:
+                return
+            if state["remaining"] <= RATE_LIMIT_RESERVE:
+                delay = state["reset"] - now + 1
+            elif state["remaining"] < state["limit"] / 4:
+                interval = (state["reset"] - now) / (state["remaining"] - RATE_LIMIT_RESERVE)
+                start = max(now, state["next_at"])
+                state["next_at"] = start + interval
+                delay = start - now
+            else:
+                delay = 0
+            # Count the request now so concurrent callers see the budget shrink.
+            state["remaining"] -= 1
+        if delay > self.max_wait:
+            raise RateLimitExceeded(f"Rate limit for {host} resets in {int(delay)}s; rerun then to resume")
+        if delay > 0:
+            sleep(delay)
+
+    def _retry_delay(self, response, attempt):
+        """Seconds to wait before retrying response, or None if it should not be retried."""
+        headers = response.headers
+        rate_limited = headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in headers
+        if response.status_code not in RETRY_STATUSES and not (response.status_code == 403 and rate_limited):
+            return None
+        if headers.get("Retry-After", "").isdigit():
+            return int(headers["Retry-After"])
+        if headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in headers:
+            return max(0.0, float(headers["X-RateLimit-Reset"]) - time.time() + 1)
+        return self.jitter(attempt)
+
+    def jitter(self, attempt):
+        return random.uniform(0, min(MAX_RETRY_BACKOFF, self.backoff * 2 ** attempt))
+
+    def get(self, url, **kwargs):
+        """session.get(url, **kwargs), paced and retried. The last response is returned whatever its status."""
+        host = urlparse(url).netloc
+        for attempt in range(self.max_retries + 1):
+            self._pace(host)
+            try:
+                response = get_session().get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                sleep(self.jitter(attempt))
+                continue
+            self._update(host, response.headers)
+            delay = self._retry_delay(response, attempt)
+            if delay is None or attempt == self.max_retries:
+                return response
+            if delay > self.max_wait:
+                raise RateLimitExceeded(f"Rate limit for {host} resets in {int(delay)}s; rerun then to resume")
+            response.close()
+            sleep(delay)
+
+_scheduler = RequestScheduler()
+
+def configure_scheduler(max_retries=DEFAULT_MAX_RETRIES, max_wait=DEFAULT_RATE_LIMIT_WAIT, backoff=RETRY_BACKOFF):
+    """Set how outgoing requests are retried and how long they may wait for a rate limit."""
+    global _scheduler
+    _scheduler = RequestScheduler(max_retries, max_wait, backoff)
+    return _scheduler
+
+def scheduled_get(url, **kwargs):
+    """GET url through the configured RequestScheduler."""
+    return _scheduler.get(url, **kwargs)
+
+DEFAULT_CACHE_DIR = os.getenv("ONEFILELLM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "onefilellm"))
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+class DiskCache:
+    """Persistent cache for remote sources, bounded in size with LRU eviction.
+
+    GitHub file contents are content-addressed under their blob SHA in
+    blobs/, so they never need revalidating. Other responses live in http/,
+    keyed by URL, next to a .json sidecar holding the ETag/Last-Modified
+    validators used for conditional requests. Reads bump a file's mtime,
+    which is what eviction orders by.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    def _path(self, kind, key):
+        return os.path.join(self.directory, kind, key[:2], key)
+
+    @staticmethod
+    def url_key(url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            # Overwriting an entry, such as a revalidated response, only changes the size by the difference.
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            os.replace(temp_path, path)
+            if self._size is not None:
+                self._size += len(data) - old_size
+        self._evict_if_needed()
+
+    def get_blob(self, sha):
+        return self._read(self._path("blobs", sha))
+
+    def put_blob(self, sha, data):
+        self._write(self._path("blobs", sha), data)
+
+    def get_checkpoint(self, key):
+        data = self._read(self._path("checkpoints", key))
+        return json.loads(data) if data is not None else None
+
+    def put_checkpoint(self, key, checkpoint):
+        self._write(self._path("checkpoints", key), json.dumps(checkpoint).encode("utf-8"))
+
+    def delete_checkpoint(self, key):
+        try:
+            os.remove(self._path("checkpoints", key))
+        except OSError:
+            pass
+
+    def get_response(self, url):
+        """Return (meta, body) for a cached response, or None."""
+        path = self._path("http", self.url_key(url))
+        meta = self._read(f"{path}.json")
+        body = self._read(path) if meta is not None else None
+        if body is None:
+            return None
+        return json.loads(meta), body
+
+    def put_response(self, url, meta, body):
+        path = self._path("http", self.url_key(url))
+        self._write(path, body)
+        self._write(f"{path}.json", json.dumps(meta).encode("utf-8"))
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict_if_needed(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            if self._size <= self.max_bytes:
+                return
+            # Evict least recently used files until we are comfortably under the cap.
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(self._entries()):
+                if self._size <= target:
+                    break
+                try:
+                    os.remove(path)
+                    self._size -= size
+                except OSError:
+                    pass
+
+_cache = None
+_cache_configured = False
+
+def configure_cache(directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES, enabled=True):
+    """Set up (or disable) the persistent cache used for remote fetches."""
+    global _cache, _cache_configured
+    _cache = DiskCache(directory, max_bytes) if enabled else None
+    _cache_configured = True
+    return _cache
+
+def get_cache():
+    if not _cache_configured:
+        configure_cache()
+    return _cache
+
+class CachedResponse:
+    """The parts of a requests.Response that callers use, possibly served from the cache."""
+
+    def __init__(self, url, status_code, headers, content, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        match = re.search(r"charset=([\w-]+)", self.headers.get("Content-Type", ""))
+        return self.content.decode(match.group(1) if match else "utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+def get_fresh_cached_response(url, modified_at):
+    """Return the cached response for url if it was fetched after modified_at, else None.
+
+    Used when the server has already said when a resource last changed, e.g.
+    via a sitemap <lastmod>, so no revalidation request is needed.
+    """
+    cache = get_cache()
+    cached = cache.get_response(url) if cache else None
+    if cached is None or cached[0].get("fetched_at", 0) < modified_at:
+        return None
+    meta, body = cached
+    return CachedResponse(url, 200, requests.structures.CaseInsensitiveDict(meta.get("headers", {})), body, from_cache=True)
+
+def cached_get(url, headers=None, timeout=REQUEST_TIMEOUT, store=False):
+    """GET url through the shared session, revalidating against the disk cache.
+
+    Responses carrying an ETag or Last-Modified header are stored; later
+    calls send If-None-Match/If-Modified-Since and a 304 is answered from the
+    cache. store keeps a response without validators too, for callers that
+    learn elsewhere when it changes (see get_fresh_cached_response). Error
+    statuses raise requests.HTTPError.
+    """
+    cache = get_cache()
+    cached = cache.get_response(url) if cache else None
+    request_headers = dict(headers or {})
+    if cached:
+        meta, _ = cached
+        if meta.get("etag"):
+            request_headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            request_headers["If-Modified-Since"] = meta["last_modified"]
+
+    response = scheduled_get(url, headers=request_headers, timeout=timeout)
+    if response.status_code == 304 and cached:
+        meta, body = cached
+        return CachedResponse(url, 200, requests.structures.CaseInsensitiveDict(meta.get("headers", {})), body, from_cache=True)
+    response.raise_for_status()
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if cache and (etag or last_modified or store):
+        cache.put_response(url, {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+            # Link is kept so paginated API responses can be followed from the cache.
+            "headers": {name: response.headers[name] for name in ("Content-Type", "Link") if name in response.headers},
+        }, response.content)
+    return CachedResponse(url, response.status_code, response.headers, response.content)
+
+def ordered_map(executor, fn, items, window):
+    """Like executor.map, but yields lazily and keeps at most `window` calls in flight.
+
+    Results come back in the order of `items`, so output built from them is
+    deterministic regardless of which call finishes first.
+    """
+    in_flight = deque()
+    for item in items:
+        in_flight.append(executor.submit(fn, item))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+ENCODING_SNIFF_BYTES = 64 * 1024
+BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+def detect_encoding(prefix):
+    """Guess the encoding of a file from a bounded prefix of its bytes."""
+    for bom, encoding in BYTE_ORDER_MARKS:
+        if prefix.startswith(bom):
+            return encoding
+    try:
+        # final=False tolerates a multi-byte character cut off at the end of the prefix.
+        codecs.getincrementaldecoder("utf-8")().decode(prefix[:ENCODING_SNIFF_BYTES], final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+def decode_text(data):
+    """Decode file bytes with universal newlines, like reading the file in text mode."""
+    encoding = detect_encoding(data[:ENCODING_SNIFF_BYTES])
+    return data.decode(encoding, errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
 
 def download_file(url, target_path):
-    response = requests.get(url, headers=headers)
+    response = requests.get(url, headers=github_headers())
     response.raise_for_status()
     with open(target_path, "wb") as f:
         f.write(response.content)
 
+ALLOWED_EXTENSIONS = ['.py', '.txt', '.js', '.tsx', '.ts', '.md', '.cjs', '.html', '.json', '.ipynb', '.h', '.localhost', '.sh', '.yaml', '.example']
+
+# Directories that are never worth descending into when walking a local folder.
+DEFAULT_EXCLUDED_DIRS = {
+    ".git", ".hg", ".svn", "node_modules", "bower_components", "venv", ".venv", "__pycache__",
+    ".mypy_cache", ".pytest_cache", ".ruff_cache", ".tox", ".nox", ".eggs", ".next", "build", "dist",
+}
+
+IGNORE_FILE_NAMES = (".gitignore", ".ignore")
+
+def compile_ignore_pattern(line):
+    """Translate one .gitignore-style line into (regex, negated, directory_only).
+
+    Returns None for blank lines and comments. Patterns without a slash
+    match at any depth; patterns containing one are anchored to the
+    directory the rule came from.
+    """
+    line = line.rstrip("\r\n")
+    if not line.strip() or line.startswith("#"):
+        return None
+    line = re.sub(r"(?<!\\) +$", "", line)
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    elif line.startswith(("\\!", "\\#")):
+        line = line[1:]
+    directory_only = line.endswith("/")
+    line = line.rstrip("/")
+    anchored = "/" in line
+    line = line.lstrip("/")
+
+    regex, i = [], 0
+    while i < len(line):
+        c = line[i]
+        if line.startswith("**/", i):
+            regex.append("(?:.*/)?")
+            i += 3
+            continue
+        if line.startswith("**", i) and i + 2 == len(line):
+            regex.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            regex.append("[^/]*")
+        elif c == "?":
+            regex.append("[^/]")
+        elif c == "[" and line.find("]", i + 2) != -1:
+            end = line.find("]", i + 2)
+            body = line[i + 1:end]
+            regex.append("[^" + body[1:] + "]" if body.startswith("!") else "[" + body + "]")
+            i = end
+        elif c == "\\" and i + 1 < len(line):
+            i += 1
+            regex.append(re.escape(line[i]))
+        else:
+            regex.append(re.escape(c))
+        i += 1
+
+    prefix = "" if anchored else "(?:.*/)?"
+    return re.compile(prefix + "".join(regex) + r"\Z"), negated, directory_only
+
+class IgnoreMatcher:
+    """An ordered set of .gitignore-style rules; the last matching rule wins.
+
+    Each rule remembers the directory (relative, '/'-separated) it was read
+    from and only applies below it, so nested ignore files layer correctly.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = tuple(rules)
+
+    @classmethod
+    def from_patterns(cls, patterns, base=""):
+        return cls(cls._compile(patterns, base))
+
+    @staticmethod
+    def _compile(patterns, base):
+        rules = []
+        for pattern in patterns:
+            compiled = compile_ignore_pattern(pattern)
+            if compiled:
+                rules.append((base,) + compiled)
+        return rules
+
+    def extend_from_directory(self, directory, base):
+        """Return a matcher that also applies the ignore files found in directory."""
+        rules = []
+        for name in IGNORE_FILE_NAMES:
+            try:
+                with open(os.path.join(directory, name), "r", encoding="utf-8", errors="ignore") as f:
+                    rules.extend(self._compile(f.read().splitlines(), base))
+            except OSError:
+                continue
+        return IgnoreMatcher(self.rules + tuple(rules)) if rules else self
+
+    def is_ignored(self, path, is_dir=False):
+        for base, regex, negated, directory_only in reversed(self.rules):
+            if directory_only and not is_dir:
+                continue
+            if base:
+                if not path.startswith(base + "/"):
+                    continue
+                relative = path[len(base) + 1:]
+            else:
+                relative = path
+            if regex.match(relative):
+                return not negated
+        return False
+
+    def is_excluded(self, path):
+        """True if path, or any directory above it, is ignored."""
+        parts = path.split("/")
+        return any(self.is_ignored("/".join(parts[:depth]), is_dir=True) for depth in range(1, len(parts))) \
+            or self.is_ignored(path)
+
+# Leading bytes of common binary formats that can hide behind text-like names.
+BINARY_SIGNATURES = (
+    b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"%PDF", b"PK\x03\x04", b"\x1f\x8b", b"BZh", b"\xfd7zXZ",
+    b"7z\xbc\xaf", b"Rar!", b"\x7fELF", b"MZ", b"\xca\xfe\xba\xbe", b"\xcf\xfa\xed\xfe", b"\x00asm",
+    b"SQLite format 3", b"wOFF", b"wOF2", b"OggS", b"ID3", b"RIFF",
+)
+SNIFF_BYTES = 8192
+DEFAULT_FILETYPES_CONFIG = os.getenv("ONEFILELLM_FILETYPES", os.path.join(os.path.expanduser("~"), ".onefilellm.json"))
+
+def is_binary_content(data):
+    """True if data starts with a known binary signature or has a NUL byte near the start."""
+    head = data[:SNIFF_BYTES]
+    return head.startswith(BINARY_SIGNATURES) or b"\x00" in head
+
+class FileTypeClassifier:
+    """Decides which files are text worth including.
+
+    Names are matched against a frozen set of suffixes (and exact file
+    names) with one rfind per dot in the longest configured suffix, instead
+    of scanning the whole extension list for every file. Content sniffing
+    with is_binary_content catches binaries behind text-like names.
+    """
+
+    def __init__(self, extensions=ALLOWED_EXTENSIONS, names=(), sniff_binary=True):
+        self.suffixes = frozenset(extensions)
+        self.names = frozenset(names)
+        self.sniff_binary = sniff_binary
+        self._max_dots = max((suffix.count(".") for suffix in self.suffixes), default=0)
+
+    @classmethod
+    def from_config(cls, path):
+        """Build a classifier from a JSON config file, e.g.
+
+            {"extensions": [".rs", ".go"], "exclude_extensions": [".txt"],
+             "names": ["Makefile"], "replace_defaults": false, "sniff_binary": true}
+
+        Listed extensions are added to ALLOWED_EXTENSIONS unless
+        replace_defaults is true.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        extensions = set() if config.get("replace_defaults") else set(ALLOWED_EXTENSIONS)
+        extensions.update(config.get("extensions", []))
+        extensions.difference_update(config.get("exclude_extensions", []))
+        return cls(extensions, config.get("names", []), config.get("sniff_binary", True))
+
+    def matches(self, filename):
+        start = filename.rfind("/") + 1
+        if self.names and filename[start:] in self.names:
+            return True
+        end = len(filename)
+        for _ in range(self._max_dots):
+            end = filename.rfind(".", start, end)
+            if end == -1:
+                return False
+            if filename[end:] in self.suffixes:
+                return True
+        return False
+
+    def is_text(self, data):
+        return not (self.sniff_binary and is_binary_content(data))
+
+_classifier = FileTypeClassifier()
+_include_matcher = None
+_exclude_matcher = IgnoreMatcher()
+
+def configure_filetypes(include=None, exclude=None, config_path=DEFAULT_FILETYPES_CONFIG):
+    """Set which files are processed.
+
+    The extension list comes from ALLOWED_EXTENSIONS, extended by the JSON
+    config at config_path when it exists. include globs replace it and
+    exclude globs are applied on top; both use .gitignore syntax and are
+    matched against '/'-separated paths relative to the repository or
+    folder root.
+    """
+    global _classifier, _include_matcher, _exclude_matcher
+    _classifier = FileTypeClassifier.from_config(config_path) if config_path and os.path.isfile(config_path) else FileTypeClassifier()
+    _include_matcher = IgnoreMatcher.from_patterns(include) if include else None
+    _exclude_matcher = IgnoreMatcher.from_patterns(exclude or [])
+
 def is_allowed_filetype(filename):
-    allowed_extensions = ['.py', '.txt', '.js', '.tsx', '.ts', '.md', '.cjs', '.html', '.json', '.ipynb', '.h', '.localhost', '.sh', '.yaml', '.example']
-#    allowed_extensions = ['.md']
-    return any(filename.endswith(ext) for ext in allowed_extensions)
-    
+    if _include_matcher is not None:
+        return _include_matcher.is_ignored(filename)
+    return _classifier.matches(filename)
+
+def is_text_content(data):
+    """Content check applied after a file is read; False for sniffed binaries."""
+    return _classifier.is_text(data)
+
+def is_allowed_path(path):
+    """is_allowed_filetype plus the configured exclude globs, for a relative '/'-separated path."""
+    return is_allowed_filetype(path) and not _exclude_matcher.is_excluded(path)
+
+# Files larger than this are truncated (or skipped) rather than read whole.
+DEFAULT_MAX_FILE_BYTES = 10 * 1024 * 1024
+# Files at least this large are memory-mapped instead of read into a buffer.
+MMAP_THRESHOLD = 1024 * 1024
+OVERSIZE_POLICIES = ("truncate", "skip")
+
+class ReadLimits:
+    """Per-file and per-source byte caps on file contents.
+
+    reserve() is called once per file, before it is read or downloaded, and
+    returns how many bytes may be taken from it; reservations count against
+    max_total_bytes so a single source can never exceed it.
+    """
+
+    def __init__(self, max_file_bytes=DEFAULT_MAX_FILE_BYTES, max_total_bytes=None, oversize="truncate"):
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.oversize = oversize
+        self.used_bytes = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """Return (bytes to read, skip reason). Zero bytes means skip the file for that reason."""
+        with self._lock:
+            allowed = size if size is not None else self.max_file_bytes
+            if self.max_file_bytes is not None and (size is None or size > self.max_file_bytes):
+                if self.oversize == "skip" and size is not None:
+                    return 0, "exceeds per-file size limit"
+                allowed = self.max_file_bytes
+            if self.max_total_bytes is not None:
+                remaining = max(0, self.max_total_bytes - self.used_bytes)
+                if remaining == 0 or (remaining < allowed and self.oversize == "skip"):
+                    return 0, "total size limit reached"
+                allowed = min(allowed, remaining)
+            self.used_bytes += allowed
+            return allowed, None
+
+_read_limits = ReadLimits()
+
+def configure_read_limits(max_file_bytes=DEFAULT_MAX_FILE_BYTES, max_total_bytes=None, oversize="truncate"):
+    """Set the byte caps applied to every source processed afterwards."""
+    global _read_limits
+    if oversize not in OVERSIZE_POLICIES:
+        raise ValueError(f"oversize must be one of {', '.join(OVERSIZE_POLICIES)}")
+    _read_limits = ReadLimits(max_file_bytes, max_total_bytes, oversize)
+
+def new_read_limits():
+    """A fresh ReadLimits with the configured caps, for one source."""
+    return ReadLimits(_read_limits.max_file_bytes, _read_limits.max_total_bytes, _read_limits.oversize)
+
+def read_file_bytes(file_path, limit=None):
+    """Read at most limit bytes of a file, memory-mapping large ones.
+
+    Returns (data, size) where size is the full size of the file.
+    """
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        length = size if limit is None else min(size, limit)
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:length], size
+        return f.read(length), size
+
+def hash_file(file_path):
+    """SHA-256 of a file's contents without holding large files in memory."""
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return hashlib.sha256(mapped).hexdigest()
+        return hashlib.sha256(f.read()).hexdigest()
+
+def render_skipped(name, size, reason):
+    """The marker element left in place of a file that was not read."""
+    size_attribute = f' bytes="{size}"' if size is not None else ""
+    return f'<skipped name="{escape_xml(name)}"{size_attribute} reason="{reason}"/>'
+
+def render_file_block(name, data, size, sniff_binary=True):
+    """Return the escaped <file> element for data read from a file of size bytes.
+
+    When data is shorter than the file, the content is followed by a
+    <truncated/> marker. Returns None for binary content.
+    """
+    if sniff_binary and is_binary_content(data):
+        return None
+    truncated = size is not None and len(data) < size
+    if truncated and name.endswith(".ipynb"):
+        # A cut-off notebook is not valid JSON, so there is nothing to convert.
+        return render_skipped(name, size, "exceeds per-file size limit")
+    text = decode_text(data)
+    if name.endswith(".ipynb"):
+        text = notebook_to_python(text)
+    block = f'<file name="{escape_xml(name)}">\n{escape_xml(text)}'
+    if truncated:
+        block += f'\n<truncated bytes="{size}" kept_bytes="{len(data)}"/>'
+    return block + '\n</file>'
+
+def walk_local_files(local_path, use_ignore_files=True):
+    """Yield (file_path, relative_path) for every allowed file under local_path.
+
+    Uses os.scandir and prunes DEFAULT_EXCLUDED_DIRS, exclude globs and
+    .gitignore/.ignore matches before descending, so ignored trees are never
+    listed. Entries are visited in sorted order, files of a directory before
+    its subdirectories, which keeps output stable across filesystems.
+    """
+    def walk(directory, relative_dir, matcher):
+        if use_ignore_files:
+            matcher = matcher.extend_from_directory(directory, relative_dir)
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            return
+        subdirectories = []
+        for entry in entries:
+            relative = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in DEFAULT_EXCLUDED_DIRS and not matcher.is_ignored(relative, is_dir=True):
+                        subdirectories.append((entry.path, relative))
+                elif entry.is_file() and is_allowed_filetype(relative) and not matcher.is_ignored(relative):
+                    yield entry.path, relative.replace("/", os.sep)
+            except OSError:
+                continue
+        for path, relative in subdirectories:
+            yield from walk(path, relative, matcher)
+
+    yield from walk(local_path, "", _exclude_matcher)
 
 def process_ipynb_file(temp_file):
     with open(temp_file, "r", encoding='utf-8', errors='ignore') as f:
         notebook_content = f.read()
 
-    exporter = PythonExporter()
+    return notebook_to_python(notebook_content)
+
+def notebook_to_python(notebook_content):
+    exporter = nbconvert.PythonExporter()
     python_code, _ = exporter.from_notebook_node(nbformat.reads(notebook_content, as_version=4))
     return python_code
 
 def process_directory(url, output):
-    response = requests.get(url, headers=headers)
+    response = requests.get(url, headers=github_headers())
     response.raise_for_status()
     files = response.json()
 
@@ -112,8 +884,7 @@ def process_local_directory(local_path, output):
 
                 output.write("\n\n")
 
-def process_github_repo(repo_url):
-    api_base_url = "https://api.github.com/repos/"
+def parse_github_repo_url(repo_url):
     repo_url_parts = repo_url.split("https://github.com/")[-1].split("/")
     repo_name = "/".join(repo_url_parts[:2])
 
@@ -127,93 +898,553 @@ def process_github_repo(repo_url):
         # Any remaining parts after the branch/tag name form the subdirectory
         if len(repo_url_parts) > 4:
             subdirectory = "/".join(repo_url_parts[4:])
-    
-    contents_url = f"{api_base_url}{repo_name}/contents"
+
+    return repo_name, branch_or_tag, subdirectory
+
+def process_github_repo(repo_url, max_workers=None, mode="contents"):
+    """Flatten a GitHub repository.
+
+    mode selects how files are discovered and downloaded:
+      "contents" - one Contents API call per directory, one download per file
+      "tree"     - one Git Trees API call for the whole repo, one download per file
+      "tarball"  - one archive download, members streamed straight out of the tar
+      "zipball"  - same as tarball, using the zip archive
+    """
+    return "\n".join(iter_github_repo(repo_url, max_workers, mode))
+
+def iter_github_repo(repo_url, max_workers=None, mode="contents", packer=None):
+    """Yield the fragments of process_github_repo's document one <file> at a time.
+
+    With a TokenPacker, listed files are fetched in its rank order and left
+    undownloaded once its budget is spent. The archive modes cannot be
+    ranked; they stop reading the archive instead.
+    """
+    if mode not in GITHUB_REPO_MODES:
+        raise ValueError(f"Unknown GitHub repository mode {mode!r}; expected one of {', '.join(GITHUB_REPO_MODES)}")
+
+    repo_name, branch_or_tag, subdirectory = parse_github_repo_url(repo_url)
+    yield f'<source type="github_repository" url="{repo_url}">'
+
+    limits = new_read_limits()
+    for path, block in GITHUB_REPO_MODES[mode](repo_name, branch_or_tag, subdirectory, max_workers or DEFAULT_MAX_WORKERS, limits, packer):
+        print(f"Processing {path}...")
+        yield block
+    yield '</source>'
+    print("All files processed.")
+
+def iter_github_contents(repo_name, branch_or_tag, subdirectory, max_workers, limits, packer=None, commit=None):
+    # Listed at the commit the ref points to now, so every file comes from the same tree.
+    commit = commit or resolve_github_commit(repo_name, branch_or_tag)
+    contents_url = f"{GITHUB_API_URL}/repos/{repo_name}/contents"
     if subdirectory:
         contents_url = f"{contents_url}/{subdirectory}"
+    contents_url = f"{contents_url}?ref={commit}"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        checkpoint_key = github_listing_key(repo_name, commit, subdirectory)
+        files = load_listing_checkpoint(checkpoint_key)
+        if files is None:
+            files = list_github_contents(contents_url, executor)
+            save_listing_checkpoint(checkpoint_key, files)
+        yield from _fetch_github_files(files, executor, max_workers, limits, packer)
+    delete_listing_checkpoint(checkpoint_key)
+
+def iter_github_tree(repo_name, branch_or_tag, subdirectory, max_workers, limits, packer=None):
+    commit = resolve_github_commit(repo_name, branch_or_tag)
+    checkpoint_key = github_listing_key(repo_name, commit, subdirectory)
+    files = load_listing_checkpoint(checkpoint_key)
+    if files is None:
+        tree = github_get_json(f"{GITHUB_API_URL}/repos/{repo_name}/git/trees/{commit}?recursive=1")
+        if tree.get("truncated"):
+            # The Trees API caps recursive listings; fall back to walking directories.
+            print("Git tree listing was truncated, falling back to the Contents API.")
+            yield from iter_github_contents(repo_name, branch_or_tag, subdirectory, max_workers, limits, packer, commit)
+            return
+
+        prefix = f"{subdirectory.strip('/')}/" if subdirectory else ""
+        files = []
+        for entry in tree["tree"]:
+            name = entry["path"].rsplit("/", 1)[-1]
+            if entry["type"] == "blob" and entry["path"].startswith(prefix) and is_allowed_path(entry["path"]):
+                files.append({
+                    "name": name,
+                    "path": entry["path"],
+                    "sha": entry["sha"],
+                    "size": entry.get("size"),
+                    "download_url": f"{GITHUB_RAW_URL}/{repo_name}/{commit}/{quote(entry['path'])}",
+                })
+        save_listing_checkpoint(checkpoint_key, files)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from _fetch_github_files(files, executor, max_workers, limits, packer)
+    delete_listing_checkpoint(checkpoint_key)
+
+# A listing saved by an interrupted flatten is reused for this long.
+CHECKPOINT_MAX_AGE = 24 * 60 * 60
+
+def resolve_github_commit(repo_name, ref):
+    """The SHA of the commit ref (the default branch when None) points to now."""
+    return github_get_json(f"{GITHUB_API_URL}/repos/{repo_name}/commits/{quote(ref or 'HEAD', safe='')}")["sha"]
+
+def filetype_settings_key():
+    """A fingerprint of the file type, include and exclude settings that decide which listed files are kept."""
+    include = _include_matcher.rules if _include_matcher is not None else None
+    return repr((sorted(_classifier.suffixes), sorted(_classifier.names), include, _exclude_matcher.rules))
+
+def github_listing_key(repo_name, commit, subdirectory):
+    """The checkpoint key for a listing of commit, filtered with the current file type settings.
+
+    A ref that has moved on resolves to another commit, and other filters
+    give another fingerprint, so neither can pick up a listing made for a
+    different tree or different settings.
+    """
+    return DiskCache.url_key(f"github-listing:{repo_name}@{commit}/{subdirectory or ''}:{filetype_settings_key()}")
+
+def load_listing_checkpoint(key):
+    """The file listing saved by an interrupted flatten of the same repository, or None.
+
+    Together with the blob cache, which keeps every downloaded file by SHA,
+    this lets a rerun skip the listing requests and fetch only the files the
+    interrupted run did not get to.
+    """
+    cache = get_cache()
+    checkpoint = cache.get_checkpoint(key) if cache else None
+    if checkpoint is None or time.time() - checkpoint["saved_at"] > CHECKPOINT_MAX_AGE:
+        return None
+    print(f"Resuming from the listing of {len(checkpoint['files'])} files saved by an interrupted run.")
+    return checkpoint["files"]
+
+def delete_listing_checkpoint(key):
+    """Forget the listing of a flatten that completed."""
+    cache = get_cache()
+    if cache:
+        cache.delete_checkpoint(key)
+
+def save_listing_checkpoint(key, files):
+    cache = get_cache()
+    if cache:
+        fields = ("name", "path", "sha", "size", "download_url")
+        cache.put_checkpoint(key, {"saved_at": time.time(), "files": [{field: file.get(field) for field in fields} for file in files]})
+
+def _fetch_github_files(files, executor, max_workers, limits, packer=None):
+    fetch = fetch_github_file
+    if packer:
+        files = packer.rank(files, lambda file: (file["path"], file.get("size")))
+        fetch = partial(fetch_github_file_within, packer)
+    # Reserve in fetch order, the listing's or the packer's deterministic rank, so a
+    # total size cap always keeps the same files, and under packing the highest ranked.
+    files = [dict(file, limit=limits.reserve(file.get("size"))) for file in files]
+    for file, block in zip(files, ordered_map(executor, fetch, files, max_workers * 2)):
+        if block is not None:
+            yield file["path"], block
+
+def iter_github_archive(repo_name, branch_or_tag, subdirectory, max_workers, limits, packer=None, archive_format="tarball"):
+    archive_url = f"{GITHUB_API_URL}/repos/{repo_name}/{archive_format}"
     if branch_or_tag:
-        contents_url = f"{contents_url}?ref={branch_or_tag}"
-
-    repo_content = [f'<source type="github_repository" url="{repo_url}">']
-
-    def process_directory(url, repo_content):
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        files = response.json()
+        archive_url = f"{archive_url}/{quote(branch_or_tag, safe='')}"
 
-        for file in files:
-            if file["type"] == "file" and is_allowed_filetype(file["name"]):
-                print(f"Processing {file['path']}...")
-
-                temp_file = f"temp_{file['name']}"
-                download_file(file["download_url"], temp_file)
+    response = scheduled_get(archive_url, headers=github_headers(), timeout=REQUEST_TIMEOUT, stream=True)
+    response.raise_for_status()
 
-                repo_content.append(f'<file name="{escape_xml(file["path"])}">') 
-                if file["name"].endswith(".ipynb"):
-                    repo_content.append(escape_xml(process_ipynb_file(temp_file)))
+    if archive_format == "zipball":
+        # Zip archives keep their index at the end, so they need a seekable buffer.
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            members = ((info.filename, info.file_size, partial(archive.open, info)) for info in archive.infolist() if not info.is_dir())
+            yield from _iter_archive_members(members, subdirectory, limits, packer)
+    else:
+        with response, tarfile.open(fileobj=response.raw, mode="r|*") as archive:
+            members = ((member.name, member.size, partial(archive.extractfile, member)) for member in archive if member.isfile())
+            yield from _iter_archive_members(members, subdirectory, limits, packer)
+
+def _iter_archive_members(members, subdirectory, limits, packer=None):
+    prefix = f"{subdirectory.strip('/')}/" if subdirectory else ""
+    for member_name, size, open_member in members:
+        if packer and packer.spent:
+            # Nothing more of the archive is needed, so stop downloading it.
+            return
+        # GitHub archives wrap everything in a single "<owner>-<repo>-<sha>/" directory.
+        path = member_name.split("/", 1)[-1]
+        if not path.startswith(prefix) or not is_allowed_path(path):
+            continue
+        limit, reason = limits.reserve(size)
+        if reason:
+            yield path, render_skipped(path, size, reason)
+            continue
+        block = render_file_block(path, open_member().read(limit), size, _classifier.sniff_binary)
+        if block is not None:
+            yield path, block
+
+GITHUB_REPO_MODES = {
+    "contents": iter_github_contents,
+    "tree": iter_github_tree,
+    "tarball": iter_github_archive,
+    "zipball": partial(iter_github_archive, archive_format="zipball"),
+}
+
+def github_get_json(url):
+    return cached_get(url, headers=github_headers()).json()
+
+# Largest page size the GitHub REST API allows for list endpoints.
+GITHUB_PER_PAGE = 100
+
+def with_query(url, **params):
+    """url with the given query parameters added or replaced."""
+    parsed = urlparse(url)
+    query = {name: values[-1] for name, values in parse_qs(parsed.query).items()}
+    query.update({name: str(value) for name, value in params.items()})
+    return parsed._replace(query=urlencode(query)).geturl()
+
+def github_get_all(url, max_workers=None):
+    """Return every item of a paginated GitHub list endpoint.
+
+    Pages of GITHUB_PER_PAGE items are requested. When the first page's Link
+    header names the last page, all remaining pages are fetched at once;
+    otherwise rel="next" links are followed one by one.
+    """
+    response = cached_get(with_query(url, per_page=GITHUB_PER_PAGE), headers=github_headers())
+    items = response.json()
+    links = {link.get("rel"): link["url"] for link in requests.utils.parse_header_links(response.headers.get("Link", ""))}
+    last_page = parse_qs(urlparse(links["last"]).query).get("page", [None])[0] if "last" in links else None
+    if last_page and last_page.isdigit():
+        page_urls = [with_query(links["last"], page=page) for page in range(2, int(last_page) + 1)]
+        with ThreadPoolExecutor(max_workers=max_workers or DEFAULT_MAX_WORKERS) as executor:
+            for page in executor.map(github_get_json, page_urls):
+                items.extend(page)
+        return items
+    while "next" in links:
+        response = cached_get(links["next"], headers=github_headers())
+        items.extend(response.json())
+        links = {link.get("rel"): link["url"] for link in requests.utils.parse_header_links(response.headers.get("Link", ""))}
+    return items
+
+def list_github_contents(contents_url, executor):
+    """List every allowed file below contents_url, fetching directories concurrently.
+
+    Files are returned in the same depth-first order a serial walk of the
+    Contents API would produce.
+    """
+    listings = {}
+    pending = {executor.submit(github_get_json, contents_url): contents_url}
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            url = pending.pop(future)
+            listings[url] = future.result()
+            for entry in listings[url]:
+                if entry["type"] == "dir":
+                    pending[executor.submit(github_get_json, entry["url"])] = entry["url"]
+
+    def walk(url):
+        for entry in listings[url]:
+            if entry["type"] == "file" and is_allowed_path(entry["path"]):
+                yield entry
+            elif entry["type"] == "dir":
+                yield from walk(entry["url"])
+
+    return list(walk(contents_url))
+
+def git_blob_sha(data):
+    """The SHA-1 Git gives a blob holding data."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def fetch_github_file(file):
+    """Return the <file> block for one listed file, or None if it is binary.
+
+    file["limit"], when present, is the (bytes, skip reason) pair reserved
+    for it; downloads stop once that many bytes have arrived.
+    """
+    size = file.get("size")
+    limit, reason = file.get("limit", (None, None))
+    if reason:
+        return render_skipped(file["path"], size, reason)
+    cache = get_cache()
+    data = cache.get_blob(file["sha"]) if cache and file.get("sha") else None
+    if data is None:
+        with scheduled_get(file["download_url"], headers=github_headers(), timeout=REQUEST_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            if limit is not None and size is not None and size > limit:
+                data = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    data += chunk
+                    if len(data) >= limit:
+                        break
+                data = bytes(data)
+            else:
+                data = response.content
+                # Only complete blobs go in the cache, which is keyed by content hash. The
+                # download follows the branch, which may have moved since the listing.
+                if cache and file.get("sha") and git_blob_sha(data) == file["sha"]:
+                    cache.put_blob(file["sha"], data)
+    if size is None:
+        # Without a listed size the download itself tells how large the file is.
+        size = len(data)
+    if limit is not None:
+        data = data[:limit]
+    return render_file_block(file["path"], data, size, _classifier.sniff_binary)
+
+def fetch_github_file_within(packer, file):
+    """fetch_github_file, or None without a download once packer's budget is spent."""
+    if packer.spent:
+        return packer.skip()
+    return fetch_github_file(file)
+
+MANIFEST_SUFFIX = ".manifest.json"
+# Outputs larger than this are left on disk rather than copied to the clipboard.
+CLIPBOARD_MAX_BYTES = 64 * 1024 * 1024
+
+def load_local_manifest(output_file, local_path):
+    """Load the manifest written next to output_file by a previous incremental run.
+
+    Returns an empty manifest when there is none, it belongs to another
+    folder, or the output file no longer matches it, since the cached
+    <file> blocks are read back out of that output by byte offset.
+    """
+    try:
+        with open(output_file + MANIFEST_SUFFIX, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("root") != os.path.abspath(local_path) or os.path.getsize(output_file) != manifest.get("output_size"):
+            return {}
+    except (OSError, ValueError):
+        return {}
+    return manifest
+
+def save_local_manifest(output_file, manifest):
+    temp_path = f"{output_file}{MANIFEST_SUFFIX}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, output_file + MANIFEST_SUFFIX)
+
+def render_local_file(file_path, relative_path, raw=None, sniff_binary=True, limit=None):
+    """Return the escaped <file> block for one local file, or None if it is binary.
+
+    raw, when given, is the file's complete contents. Either way at most
+    limit bytes of it are kept.
+    """
+    if raw is None:
+        raw, size = read_file_bytes(file_path, limit)
+    else:
+        size = len(raw)
+        raw = raw[:limit] if limit is not None else raw
+    return render_file_block(relative_path, raw, size, sniff_binary)
+
+def process_local_folder(local_path, incremental_output=None, jobs=1, use_ignore_files=True):
+    """Flatten a local folder.
+
+    With incremental_output set to the path the result will be written to,
+    a manifest of each file's mtime, size, content hash and block offset is
+    saved next to it. The next run copies the <file> blocks of unchanged
+    files straight out of the previous output instead of re-reading and
+    re-escaping them. jobs > 1 processes files in that many worker processes.
+    .gitignore/.ignore files are honoured unless use_ignore_files is False.
+    """
+    return '\n'.join(iter_local_folder(local_path, incremental_output, jobs, use_ignore_files))
+
+def iter_local_folder(local_path, incremental_output=None, jobs=1, use_ignore_files=True, packer=None):
+    """Yield the fragments of process_local_folder's document one <file> at a time.
+
+    With jobs > 1, files are read, converted and escaped in a process pool.
+    Blocks are still yielded in walk order, so the output is identical to a
+    serial run. As for PDFs, the pool is only started from the main thread;
+    batch and web app worker threads read files serially. With a
+    TokenPacker, files are read in its rank order instead and not at all
+    once its budget is spent.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        jobs = 1
+    if packer:
+        # The packer rewrites blocks after they leave here, so their offsets cannot be recorded.
+        incremental_output = None
+    manifest = load_local_manifest(incremental_output, local_path) if incremental_output else {}
+    previous_files = manifest.get("files", {})
+    current_files = {}
+    reused = 0
+    limits = new_read_limits()
+
+    header = f'<source type="local_directory" path="{escape_xml(local_path)}">'
+    yield header
+    offset = len(header.encode("utf-8")) + 1
+
+    def plan_files(previous_output, executor):
+        """Yield (relative_path, manifest entry, block or future) for each allowed file."""
+        nonlocal reused
+        files = walk_local_files(local_path, use_ignore_files)
+        if packer:
+            files = packer.rank([(file_path, relative_path, os.stat(file_path)) for file_path, relative_path in files],
+                                lambda file: (file[1].replace(os.sep, "/"), file[2].st_size, file[2].st_mtime))
+        for file_path, relative_path, *stat in files:
+            block = raw = entry = None
+            stat = stat[0] if stat else os.stat(file_path)
+            # Reserved here, in walk (or rank) order, so a total size cap keeps the same files with any --jobs.
+            limit, reason = limits.reserve(stat.st_size)
+            if incremental_output:
+                previous = previous_files.get(relative_path)
+                if previous and previous["mtime_ns"] == stat.st_mtime_ns and previous["size"] == stat.st_size:
+                    digest = previous["sha256"]
+                elif stat.st_size < MMAP_THRESHOLD:
+                    with open(file_path, "rb") as f:
+                        raw = f.read()
+                    digest = hashlib.sha256(raw).hexdigest()
                 else:
-                    with open(temp_file, "r", encoding='utf-8', errors='ignore') as f:
-                        repo_content.append(escape_xml(f.read()))
-                repo_content.append('</file>')
-                os.remove(temp_file)
-
-            elif file["type"] == "dir":
-                process_directory(file["url"], repo_content)
-
-    process_directory(contents_url, repo_content)
-    repo_content.append('</source>')
+                    digest = hash_file(file_path)
+                # A block rendered under different size limits cannot be reused as is.
+                if previous and previous["sha256"] == digest and previous.get("read_bytes") == limit:
+                    previous_output.seek(previous["offset"])
+                    block = previous_output.read(previous["length"]).decode("utf-8")
+                    reused += 1
+                entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest, "read_bytes": limit}
+            if block is None and reason:
+                block = render_skipped(relative_path, stat.st_size, reason)
+            elif block is None and packer and packer.spent:
+                packer.skip()
+            elif block is None:
+                print(f"Processing {file_path}...")
+                if executor:
+                    block = executor.submit(render_local_file, file_path, relative_path, raw, _classifier.sniff_binary, limit)
+                else:
+                    block = render_local_file(file_path, relative_path, raw, _classifier.sniff_binary, limit)
+            yield relative_path, entry, block
+
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    with open(incremental_output, "rb") if previous_files else nullcontext() as previous_output, executor or nullcontext():
+        in_flight = deque()
+        planned = plan_files(previous_output, executor)
+        while True:
+            # Keep a bounded number of files queued ahead so memory stays flat.
+            for job in planned:
+                in_flight.append(job)
+                if len(in_flight) >= jobs * 2:
+                    break
+            if not in_flight:
+                break
+            relative_path, entry, block = in_flight.popleft()
+            if isinstance(block, Future):
+                block = block.result()
+            if block is None:
+                continue
+            yield block
+
+            length = len(block.encode("utf-8"))
+            if entry is not None:
+                current_files[relative_path] = dict(entry, offset=offset, length=length)
+            offset += length + 1
+
+    yield '</source>'
+    if incremental_output:
+        print(f"Reused {reused} unchanged files from the previous run.")
+        save_local_manifest(incremental_output, {
+            "root": os.path.abspath(local_path),
+            "output_size": offset + len('</source>'),
+            "files": current_files,
+        })
     print("All files processed.")
 
-    return "\n".join(repo_content)
-
-def process_local_folder(local_path):
-    def process_local_directory(local_path):
-        content = [f'<source type="local_directory" path="{escape_xml(local_path)}">']
-        for root, dirs, files in os.walk(local_path):
-            for file in files:
-                if is_allowed_filetype(file):
-                    print(f"Processing {os.path.join(root, file)}...")
-
-                    file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(file_path, local_path)
-                    content.append(f'<file name="{escape_xml(relative_path)}">')
-
-                    if file.endswith(".ipynb"):
-                        content.append(escape_xml(process_ipynb_file(file_path)))
-                    else:
-                        with open(file_path, "r", encoding='utf-8', errors='ignore') as f:
-                            content.append(escape_xml(f.read()))
-
-                    content.append('</file>')
-
-        content.append('</source>')
-        return '\n'.join(content)
-
-    formatted_content = process_local_directory(local_path)
-    print("All files processed.")
-    return formatted_content
+# Pages handed to each worker process, and the smallest PDF worth a process pool.
+PDF_PAGES_PER_TASK = 16
+PDF_PARALLEL_MIN_PAGES = 48
+
+# PDFium is not thread-safe, even across separate documents, so only one thread calls it at a time.
+_pdfium_lock = threading.Lock()
+
+def _open_pdf(data, backend):
+    if backend == "pypdfium2":
+        return pdfium.PdfDocument(data)
+    if backend == "pdfminer":
+        return data
+    return PyPDF2.PdfReader(io.BytesIO(data))
+
+def _close_pdf(document, backend):
+    if backend == "pypdfium2":
+        document.close()
+
+def _pdf_page_count(document, backend):
+    if backend == "pdfminer":
+        return sum(1 for _ in pdfminer_pdfpage.PDFPage.get_pages(io.BytesIO(document)))
+    if backend == "pypdfium2":
+        return len(document)
+    return len(document.pages)
+
+def _pdf_page_texts(document, backend, start, stop):
+    if backend == "pdfminer":
+        return [pdfminer_high_level.extract_text(io.BytesIO(document), page_numbers=range(start, stop)).strip("\x0c")]
+    if backend == "pypdfium2":
+        return [document[i].get_textpage().get_text_range() for i in range(start, stop)]
+    return [document.pages[i].extract_text() for i in range(start, stop)]
+
+# Each process-pool worker opens the PDF once, then extracts the page ranges it is sent.
+_pdf_worker_document = None
+
+def _init_pdf_worker(data, backend):
+    global _pdf_worker_document
+    _pdf_worker_document = (_open_pdf(data, backend), backend)
+
+def _extract_pdf_range(start, stop):
+    document, backend = _pdf_worker_document
+    return _pdf_page_texts(document, backend, start, stop)
+
+# Backends in order of preference; pypdf2 is always installed.
+PDF_BACKENDS = ("pypdfium2", "pdfminer", "pypdf2")
+
+def available_pdf_backends():
+    return [name for name in PDF_BACKENDS
+            if not (name == "pypdfium2" and not module_available("pypdfium2")) and not (name == "pdfminer" and not module_available("pdfminer"))]
+
+_pdf_options = {"max_pages": None, "jobs": None, "backend": None}
+
+def configure_pdf(max_pages=None, jobs=None, backend="auto"):
+    """Set the page budget, worker count and backend used for every PDF."""
+    available = available_pdf_backends()
+    if backend == "auto":
+        backend = available[0]
+    elif backend not in available:
+        raise ValueError(f"PDF backend {backend!r} is not available; choose from {', '.join(available)}")
+    _pdf_options.update(max_pages=max_pages, jobs=jobs, backend=backend)
+
+def extract_pdf_text(data, max_pages=None, jobs=None, backend=None):
+    """Return the text of a PDF held in memory, with pages joined by spaces.
+
+    Only the first max_pages pages are read. Large documents are split into
+    page ranges that are extracted in jobs worker processes (default: one
+    per CPU). That is only done on the main thread: PDFs met by crawl,
+    batch or web app worker threads are read serially, since forking a
+    pool per PDF from many threads at once oversubscribes the CPUs and can
+    deadlock on locks held by other threads. In this process, pypdfium2 is
+    only used under a lock, as PDFium is not thread-safe. Arguments left as
+    None use the configure_pdf() settings.
+    """
+    max_pages = max_pages or _pdf_options["max_pages"]
+    jobs = jobs or _pdf_options["jobs"] or os.cpu_count() or 1
+    backend = backend or _pdf_options["backend"] or available_pdf_backends()[0]
+
+    with _pdfium_lock if backend == "pypdfium2" else nullcontext():
+        document = _open_pdf(data, backend)
+        try:
+            page_count = _pdf_page_count(document, backend)
+            if max_pages:
+                page_count = min(page_count, max_pages)
+            starts = range(0, page_count, PDF_PAGES_PER_TASK)
+            stops = [min(start + PDF_PAGES_PER_TASK, page_count) for start in starts]
+            parallel = jobs > 1 and page_count >= PDF_PARALLEL_MIN_PAGES and threading.current_thread() is threading.main_thread()
+            if not parallel:
+                ranges = [_pdf_page_texts(document, backend, start, stop) for start, stop in zip(starts, stops)]
+        finally:
+            _close_pdf(document, backend)
+
+    if parallel:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(starts)), initializer=_init_pdf_worker,
+                                 initargs=(data, backend)) as executor:
+            ranges = list(executor.map(_extract_pdf_range, starts, stops))
+    return ' '.join(text for texts in ranges for text in texts)
 
 def process_arxiv_pdf(arxiv_abs_url):
     pdf_url = arxiv_abs_url.replace("/abs/", "/pdf/") + ".pdf"
-    response = requests.get(pdf_url)
-    pdf_content = response.content
-
-    with open('temp.pdf', 'wb') as pdf_file:
-        pdf_file.write(pdf_content)
-
-    text = []
-    with open('temp.pdf', 'rb') as pdf_file:
-        pdf_reader = PdfReader(pdf_file)
-        for page in range(len(pdf_reader.pages)):
-            text.append(pdf_reader.pages[page].extract_text())
+    response = cached_get(pdf_url)
 
     formatted_text = f'<source type="arxiv_paper" url="{arxiv_abs_url}">\n'
     formatted_text += '<paper>\n'
-    formatted_text += escape_xml(' '.join(text))
+    formatted_text += escape_xml(extract_pdf_text(response.content))
     formatted_text += '\n</paper>\n'
     formatted_text += '</source>'
 
-    os.remove('temp.pdf')
     print("ArXiv paper processed successfully.")
 
     return formatted_text
@@ -242,8 +1473,8 @@ def fetch_youtube_transcript(url):
         return f'<source type="youtube_transcript" url="{escape_xml(url)}">\n<error>Could not extract video ID from URL.</error>\n</source>'
 
     try:
-        transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
-        formatter = TextFormatter()
+        transcript_list = youtube_transcript_api.YouTubeTranscriptApi.get_transcript(video_id)
+        formatter = youtube_transcript_formatters.TextFormatter()
         transcript = formatter.format_transcript(transcript_list)
         
         formatted_text = f'<source type="youtube_transcript" url="{escape_xml(url)}">\n'
@@ -256,57 +1487,574 @@ def fetch_youtube_transcript(url):
     except Exception as e:
         return f'<source type="youtube_transcript" url="{escape_xml(url)}">\n<error>{escape_xml(str(e))}</error>\n</source>'
 
-def preprocess_text(input_file, output_file):
-    with open(input_file, "r", encoding="utf-8") as input_file:
-        input_text = input_file.read()
-
-    def process_text(text):
-        text = re.sub(r"[\n\r]+", "\n", text)
-        # Update the following line to include apostrophes and quotation marks
-        text = re.sub(r"[^a-zA-Z0-9\s_.,!?:;@#$%^&*()+\-=[\]{}|\\<>`~'\"/]+", "", text)
-        text = re.sub(r"\s+", " ", text)
-        text = text.lower()
-        words = text.split()
-        words = [word for word in words if word not in stop_words]
-        return " ".join(words)
+# Characters dropped from compressed text; everything else is kept.
+COMPRESS_DROP_PATTERN = re.compile(r"[^a-zA-Z0-9\s_.,!?:;@#$%^&*()+\-=[\]{}|\\<>`~'\"/]+")
+COMPRESS_TAG_PATTERN = re.compile(r"<[/?!]?[A-Za-z_][^<>]*>")
+XML_ENTITY_PATTERN = re.compile(r"&(lt|gt|amp|quot|apos|#[0-9]+|#x[0-9a-fA-F]+);")
+XML_ENTITIES = {"lt": "<", "gt": ">", "amp": "&", "quot": '"', "apos": "'"}
+COMPRESS_CHUNK_CHARS = 1024 * 1024
+COMPRESSED_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
+
+def unescape_xml(text):
+    def replace(match):
+        entity = match.group(1)
+        if entity.startswith("#x"):
+            return chr(int(entity[2:], 16))
+        if entity.startswith("#"):
+            return chr(int(entity[1:]))
+        return XML_ENTITIES[entity]
+    return XML_ENTITY_PATTERN.sub(replace, text) if "&" in text else text
+
+def compress_words(text):
+    """The compressed words of one piece of text: filtered, lowercased, stop words removed."""
+    return [word for word in COMPRESS_DROP_PATTERN.sub("", text).lower().split() if word not in stop_words]
+
+class TextCompressor:
+    """Incrementally compresses an XML document fed to it in arbitrary chunks.
+
+    Tags are copied through unchanged. The text between two tags is
+    compressed as one piece, exactly as if it had been read whole; text is
+    only held back from the end of a chunk up to its last whitespace or
+    unfinished tag.
+    """
+
+    def __init__(self, write):
+        self.write = write
+        self._buffer = ""
+        self._mid_text = False
+
+    def feed(self, chunk):
+        buffer = self._buffer + chunk
+        position = 0
+        for match in COMPRESS_TAG_PATTERN.finditer(buffer):
+            self._text(buffer[position:match.start()], final=True)
+            self.write(match.group())
+            position = match.end()
+        # Keep any unfinished tag, and the last (possibly partial) word before it.
+        rest = buffer[position:]
+        tag_start = rest.rfind("<")
+        safe = rest if tag_start < 0 else rest[:tag_start]
+        cut = max(safe.rfind(" "), safe.rfind("\n"), safe.rfind("\t"))
+        if cut > 0:
+            self._text(rest[:cut], final=False)
+            rest = rest[cut:]
+        self._buffer = rest
+
+    def close(self):
+        self._text(self._buffer, final=True)
+        self._buffer = ""
+
+    def _text(self, text, final):
+        words = compress_words(unescape_xml(text))
+        if words:
+            self.write((" " if self._mid_text else "") + escape_xml(" ".join(words)))
+            self._mid_text = True
+        if final:
+            self._mid_text = False
 
-    try:
-        # Try to parse the input as XML
-        root = ET.fromstring(input_text)
-
-        # Process text content while preserving XML structure
-        for elem in root.iter():
-            if elem.text:
-                elem.text = process_text(elem.text)
-            if elem.tail:
-                elem.tail = process_text(elem.tail)
-
-        # Write the processed XML to the output file
-        tree = ET.ElementTree(root)
-        tree.write(output_file, encoding="utf-8", xml_declaration=True)
-        print("Text preprocessing completed with XML structure preserved.")
-    except ET.ParseError:
-        # If XML parsing fails, process the text without preserving XML structure
-        processed_text = process_text(input_text)
-        with open(output_file, "w", encoding="utf-8") as out_file:
-            out_file.write(processed_text)
-        print("XML parsing failed. Text preprocessing completed without XML structure.")
-
-def get_token_count(text, disallowed_special=[], chunk_size=1000):
-    enc = tiktoken.get_encoding("cl100k_base")
-
-    # Remove XML tags
-    text_without_tags = re.sub(r'<[^>]+>', '', text)
-
-    # Split the text into smaller chunks
-    chunks = [text_without_tags[i:i+chunk_size] for i in range(0, len(text_without_tags), chunk_size)]
-    total_tokens = 0
-
-    for chunk in chunks:
-        tokens = enc.encode(chunk, disallowed_special=disallowed_special)
-        total_tokens += len(tokens)
-    
-    return total_tokens
+def preprocess_text(input_file, output_file):
+    """Write a compressed copy of input_file to output_file.
+
+    Text outside tags is lowercased, stripped of unusual characters, stop
+    words and extra whitespace, while the tags themselves are kept. The
+    input is streamed through a TextCompressor a chunk at a time, so memory
+    use does not depend on its size.
+    """
+    with open(input_file, "r", encoding="utf-8") as source, open(output_file, "w", encoding="utf-8") as out_file:
+        out_file.write(COMPRESSED_DECLARATION)
+        compressor = TextCompressor(out_file.write)
+        for chunk in iter(partial(source.read, COMPRESS_CHUNK_CHARS), ""):
+            compressor.feed(chunk)
+        compressor.close()
+    print("Text preprocessing completed with XML structure preserved.")
+
+TOKEN_ENCODING = "cl100k_base"
+# Text is encoded in pieces of about this many characters, split at whitespace.
+TOKEN_CHUNK_CHARS = 64 * 1024
+# Inputs longer than this are encoded on several threads.
+PARALLEL_TOKEN_CHARS = 1024 * 1024
+# How many of the largest files or pages main() lists after the totals.
+TOKEN_REPORT_LIMIT = 10
+TAG_PATTERN = re.compile(r'<[^>]+>')
+ITEM_TAG_PATTERN = re.compile(r'\s*<(?:file name|page url)="([^"]*)">')
+# The last newline of a whitespace run, after which the tokenizer always breaks.
+LINE_BREAK_PATTERN = re.compile(r"\n(?=[^\S\r\n]*\S)")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def get_encoding():
+    """The tiktoken encoding used for token counts, loaded once per process."""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+    return _encoding
+
+def split_token_chunks(text, chunk_size=TOKEN_CHUNK_CHARS):
+    """Yield pieces of text of about chunk_size characters.
+
+    Pieces break only where the tokenizer's pre-splitting always breaks too:
+    after the last newline of a whitespace run, or before whitespace that
+    follows a letter or digit. Punctuation takes the newlines after it into
+    its own token, so a piece never ends right after punctuation. The tokens
+    of the pieces then add up to the tokens of the whole text; only a run of
+    chunk_size characters with no such break is cut mid-word.
+    """
+    start, length = 0, len(text)
+    while length - start > chunk_size:
+        end = cut = start + chunk_size
+        while True:
+            cut = max(text.rfind(" ", start + 1, cut), text.rfind("\n", start + 1, cut))
+            if cut < 0:
+                cut = end
+                break
+            if text[cut - 1].isalnum():
+                break
+            if LINE_BREAK_PATTERN.match(text, cut):
+                cut += 1
+                break
+        yield text[start:cut]
+        start = cut
+    if start < length:
+        yield text[start:]
+
+def get_token_count(text, disallowed_special=[], chunk_size=TOKEN_CHUNK_CHARS):
+    """Count the tokens in text, ignoring XML tags."""
+    enc = get_encoding()
+    chunks = list(split_token_chunks(TAG_PATTERN.sub('', text), chunk_size))
+    if disallowed_special:
+        return sum(len(tokens) for tokens in enc.encode_batch(chunks, disallowed_special=disallowed_special))
+    if len(text) > PARALLEL_TOKEN_CHARS:
+        return sum(len(tokens) for tokens in enc.encode_ordinary_batch(chunks, num_threads=os.cpu_count() or 1))
+    return sum(len(enc.encode_ordinary(chunk)) for chunk in chunks)
+
+class TokenCounter:
+    """Output consumer that keeps a running token count of everything fed to it.
+
+    Counts for each <file> and <page> fragment are kept in items, keyed by
+    file name or page URL.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.items = {}
+
+    def feed(self, text):
+        count = get_token_count(text)
+        self.total += count
+        match = ITEM_TAG_PATTERN.match(text)
+        if match:
+            name = match.group(1)
+            self.items[name] = self.items.get(name, 0) + count
+
+    def largest(self, limit=10):
+        """The limit items with the most tokens, as (name, count) pairs."""
+        return heapq.nlargest(limit, self.items.items(), key=lambda item: item[1])
+
+    def close(self):
+        pass
+
+class OutputWriter:
+    """Streams document fragments to a file, and to any consumers, in one pass.
+
+    Fragments are joined with newlines exactly as "\\n".join would, so the
+    file matches what the process_* functions return. The file is written
+    under a temporary name and moved into place on close, which leaves the
+    previous output readable while it is being replaced.
+    """
+
+    def __init__(self, path, consumers=()):
+        self.path = path
+        self.consumers = list(consumers)
+        self.bytes_written = 0
+        self._temp_path = f"{path}.tmp"
+        self._file = open(self._temp_path, "w", encoding="utf-8", newline="")
+        self._first = True
+
+    def write(self, fragment):
+        if not self._first:
+            fragment = "\n" + fragment
+        self._first = False
+        self._file.write(fragment)
+        self.bytes_written += len(fragment.encode("utf-8"))
+        for consumer in self.consumers:
+            consumer.feed(fragment)
+
+    def close(self):
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+        for consumer in self.consumers:
+            consumer.close()
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._temp_path)
+        for consumer in self.consumers:
+            if hasattr(consumer, "abort"):
+                consumer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class CompressedOutputWriter(TextCompressor):
+    """Output consumer that writes the same compressed copy as preprocess_text, in the same pass as the output.
+
+    Like OutputWriter, the file is written under a temporary name and moved
+    into place on close, and the compressed text is fed on to consumers,
+    such as a TokenCounter, as it is written.
+    """
+
+    def __init__(self, path, consumers=()):
+        self._pending = []
+        super().__init__(self._pending.append)
+        self.path = path
+        self.consumers = list(consumers)
+        self._temp_path = f"{path}.tmp"
+        self._file = open(self._temp_path, "w", encoding="utf-8")
+        self._file.write(COMPRESSED_DECLARATION)
+
+    def feed(self, fragment):
+        super().feed(fragment)
+        self._flush()
+
+    def _flush(self):
+        text = "".join(self._pending)
+        self._pending.clear()
+        if text:
+            self._file.write(text)
+            for consumer in self.consumers:
+                consumer.feed(text)
+
+    def close(self):
+        super().close()
+        self._flush()
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+        for consumer in self.consumers:
+            consumer.close()
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._temp_path)
+        for consumer in self.consumers:
+            if hasattr(consumer, "abort"):
+                consumer.abort()
+
+DEFAULT_CHUNK_DIR = "chunks"
+DEFAULT_SHARD_RECORDS = 1000
+# Cut points for chunk text, like LINE_BREAK_PATTERN after the last newline of a run, so token counts add up.
+PARAGRAPH_BREAK_PATTERN = re.compile(r"\n[^\S\n]*\n(?=[^\S\r\n]*\S)")
+SOURCE_TAG_PATTERN = re.compile(r'\s*<source ([^>]*)>')
+NESTED_ITEM_PATTERN = re.compile(r'<(?:file name|page url)="([^"]*)">.*?</(?:file|page)>', re.S)
+ATTRIBUTE_PATTERN = re.compile(r'(\w+)="([^"]*)"')
+SHARD_NAME_PATTERN = re.compile(r"chunks-\d{5,}\.jsonl(\.tmp)?")
+
+def split_after(text, pattern):
+    """Yield the pieces of text cut at the end of every match of pattern."""
+    start = 0
+    for match in pattern.finditer(text):
+        if match.end() > start:
+            yield text[start:match.end()]
+            start = match.end()
+    if start < len(text):
+        yield text[start:]
+
+class ChunkWriter(TokenCounter):
+    """Output consumer that also writes each file, page or document as token-bounded chunks in JSONL shards."""
+
+    def __init__(self, directory=DEFAULT_CHUNK_DIR, max_tokens=512, overlap=0, shard_records=DEFAULT_SHARD_RECORDS):
+        super().__init__()
+        if overlap >= max_tokens:
+            raise ValueError("overlap must be smaller than max_tokens")
+        self.directory = directory
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.shard_records = shard_records
+        self.records = 0
+        self.shards = []
+        self._source = {}
+        self._shard = None
+        self._shard_path = None
+        self._shard_count = 0
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if SHARD_NAME_PATTERN.fullmatch(name):
+                os.remove(os.path.join(directory, name))
+
+    def _encode(self, pieces):
+        enc = get_encoding()
+        if sum(len(piece) for piece in pieces) > PARALLEL_TOKEN_CHARS:
+            return [len(tokens) for tokens in enc.encode_ordinary_batch(pieces, num_threads=os.cpu_count() or 1)]
+        return [len(enc.encode_ordinary(piece)) for piece in pieces]
+
+    def _units(self, text):
+        """(piece, tokens) pairs that join up to text, none over max_tokens unless it cannot be cut."""
+        paragraphs = list(split_after(text, PARAGRAPH_BREAK_PATTERN))
+        for paragraph, count in zip(paragraphs, self._encode(paragraphs)):
+            if count <= self.max_tokens:
+                yield paragraph, count
+                continue
+            lines = list(split_after(paragraph, LINE_BREAK_PATTERN))
+            for line, line_count in zip(lines, self._encode(lines)):
+                if line_count <= self.max_tokens:
+                    yield line, line_count
+                    continue
+                enc = get_encoding()
+                tokens = enc.encode_ordinary(line)
+                for start in range(0, len(tokens), self.max_tokens):
+                    piece = tokens[start:start + self.max_tokens]
+                    yield enc.decode(piece), len(piece)
+
+    def feed(self, text):
+        source = SOURCE_TAG_PATTERN.match(text)
+        if source:
+            self._source = dict(ATTRIBUTE_PATTERN.findall(source.group(1)))
+        match = ITEM_TAG_PATTERN.match(text)
+        if match:
+            units = self._count(text)
+            name = match.group(1)
+            self.items[name] = self.items.get(name, 0) + sum(tokens for _, tokens in units)
+            self._write_chunks(units, unescape_xml(name))
+        elif source and text.rstrip().endswith("</source>"):
+            # A whole document in one fragment.
+            nested = list(NESTED_ITEM_PATTERN.finditer(text))
+            if not nested:
+                self._write_chunks(self._count(text), None)
+                return
+            # Counted whole, so the total matches a TokenCounter's, then chunked file by file.
+            self._count(text)
+            self._write_chunks(list(self._units(TAG_PATTERN.sub('', NESTED_ITEM_PATTERN.sub('', text)))), None)
+            for block in nested:
+                self._write_chunks(list(self._units(TAG_PATTERN.sub('', block.group(0)))), unescape_xml(block.group(1)))
+        else:
+            self._count(text)
+
+    def _count(self, text):
+        units = list(self._units(TAG_PATTERN.sub('', text)))
+        self.total += sum(tokens for _, tokens in units)
+        return units
+
+    def _write_chunks(self, units, path):
+        chunk, chunk_tokens, index = [], 0, 0
+        for unit in units:
+            if chunk and chunk_tokens + unit[1] > self.max_tokens:
+                self._write_record(chunk, chunk_tokens, path, index)
+                index += 1
+                kept, kept_tokens = [], 0
+                for previous in reversed(chunk):
+                    if kept_tokens + previous[1] > self.overlap or kept_tokens + previous[1] + unit[1] > self.max_tokens:
+                        break
+                    kept.insert(0, previous)
+                    kept_tokens += previous[1]
+                chunk, chunk_tokens = kept, kept_tokens
+            chunk.append(unit)
+            chunk_tokens += unit[1]
+        if "".join(piece for piece, _ in chunk).strip():
+            self._write_record(chunk, chunk_tokens, path, index)
+
+    def _write_record(self, chunk, tokens, path, index):
+        if self._shard is None:
+            self._shard_path = os.path.join(self.directory, f"chunks-{self._shard_count:05}.jsonl")
+            self._shard = open(f"{self._shard_path}.tmp", "w", encoding="utf-8")
+            self._shard_count += 1
+        record = {
+            "id": self.records,
+            "source_type": self._source.get("type"),
+            "source": self._source.get("url", self._source.get("path")),
+            "path": path,
+            "chunk": index,
+            "tokens": tokens,
+            "text": unescape_xml("".join(piece for piece, _ in chunk).strip()),
+        }
+        self._shard.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.records += 1
+        if self.records % self.shard_records == 0:
+            self._finish_shard()
+
+    def _finish_shard(self):
+        self._shard.close()
+        os.replace(f"{self._shard_path}.tmp", self._shard_path)
+        self.shards.append(self._shard_path)
+        self._shard = None
+
+    def close(self):
+        if self._shard is not None:
+            self._finish_shard()
+
+    def abort(self):
+        if self._shard is not None:
+            self._shard.close()
+            os.remove(f"{self._shard_path}.tmp")
+            self._shard = None
+
+# README files and these names are where a reader starts on a project, so packing takes them first.
+ENTRY_POINT_NAMES = frozenset({
+    "main.py", "__main__.py", "app.py", "cli.py", "setup.py", "pyproject.toml", "package.json",
+    "index.js", "index.ts", "main.js", "main.ts", "main.go", "main.rs", "lib.rs", "cargo.toml", "go.mod",
+})
+PACK_ORDERS = ("listing", "size", "recency")
+# Fewer tokens than this left in a budget are not worth a cut-off file; packing stops there.
+MIN_PACKED_TOKENS = 64
+# Tokens held back from items for the newlines before the closing tags that follow them.
+PACK_CLOSING_TOKENS = 4
+
+def truncate_item(block, max_tokens):
+    """Cut a <file> or <page> block to its first max_tokens tokens of content.
+
+    The content is followed by a <truncated tokens=.../> marker giving the
+    full and kept token counts, as <truncated bytes=.../> does for files cut
+    by size.
+    """
+    match = ITEM_TAG_PATTERN.match(block)
+    tag = "file" if "<file" in match.group(0) else "page"
+    content = TAG_PATTERN.sub('', block[match.end():block.rindex(f"</{tag}>")]).strip("\n")
+    enc = get_encoding()
+    kept, total = [], 0
+    for chunk in split_token_chunks(content):
+        tokens = enc.encode_ordinary(chunk)
+        if total < max_tokens:
+            kept.append(chunk if total + len(tokens) <= max_tokens else enc.decode(tokens[:max_tokens - total]))
+        total += len(tokens)
+    # A cut may land inside an escaped character such as &amp;.
+    text = re.sub(r"&[#\w]*$", "", "".join(kept))
+    return f'{block[:match.end()]}\n{text}\n<truncated tokens="{total}" kept_tokens="{min(total, max_tokens)}"/>\n</{tag}>'
+
+def truncate_document(document, max_tokens):
+    """Cut a whole-document fragment, such as a pull request, to its first max_tokens tokens of text.
+
+    Tags before the cut are kept, a <truncated tokens=.../> marker follows
+    it, and the elements still open there are closed, so the result stays
+    well-formed. A document within max_tokens is returned unchanged.
+    """
+    enc = get_encoding()
+    pieces, open_tags = [], []
+    kept = total = 0
+    cut = False
+    for index, piece in enumerate(re.split(r'(<[^>]+>)', document)):
+        if index % 2:
+            if cut:
+                continue
+            if piece.startswith("</"):
+                if open_tags:
+                    open_tags.pop()
+            elif not piece.endswith("/>") and not piece.startswith(("<?", "<!")):
+                open_tags.append(re.match(r"<([^\s>/]+)", piece).group(1))
+            pieces.append(piece)
+            continue
+        tokens = enc.encode_ordinary(piece)
+        total += len(tokens)
+        if cut:
+            continue
+        if kept + len(tokens) > max_tokens:
+            pieces.append(re.sub(r"&[#\w]*$", "", enc.decode(tokens[:max_tokens - kept])))
+            kept, cut = max_tokens, True
+        else:
+            pieces.append(piece)
+            kept += len(tokens)
+    if not cut:
+        return document
+    closing = "\n".join(f"</{tag}>" for tag in reversed(open_tags))
+    return f'{"".join(pieces)}\n<truncated tokens="{total}" kept_tokens="{kept}"/>\n{closing}'
+
+class TokenPacker:
+    """Fits one output into max_tokens tokens, ranking listings before they are fetched and cutting what does not fit."""
+
+    def __init__(self, max_tokens, priority=(), order="listing"):
+        if order not in PACK_ORDERS:
+            raise ValueError(f"order must be one of {', '.join(PACK_ORDERS)}")
+        self.max_tokens = max_tokens
+        self.priority = [IgnoreMatcher.from_patterns([pattern]) for pattern in priority or ()]
+        self.order = order
+        self.used_tokens = 0
+        self.truncated = 0
+        self.skipped = 0
+        self._reported = 0
+        self._lock = threading.Lock()
+
+    @property
+    def spent(self):
+        return self.max_tokens - self.used_tokens - PACK_CLOSING_TOKENS < MIN_PACKED_TOKENS
+
+    def rank_key(self, path, size=None, mtime=None):
+        """Sort key for a file at the '/'-separated path, of size bytes, modified at mtime."""
+        pattern = next((index for index, matcher in enumerate(self.priority) if matcher.is_excluded(path)), len(self.priority))
+        name = path.rsplit("/", 1)[-1].lower()
+        entry_point = name.startswith("readme") or name in ENTRY_POINT_NAMES
+        if self.order == "size":
+            secondary = size if size is not None else float("inf")
+        elif self.order == "recency":
+            secondary = -(mtime or 0)
+        else:
+            secondary = 0
+        return (pattern, not entry_point, path.count("/") if entry_point else 0, secondary)
+
+    def with_budget(self, max_tokens):
+        """A new packer that ranks like this one, for max_tokens tokens."""
+        packer = TokenPacker(max_tokens, order=self.order)
+        packer.priority = self.priority
+        return packer
+
+    def rank(self, entries, describe):
+        """entries sorted by rank_key(*describe(entry)); ties keep their listing order."""
+        keys = {id(entry): self.rank_key(*describe(entry)) for entry in entries}
+        return sorted(entries, key=lambda entry: keys[id(entry)])
+
+    def pack(self, fragments):
+        """Yield fragments, with items cut or skipped to stay within max_tokens.
+
+        Counts include the newline each fragment is joined to the output with.
+        """
+        separator = ""
+        for fragment in fragments:
+            match = ITEM_TAG_PATTERN.match(fragment)
+            if match and self.spent:
+                self.skip()
+                continue
+            if not match and self.skipped > self._reported:
+                marker = self._skipped_marker()
+                self.used_tokens += get_token_count(separator + marker)
+                yield marker
+            count = get_token_count(separator + fragment)
+            remaining = self.max_tokens - self.used_tokens - PACK_CLOSING_TOKENS
+            document = not match and fragment.lstrip().startswith("<source") and fragment.rstrip().endswith("</source>")
+            if (match or document) and count > remaining:
+                # The newlines around the cut content take a token or two of their own.
+                truncate = truncate_item if match else truncate_document
+                kept = max(0, remaining)
+                while True:
+                    cut = truncate(fragment, kept)
+                    count = get_token_count(separator + cut)
+                    if count <= remaining or kept == 0:
+                        break
+                    kept = max(0, kept - (count - remaining))
+                fragment = cut
+                self.truncated += 1
+            self.used_tokens += count
+            separator = "\n"
+            yield fragment
+        if self.skipped > self._reported:
+            yield self._skipped_marker()
+        print(f"Packed {self.used_tokens} of {self.max_tokens} tokens; {self.truncated} items cut off, {self.skipped} skipped.")
+
+    def skip(self):
+        """Count an item left out because the budget is spent. Returns None, which sources drop like a binary file."""
+        with self._lock:
+            self.skipped += 1
+
+    def _skipped_marker(self):
+        count, self._reported = self.skipped - self._reported, self.skipped
+        return f'<skipped items="{count}" reason="token budget"/>'
+
+# Default politeness limit for web crawls, in requests per second per host.
+DEFAULT_CRAWL_RATE = 10
 
 def is_same_domain(base_url, new_url):
     return urlparse(base_url).netloc == urlparse(new_url).netloc
@@ -321,72 +2069,319 @@ def is_within_depth(base_url, current_url, max_depth):
     return len(current_parts) - len(base_parts) <= max_depth
 
 def process_pdf(url):
-    response = requests.get(url)
-    response.raise_for_status()
-
-    with open('temp.pdf', 'wb') as pdf_file:
-        pdf_file.write(response.content)
-
-    text = []
-    with open('temp.pdf', 'rb') as pdf_file:
-        pdf_reader = PdfReader(pdf_file)
-        for page in range(len(pdf_reader.pages)):
-            text.append(pdf_reader.pages[page].extract_text())
-
-    os.remove('temp.pdf')
-    return ' '.join(text)
-
-def crawl_and_extract_text(base_url, max_depth, include_pdfs, ignore_epubs):
-    visited_urls = set()
-    urls_to_visit = [(base_url, 0)]
+    return extract_pdf_text(cached_get(url).content)
+
+# Elements whose text is left out of crawled pages.
+SKIPPED_HTML_ELEMENTS = ['script', 'style', 'head', 'title', 'meta']
+
+class _TextAndLinkParser(HTMLParser):
+    """Collects the visible text and the <a href> values of a page in one pass."""
+
+    # meta is a void element, so it never has text to skip.
+    SKIPPED = frozenset(SKIPPED_HTML_ELEMENTS) - {'meta'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.links = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href is not None:
+                self.links.append(href)
+        if tag in self.SKIPPED:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            data = data.strip()
+            if data:
+                self.parts.append(data)
+
+def extract_html_stdlib(data, encoding=None):
+    parser = _TextAndLinkParser()
+    parser.feed(data.decode(encoding or detect_encoding(data[:ENCODING_SNIFF_BYTES]), errors='replace'))
+    parser.close()
+    return '\n'.join(parser.parts), parser.links
+
+def extract_html_bs4(data, encoding=None):
+    soup = bs4.BeautifulSoup(data, 'html.parser', from_encoding=encoding)
+    links = [link['href'] for link in soup.find_all('a', href=True)]
+    for element in soup(SKIPPED_HTML_ELEMENTS):
+        element.decompose()
+    for comment in soup.find_all(string=lambda text: isinstance(text, bs4.Comment)):
+        comment.extract()
+    return soup.get_text(separator='\n', strip=True), links
+
+def extract_html_lxml(data, encoding=None):
+    parser = lxml_html.HTMLParser(encoding=encoding) if encoding else None
+    document = lxml_html.document_fromstring(data, parser=parser)
+    links = document.xpath('//a/@href')
+    lxml_etree.strip_elements(document, lxml_etree.Comment, *SKIPPED_HTML_ELEMENTS, with_tail=False)
+    parts = (text.strip() for text in document.itertext())
+    return '\n'.join(part for part in parts if part), [str(link) for link in links]
+
+def extract_html_selectolax(data, encoding=None):
+    tree = selectolax_parser.HTMLParser(data.decode(encoding, errors='replace') if encoding else data)
+    links = [node.attributes['href'] for node in tree.css('a[href]') if node.attributes.get('href') is not None]
+    tree.strip_tags(SKIPPED_HTML_ELEMENTS)
+    root = tree.root
+    return (root.text(separator='\n', strip=True) if root else ''), links
+
+# Each extractor turns an HTML body into (visible text, raw href values)
+# from a single parse. "auto" picks the fastest one installed.
+HTML_EXTRACTORS = {
+    "selectolax": extract_html_selectolax,
+    "lxml": extract_html_lxml,
+    "stdlib": extract_html_stdlib,
+    "bs4": extract_html_bs4,
+}
+
+def available_html_extractors():
+    return [name for name in HTML_EXTRACTORS
+            if not (name == "selectolax" and not module_available("selectolax")) and not (name == "lxml" and not module_available("lxml"))]
+
+_html_extractor = None
+
+def configure_html_extractor(name="auto"):
+    """Select the HTML extractor used by web crawls."""
+    global _html_extractor
+    available = available_html_extractors()
+    if name == "auto":
+        name = available[0]
+    elif name not in available:
+        raise ValueError(f"HTML extractor {name!r} is not available; choose from {', '.join(available)}")
+    _html_extractor = HTML_EXTRACTORS[name]
+
+def extract_html(data, encoding=None):
+    if _html_extractor is None:
+        configure_html_extractor()
+    return _html_extractor(data, encoding)
+
+def sniff_content_type(content_type, data):
+    """Classify a fetched body as "html", "pdf" or "text" from its Content-Type and first bytes.
+
+    Returns None for anything else, e.g. images or archives.
+    """
+    mime = content_type.split(';')[0].strip().lower()
+    if mime == 'application/pdf' or data.startswith(b'%PDF-'):
+        return 'pdf'
+    if mime in ('text/html', 'application/xhtml+xml'):
+        return 'html'
+    if mime.startswith('text/'):
+        return 'text'
+    if mime in ('', 'application/octet-stream'):
+        prefix = data[:1024].lstrip().lower()
+        if prefix.startswith((b'<!doctype html', b'<html')) or b'<body' in prefix:
+            return 'html'
+        if not is_binary_content(data):
+            return 'text'
+    return None
+
+def crawl_and_extract_text(base_url, max_depth, include_pdfs, ignore_epubs, max_workers=None, rate_limit=DEFAULT_CRAWL_RATE,
+                           plan="auto"):
     processed_urls = []
-    all_text = [f'<source type="web_documentation" url="{escape_xml(base_url)}">']
+    formatted_content = '\n'.join(iter_crawled_pages(base_url, max_depth, include_pdfs, ignore_epubs, processed_urls,
+                                                      max_workers, rate_limit, plan))
 
-    while urls_to_visit:
-        current_url, current_depth = urls_to_visit.pop(0)
-        clean_url = current_url.split('#')[0]
+    return {
+        'content': formatted_content,
+        'processed_urls': processed_urls
+    }
 
-        if clean_url not in visited_urls and is_same_domain(base_url, clean_url) and is_within_depth(base_url, clean_url, max_depth):
-            if ignore_epubs and clean_url.endswith('.epub'):
+class HostRateLimiter:
+    """Spaces out requests to each host so no host sees more than `rate` per second.
+
+    wait() is thread-safe: each caller reserves the next free slot for its
+    host under the lock, then sleeps until that slot outside it.
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            sleep(slot - now)
+
+CRAWL_PLANS = ("auto", "sitemap", "links")
+# Sitemap indexes nested deeper than this are not followed.
+MAX_SITEMAP_DEPTH = 3
+
+def fetch_robots(base_url):
+    """Parse the robots.txt of base_url's host. A missing or unreadable file allows everything."""
+    # Imported here: urllib.robotparser pulls in urllib.request and http.client.
+    from urllib.robotparser import RobotFileParser
+
+    robots = RobotFileParser()
+    parsed = urlparse(base_url)
+    try:
+        robots.parse(cached_get(f"{parsed.scheme}://{parsed.netloc}/robots.txt").text.splitlines())
+    except requests.RequestException:
+        robots.parse([])
+    return robots
+
+def parse_lastmod(value):
+    """Timestamp of a sitemap <lastmod> (W3C datetime), or None if it is missing or malformed."""
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def iter_sitemap_urls(base_url, robots):
+    """Yield (url, lastmod timestamp) for every page in the site's sitemaps.
+
+    Sitemaps come from robots.txt, falling back to /sitemap.xml. Sitemap
+    indexes are followed and gzipped sitemaps are decompressed.
+    """
+    parsed = urlparse(base_url)
+    pending = deque((url, 0) for url in robots.site_maps() or [f"{parsed.scheme}://{parsed.netloc}/sitemap.xml"])
+    seen = set()
+    while pending:
+        sitemap_url, depth = pending.popleft()
+        if sitemap_url in seen or depth > MAX_SITEMAP_DEPTH:
+            continue
+        seen.add(sitemap_url)
+        try:
+            data = cached_get(sitemap_url).content
+            if data[:2] == b"\x1f\x8b":
+                data = gzip.decompress(data)
+            root = ET.fromstring(data)
+        except (requests.RequestException, OSError, ET.ParseError) as e:
+            print(f"Could not read sitemap {sitemap_url}: {e}")
+            continue
+        for entry in root:
+            fields = {child.tag.rsplit("}", 1)[-1]: (child.text or "").strip() for child in entry}
+            if not fields.get("loc"):
                 continue
-
+            if entry.tag.endswith("sitemap"):
+                pending.append((fields["loc"], depth + 1))
+            else:
+                yield fields["loc"].split("#")[0], parse_lastmod(fields.get("lastmod"))
+
+def fetch_crawled_page(url, include_pdfs, rate_limiter, lastmod=None):
+    """Fetch one crawled URL and return (text, links found on it).
+
+    The body is only parsed as HTML when it is HTML; PDFs are read from the
+    same response. text is None for content that is skipped. A page cached
+    after lastmod (a timestamp) is used without contacting the server; pages
+    with a lastmod are cached even when the server sends no validators.
+    """
+    response = get_fresh_cached_response(url, lastmod) if lastmod is not None else None
+    if response is None:
+        rate_limiter.wait(url)
+        response = cached_get(url, store=lastmod is not None)
+    content_type = response.headers.get('Content-Type', '')
+    kind = sniff_content_type(content_type, response.content)
+    if kind == 'html':
+        charset = re.search(r"charset=([\w-]+)", content_type)
+        text, links = extract_html(response.content, charset.group(1) if charset else None)
+        return text, [urljoin(url, link) for link in links]
+    if kind == 'pdf' and include_pdfs:
+        return extract_pdf_text(response.content), []
+    if kind == 'text':
+        return response.text, []
+    print(f"Skipped {url}: unsupported content type {content_type or 'unknown'}")
+    return None, []
+
+def iter_crawled_pages(base_url, max_depth, include_pdfs, ignore_epubs, processed_urls=None, max_workers=None,
+                       rate_limit=DEFAULT_CRAWL_RATE, plan="auto", packer=None):
+    """Yield the fragments of the crawl document one <page> at a time.
+
+    Pages are fetched by max_workers threads, with at most rate_limit
+    requests per second to any one host (None for no limit), and never for
+    URLs robots.txt disallows. plan chooses how pages are found:
+      "links"   - breadth-first from base_url, following the links on each page
+      "sitemap" - every in-scope URL listed in the site's sitemaps, queued up front
+      "auto"    - the sitemap when it lists any in-scope URL, links otherwise
+    Sitemap pages whose lastmod is older than their cached copy are served
+    from the cache without a request. URLs are de-duplicated as they are
+    queued, and pages are yielded in queue order whatever finishes first.
+    Each successfully processed URL is appended to processed_urls, if given.
+    With a TokenPacker, sitemap URLs are queued in its rank order, by URL
+    path and lastmod, and the crawl stops once its budget is spent.
+    """
+    if plan not in CRAWL_PLANS:
+        raise ValueError(f"Unknown crawl plan {plan!r}; expected one of {', '.join(CRAWL_PLANS)}")
+    max_workers = max_workers or DEFAULT_MAX_WORKERS
+    if processed_urls is None:
+        processed_urls = []
+    yield f'<source type="web_documentation" url="{escape_xml(base_url)}">'
+
+    robots = fetch_robots(base_url)
+    user_agent = get_session().headers.get("User-Agent", "*")
+    crawl_delay = robots.crawl_delay(user_agent)
+    if crawl_delay:
+        rate_limit = min(rate_limit or float("inf"), 1 / float(crawl_delay))
+    rate_limiter = HostRateLimiter(rate_limit)
+
+    def wanted(url):
+        return (is_same_domain(base_url, url) and is_within_depth(base_url, url, max_depth)
+                and (include_pdfs or not url.endswith('.pdf')) and not (ignore_epubs and url.endswith('.epub'))
+                and robots.can_fetch(user_agent, url))
+
+    start_url = base_url.split('#')[0]
+    queued = {start_url}
+    frontier = deque([(start_url, 0, None)] if wanted(start_url) else [])
+    if plan != "links":
+        sitemap_urls = [(url, lastmod) for url, lastmod in iter_sitemap_urls(base_url, robots) if wanted(url)]
+        if sitemap_urls or plan == "sitemap":
+            print(f"Queued {len(sitemap_urls)} pages from the sitemap.")
+            if packer:
+                sitemap_urls = packer.rank(sitemap_urls, lambda page: (urlparse(page[0]).path.lstrip("/"), None, page[1]))
+            frontier = deque((url, max_depth, lastmod) for url, lastmod in sitemap_urls if url != start_url)
+            lastmods = dict(sitemap_urls)
+            if wanted(start_url):
+                frontier.appendleft((start_url, max_depth, lastmods.get(start_url)))
+            queued.update(url for url, _ in sitemap_urls)
+
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while in_flight or frontier and not (packer and packer.spent):
+            # Keep the pool busy without fetching too far ahead of the output.
+            while frontier and len(in_flight) < max_workers * 2 and not (packer and packer.spent):
+                url, depth, lastmod = frontier.popleft()
+                in_flight.append((url, depth, executor.submit(fetch_crawled_page, url, include_pdfs, rate_limiter, lastmod)))
+            url, depth, future = in_flight.popleft()
             try:
-                response = requests.get(current_url)
-                soup = BeautifulSoup(response.content, 'html.parser')
-                visited_urls.add(clean_url)
-
-                if clean_url.endswith('.pdf') and include_pdfs:
-                    text = process_pdf(clean_url)
-                else:
-                    for element in soup(['script', 'style', 'head', 'title', 'meta', '[document]']):
-                        element.decompose()
-                    comments = soup.find_all(string=lambda text: isinstance(text, Comment))
-                    for comment in comments:
-                        comment.extract()
-                    text = soup.get_text(separator='\n', strip=True)
-
-                all_text.append(f'<page url="{escape_xml(clean_url)}">')
-                all_text.append(escape_xml(text))
-                all_text.append('</page>')
-                processed_urls.append(clean_url)
-                print(f"Processed: {clean_url}")
-
-                if current_depth < max_depth:
-                    for link in soup.find_all('a', href=True):
-                        new_url = urljoin(current_url, link['href']).split('#')[0]
-                        if new_url not in visited_urls and is_within_depth(base_url, new_url, max_depth) and (include_pdfs or not new_url.endswith('.pdf')) and not (ignore_epubs and new_url.endswith('.epub')):
-                            urls_to_visit.append((new_url, current_depth + 1))
-
+                text, links = future.result()
             except requests.RequestException as e:
-                print(f"Failed to retrieve {clean_url}: {e}")
+                print(f"Failed to retrieve {url}: {e}")
+                continue
+            if text is None:
+                continue
 
-    all_text.append('</source>')
-    formatted_content = '\n'.join(all_text)
+            processed_urls.append(url)
+            print(f"Processed: {url}")
+            yield f'<page url="{escape_xml(url)}">\n{escape_xml(text)}\n</page>'
 
-    return {
-        'content': formatted_content,
-        'processed_urls': processed_urls
-    }
+            if depth < max_depth:
+                for link in links:
+                    link = link.split('#')[0]
+                    if link not in queued and wanted(link):
+                        queued.add(link)
+                        frontier.append((link, depth + 1, None))
+
+    yield '</source>'
 
 def process_doi_or_pmid(identifier):
     headers = {
@@ -402,7 +2397,7 @@ def process_doi_or_pmid(identifier):
 
         base_url = 'https://sci-hub.se/'
         response = requests.post(base_url, headers=headers, data=payload, timeout=60)
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = bs4.BeautifulSoup(response.content, 'html.parser')
         pdf_element = soup.find(id='pdf')
 
         if pdf_element is None:
@@ -419,14 +2414,7 @@ def process_doi_or_pmid(identifier):
         else:
             pdf_url = 'https:/' + content
 
-        pdf_filename = f"{identifier.replace('/', '-')}.pdf"
-        wget.download(pdf_url, pdf_filename)
-
-        with open(pdf_filename, 'rb') as pdf_file:
-            pdf_reader = PdfReader(pdf_file)
-            text = ""
-            for page in range(len(pdf_reader.pages)):
-                text += pdf_reader.pages[page].extract_text()
+        text = extract_pdf_text(cached_get(pdf_url, headers=headers).content)
 
         formatted_text = f'<source type="sci_hub_paper" identifier="{escape_xml(identifier)}">\n'
         formatted_text += '<paper>\n'
@@ -434,7 +2422,6 @@ def process_doi_or_pmid(identifier):
         formatted_text += '\n</paper>\n'
         formatted_text += '</source>'
 
-        os.remove(pdf_filename)
         print(f"Identifier {identifier} processed successfully.")
         return formatted_text
     except (requests.RequestException, ValueError) as e:
@@ -445,69 +2432,255 @@ def process_doi_or_pmid(identifier):
         print("Sci-hub appears to be inaccessible or the document was not found. Please try again later.")
         return error_text
         
-def process_github_pull_request(pull_request_url):
+REPO_CONTEXT_MODES = ("touched", "siblings", "imports", "full", "none")
+# Links to files of a repository, e.g. https://github.com/o/r/blob/main/src/app.py#L3.
+BLOB_LINK_PATTERN = re.compile(r'https://github\.com/([^/\s]+/[^/\s]+)/blob/[^/\s]+/([^\s#?)\]>"\']+)')
+PYTHON_IMPORT_PATTERN = re.compile(r'^[ \t]*(?:from[ \t]+(\.*[\w.]*)[ \t]+import|import[ \t]+([\w.]+))', re.M)
+JS_IMPORT_PATTERN = re.compile(r'(?:\bfrom\s+|\brequire\(\s*|\bimport\s+)["\'](\.{1,2}/[^"\']+)["\']')
+JS_EXTENSIONS = (".js", ".mjs", ".cjs", ".jsx", ".ts", ".tsx")
+
+def find_imported_paths(path, text, repo_paths):
+    """Paths in repo_paths that the Python or JavaScript/TypeScript source at path imports.
+
+    Python imports are resolved relative to the file's package and to the
+    repository root; JavaScript only follows relative specifiers, so bare
+    package names (which live in node_modules) are never matched.
+    """
+    directory = posixpath.dirname(path)
+    candidates = []
+    if path.endswith(".py"):
+        for relative, absolute in PYTHON_IMPORT_PATTERN.findall(text):
+            module = relative or absolute
+            dots = len(module) - len(module.lstrip("."))
+            base = directory
+            for _ in range(dots - 1):
+                base = posixpath.dirname(base)
+            stem = module.lstrip(".").replace(".", "/")
+            for root in ([base] if dots else ["", directory]):
+                module_path = posixpath.join(root, stem) if stem else root
+                candidates += [f"{module_path}.py", posixpath.join(module_path, "__init__.py")]
+    elif path.endswith(JS_EXTENSIONS):
+        for specifier in JS_IMPORT_PATTERN.findall(text):
+            module_path = posixpath.normpath(posixpath.join(directory, specifier))
+            candidates += [module_path] + [module_path + ext for ext in JS_EXTENSIONS]
+            candidates += [f"{module_path}/index{ext}" for ext in JS_EXTENSIONS]
+    return [candidate for candidate in dict.fromkeys(candidates) if candidate in repo_paths and candidate != path]
+
+def iter_repository_context(repo_name, ref, paths, mode="touched", token_budget=None, max_workers=None):
+    """Yield a <source> holding only the repository files relevant to a pull request or issue.
+
+    paths are the files the pull request touches or the issue links to, read
+    at ref from one recursive Git tree listing. "siblings" adds the other
+    files in their directories and "imports" the files they import. Files
+    are taken in that order until token_budget tokens are used; the rest are
+    not downloaded and are listed as <skipped/> instead.
+    """
+    max_workers = max_workers or DEFAULT_MAX_WORKERS
+    yield f'<source type="github_repository" url="https://github.com/{repo_name}" ref="{escape_xml(ref)}" context="{mode}">'
+    tree = github_get_json(f"{GITHUB_API_URL}/repos/{repo_name}/git/trees/{quote(ref, safe='')}?recursive=1")
+    blobs = {entry["path"]: entry for entry in tree["tree"] if entry["type"] == "blob"}
+    paths = [path for path in dict.fromkeys(paths) if path in blobs and is_allowed_path(path)]
+    limits = new_read_limits()
+
+    def listed(path):
+        return {
+            "name": path.rsplit("/", 1)[-1],
+            "path": path,
+            "sha": blobs[path]["sha"],
+            "size": blobs[path].get("size"),
+            "download_url": f"{GITHUB_RAW_URL}/{repo_name}/{quote(ref, safe='')}/{quote(path)}",
+            "limit": limits.reserve(blobs[path].get("size")),
+        }
+
+    used_tokens = 0
+    spent = token_budget == 0
+
+    def fetch(file):
+        # Files still queued once the budget is spent are never downloaded.
+        return None if spent else fetch_github_file(file)
+
+    def take(files):
+        nonlocal used_tokens, spent
+        for file, block in zip(files, ordered_map(executor, fetch, files, max_workers * 2)):
+            if not spent and block is not None and token_budget is not None:
+                used_tokens += get_token_count(block)
+                spent = used_tokens > token_budget
+            if spent:
+                yield render_skipped(file["path"], file["size"], "context budget")
+            elif block is not None:
+                print(f"Processing {file['path']}...")
+                yield block
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        touched_blocks = {}
+        for block in take([listed(path) for path in paths]):
+            match = ITEM_TAG_PATTERN.match(block)
+            if match:
+                touched_blocks[unescape_xml(match.group(1))] = block
+            yield block
+        neighbours = []
+        if mode == "siblings":
+            directories = {posixpath.dirname(path) for path in paths}
+            neighbours = sorted(path for path in blobs if posixpath.dirname(path) in directories)
+        elif mode == "imports":
+            for path, block in touched_blocks.items():
+                neighbours += find_imported_paths(path, unescape_xml(block), blobs)
+        neighbours = [listed(path) for path in dict.fromkeys(neighbours) if path not in paths and is_allowed_path(path)]
+        yield from take(neighbours)
+    yield '</source>'
+
+def context_token_budget(context_budget, max_tokens, rendered):
+    """The context budget once rendered, the pull request or issue so far, is counted against max_tokens."""
+    if not max_tokens:
+        return context_budget
+    left = max(0, max_tokens - get_token_count(rendered) - PACK_CLOSING_TOKENS)
+    return left if context_budget is None else min(context_budget, left)
+
+def render_repository_context(repo_name, ref, paths, mode, token_budget, max_workers, repo_mode, packer=None):
+    """The <repository> element closing a pull request or issue source; empty for mode "none".
+
+    In mode "full", a token_budget packs the repository with a TokenPacker,
+    ranking files like packer if one is given, so files are no longer
+    downloaded once it is spent.
+    """
+    if mode == "none":
+        return ""
+    if mode == "full":
+        if token_budget is not None:
+            packer = packer.with_budget(token_budget) if packer else TokenPacker(token_budget)
+        else:
+            packer = None
+        fragments = iter_github_repo(f"https://github.com/{repo_name}", max_workers, repo_mode, packer)
+        content = "\n".join(packer.pack(fragments) if packer else fragments)
+    else:
+        content = "\n".join(iter_repository_context(repo_name, ref, paths, mode, token_budget, max_workers))
+    return f'<repository>\n{content}</repository>\n'
+
+def process_github_pull_request(pull_request_url, max_workers=None, repo_mode="contents", context="touched", context_budget=None,
+                                packer=None):
+    """Flatten a pull request: its description, commits, diff with review comments, and repository context.
+
+    context is one of REPO_CONTEXT_MODES and selects which repository files
+    follow, read at the head commit; context_budget caps them in tokens, as
+    does whatever of a TokenPacker's budget the pull request itself leaves.
+    """
     url_parts = pull_request_url.split("/")
     repo_owner = url_parts[3]
     repo_name = url_parts[4]
     pull_request_number = url_parts[-1]
 
-    api_base_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/pulls/{pull_request_number}"
-    headers = {"Authorization": f"token {TOKEN}"}
-
-    response = requests.get(api_base_url, headers=headers)
-    pull_request_data = response.json()
-
-    diff_url = pull_request_data["diff_url"]
-    diff_response = requests.get(diff_url, headers=headers)
-    pull_request_diff = diff_response.text
-
-    comments_url = pull_request_data["comments_url"]
-    review_comments_url = pull_request_data["review_comments_url"]
-    comments_response = requests.get(comments_url, headers=headers)
-    review_comments_response = requests.get(review_comments_url, headers=headers)
-    comments_data = comments_response.json()
-    review_comments_data = review_comments_response.json()
-
-    all_comments = comments_data + review_comments_data
-    all_comments.sort(key=lambda comment: comment.get("position") or float("inf"))
-
-    formatted_text = f'<source type="github_pull_request" url="{pull_request_url}">\n'
-    formatted_text += '<pull_request_info>\n'
-    formatted_text += f'<title>{escape_xml(pull_request_data["title"])}</title>\n'
-    formatted_text += f'<description>{escape_xml(pull_request_data["body"])}</description>\n'
-    formatted_text += '<merge_details>\n'
-    formatted_text += f'{escape_xml(pull_request_data["user"]["login"])} wants to merge {pull_request_data["commits"]} commit into {repo_owner}:{pull_request_data["base"]["ref"]} from {pull_request_data["head"]["label"]}\n'
-    formatted_text += '</merge_details>\n'
-    formatted_text += '<diff_and_comments>\n'
-
-    diff_lines = pull_request_diff.split("\n")
-    comment_index = 0
-    for line in diff_lines:
-        formatted_text += f'{escape_xml(line)}\n'
-        while comment_index < len(all_comments) and all_comments[comment_index].get("position") == diff_lines.index(line):
-            comment = all_comments[comment_index]
-            formatted_text += f'<review_comment>\n'
-            formatted_text += f'<author>{escape_xml(comment["user"]["login"])}</author>\n'
-            formatted_text += f'<content>{escape_xml(comment["body"])}</content>\n'
-            formatted_text += f'<path>{escape_xml(comment["path"])}</path>\n'
-            formatted_text += f'<line>{comment["original_line"]}</line>\n'
-            formatted_text += '</review_comment>\n'
-            comment_index += 1
-
-    formatted_text += '</diff_and_comments>\n'
-    formatted_text += '</pull_request_info>\n'
-
-    repo_url = f"https://github.com/{repo_owner}/{repo_name}"
-    repo_content = process_github_repo(repo_url)
-    
-    formatted_text += '<repository>\n'
-    formatted_text += repo_content
-    formatted_text += '</repository>\n'
-    formatted_text += '</source>'
+    repo_api_url = f"{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}"
+    api_base_url = f"{repo_api_url}/pulls/{pull_request_number}"
+    # Everything but the diff can be requested straight away; the diff URL comes from the pull request itself.
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        pull_request_future = executor.submit(github_get_json, api_base_url)
+        comments_future = executor.submit(github_get_all, f"{repo_api_url}/issues/{pull_request_number}/comments", max_workers)
+        review_comments_future = executor.submit(github_get_all, f"{api_base_url}/comments", max_workers)
+        reviews_future = executor.submit(github_get_all, f"{api_base_url}/reviews", max_workers)
+        commits_future = executor.submit(github_get_all, f"{api_base_url}/commits", max_workers)
+        files_future = executor.submit(github_get_all, f"{api_base_url}/files", max_workers) if context not in ("full", "none") else None
+        pull_request_data = pull_request_future.result()
+        pull_request_diff = cached_get(pull_request_data["diff_url"], headers=github_headers()).text
+        comments_data = comments_future.result()
+        review_comments_data = review_comments_future.result()
+        reviews_data = reviews_future.result()
+        commits_data = commits_future.result()
+        changed_files = files_future.result() if files_future else []
+
+    parts = [
+        f'<source type="github_pull_request" url="{pull_request_url}">\n',
+        '<pull_request_info>\n',
+        f'<title>{escape_xml(pull_request_data["title"])}</title>\n',
+        f'<description>{escape_xml(pull_request_data["body"])}</description>\n',
+        '<merge_details>\n',
+        f'{escape_xml(pull_request_data["user"]["login"])} wants to merge {pull_request_data["commits"]} commit into {repo_owner}:{pull_request_data["base"]["ref"]} from {pull_request_data["head"]["label"]}\n',
+        '</merge_details>\n',
+        '<commits>\n',
+    ]
+    for commit in commits_data:
+        parts.append(f'<commit sha="{commit["sha"]}">{escape_xml(commit["commit"]["message"])}</commit>\n')
+    parts.append('</commits>\n')
+    parts.append('<diff_and_comments>\n')
+    render_pull_request_diff(pull_request_diff, review_comments_data, parts)
+    parts.append('</diff_and_comments>\n')
+    for review in reviews_data:
+        if review.get("body"):
+            parts.append(f'<review state="{review["state"]}">\n<author>{escape_xml(review["user"]["login"])}</author>\n'
+                         f'<content>{escape_xml(review["body"])}</content>\n</review>\n')
+    for comment in comments_data:
+        parts.append(render_comment(comment))
+    parts.append('</pull_request_info>\n')
+
+    # Files are read from the branch being merged, which may live in a fork.
+    head = pull_request_data["head"]
+    head_repo = (head.get("repo") or {}).get("full_name") or f"{repo_owner}/{repo_name}"
+    touched = [file["filename"] for file in changed_files if file.get("status") != "removed"]
+    context_budget = context_token_budget(context_budget, packer and packer.max_tokens, "".join(parts))
+    parts.append(render_repository_context(head_repo, head.get("sha") or pull_request_data["base"]["ref"], touched,
+                                           context, context_budget, max_workers, repo_mode, packer))
+    parts.append('</source>')
 
     print(f"Pull request {pull_request_number} and repository content processed successfully.")
 
-    return formatted_text
+    return "".join(parts)
+
+def render_review_comment(comment):
+    return (
+        '<review_comment>\n'
+        f'<author>{escape_xml(comment["user"]["login"])}</author>\n'
+        f'<content>{escape_xml(comment["body"])}</content>\n'
+        f'<path>{escape_xml(comment["path"])}</path>\n'
+        f'<line>{comment.get("original_line")}</line>\n'
+        '</review_comment>\n'
+    )
+
+def render_comment(comment):
+    return (
+        '<comment>\n'
+        f'<author>{escape_xml(comment["user"]["login"])}</author>\n'
+        f'<content>{escape_xml(comment["body"])}</content>\n'
+        '</comment>\n'
+    )
+
+def render_pull_request_diff(diff, review_comments, parts):
+    """Append the escaped lines of a unified diff to parts, each followed by its review comments.
+
+    A review comment's position counts lines from the first @@ hunk header
+    of its file (that header is position 0) and runs on through later
+    hunks until the next file. Comments are looked up by (path, position)
+    in a dict, so this is a single pass over the diff. Comments without a
+    position (outdated ones) follow the diff.
+    """
+    comments_at = {}
+    outdated = []
+    for comment in review_comments:
+        if comment.get("position") is None:
+            outdated.append(comment)
+        else:
+            comments_at.setdefault((comment["path"], comment["position"]), []).append(comment)
+
+    path = old_path = position = None
+    for line in diff.split("\n"):
+        parts.append(escape_xml(line) + "\n")
+        if line.startswith("diff --git "):
+            path = old_path = position = None
+        elif position is None:
+            # File headers only come before the first hunk; inside a hunk a
+            # removed "-- x" line also starts with "---".
+            if line.startswith("--- "):
+                old_path = line[4:].removeprefix("a/")
+            elif line.startswith("+++ "):
+                path = old_path if line[4:] == "/dev/null" else line[4:].removeprefix("b/")
+            elif line.startswith("@@"):
+                position = 0
+        else:
+            position += 1
+            for comment in comments_at.get((path, position), ()):
+                parts.append(render_review_comment(comment))
+
+    for comment in outdated:
+        parts.append(render_review_comment(comment))
+    return parts
     
 def escape_xml(text):
     return (
@@ -520,70 +2693,367 @@ def escape_xml(text):
         # .replace("'", "&apos;")
     )
 
-def process_github_issue(issue_url):
+# Links to lines of a file on GitHub, e.g. https://github.com/o/r/blob/main/x.py#L10-L20.
+CODE_SNIPPET_PATTERN = re.compile(r'(https://github\.com/[^/\s]+/[^/\s]+/blob/[^\s#)]+)#L(\d+)(?:-L(\d+))?')
+
+def fetch_snippet_file_lines(blob_url):
+    """The lines of the file behind a github.com blob URL, fetched from the raw host."""
+    raw_url = GITHUB_RAW_URL + urlparse(blob_url).path.replace("/blob/", "/", 1)
+    return cached_get(raw_url, headers=github_headers()).text.split("\n")
+
+def process_github_issue(issue_url, max_workers=None, repo_mode="contents", context="touched", context_budget=None,
+                         packer=None):
+    """Flatten an issue: its description, comments with linked code snippets, and repository context.
+
+    With the default context the repository files are the ones the issue
+    and its comments link to, read at the default branch. context_budget
+    and packer bound the context as for process_github_pull_request.
+    """
     url_parts = issue_url.split("/")
     repo_owner = url_parts[3]
     repo_name = url_parts[4]
     issue_number = url_parts[-1]
 
-    api_base_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/issues/{issue_number}"
-    headers = {"Authorization": f"token {TOKEN}"}
-
-    response = requests.get(api_base_url, headers=headers)
-    issue_data = response.json()
-
-    comments_url = issue_data["comments_url"]
-    comments_response = requests.get(comments_url, headers=headers)
-    comments_data = comments_response.json()
-
-    formatted_text = f'<source type="github_issue" url="{issue_url}">\n'
-    formatted_text += '<issue_info>\n'
-    formatted_text += f'<title>{escape_xml(issue_data["title"])}</title>\n'
-    formatted_text += f'<description>{escape_xml(issue_data["body"])}</description>\n'
-    formatted_text += '<comments>\n'
+    api_base_url = f"{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}/issues/{issue_number}"
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        issue_future = executor.submit(github_get_json, api_base_url)
+        comments_data = github_get_all(f"{api_base_url}/comments", max_workers)
+        issue_data = issue_future.result()
+
+    # Fetch every file referenced by a code snippet link at once, each file only once.
+    snippets = {comment["id"]: [(match.group(1), int(match.group(2)), int(match.group(3) or match.group(2)))
+                                for match in CODE_SNIPPET_PATTERN.finditer(comment["body"] or "")]
+                for comment in comments_data}
+    file_urls = list(dict.fromkeys(url for found in snippets.values() for url, _, _ in found))
+    with ThreadPoolExecutor(max_workers=max_workers or DEFAULT_MAX_WORKERS) as executor:
+        file_lines = dict(zip(file_urls, executor.map(fetch_snippet_file_lines, file_urls)))
+
+    parts = [
+        f'<source type="github_issue" url="{issue_url}">\n',
+        '<issue_info>\n',
+        f'<title>{escape_xml(issue_data["title"])}</title>\n',
+        f'<description>{escape_xml(issue_data["body"])}</description>\n',
+        '<comments>\n',
+    ]
 
     for comment in comments_data:
-        formatted_text += '<comment>\n'
-        formatted_text += f'<author>{escape_xml(comment["user"]["login"])}</author>\n'
-        formatted_text += f'<content>{escape_xml(comment["body"])}</content>\n'
-
-        code_snippets = re.findall(r'https://github.com/.*#L\d+-L\d+', comment['body'])
-        for snippet_url in code_snippets:
-            url_parts = snippet_url.split("#")
-            file_url = url_parts[0].replace("/blob/", "/raw/")
-            line_range = url_parts[1]
-            start_line, end_line = map(int, line_range.split("-")[0][1:]), map(int, line_range.split("-")[1][1:])
-
-            file_response = requests.get(file_url, headers=headers)
-            file_content = file_response.text
+        parts.append('<comment>\n')
+        parts.append(f'<author>{escape_xml(comment["user"]["login"])}</author>\n')
+        parts.append(f'<content>{escape_xml(comment["body"])}</content>\n')
+        for file_url, start_line, end_line in snippets[comment["id"]]:
+            code_snippet = "\n".join(file_lines[file_url][start_line - 1:end_line])
+            parts.append('<code_snippet>\n')
+            parts.append(f'<![CDATA[{code_snippet}]]>\n')
+            parts.append('</code_snippet>\n')
+        parts.append('</comment>\n')
+
+    parts.append('</comments>\n')
+    parts.append('</issue_info>\n')
+
+    full_name = f"{repo_owner}/{repo_name}"
+    linked = [path for body in [issue_data["body"]] + [comment["body"] for comment in comments_data]
+              for repo, path in BLOB_LINK_PATTERN.findall(body or "") if repo.lower() == full_name.lower()]
+    default_branch = github_get_json(f"{GITHUB_API_URL}/repos/{full_name}")["default_branch"] if context not in ("full", "none") else None
+    context_budget = context_token_budget(context_budget, packer and packer.max_tokens, "".join(parts))
+    parts.append(render_repository_context(full_name, default_branch, [unquote(path) for path in linked],
+                                           context, context_budget, max_workers, repo_mode, packer))
+    parts.append('</source>')
 
-            code_lines = file_content.split("\n")[start_line-1:end_line]
-            code_snippet = "\n".join(code_lines)
-
-            formatted_text += '<code_snippet>\n'
-            formatted_text += f'<![CDATA[{code_snippet}]]>\n'
-            formatted_text += '</code_snippet>\n'
-
-        formatted_text += '</comment>\n'
-
-    formatted_text += '</comments>\n'
-    formatted_text += '</issue_info>\n'
+    print(f"Issue {issue_number} and repository content processed successfully.")
 
-    repo_url = f"https://github.com/{repo_owner}/{repo_name}"
-    repo_content = process_github_repo(repo_url)
-    
-    formatted_text += '<repository>\n'
-    formatted_text += repo_content
-    formatted_text += '</repository>\n'
-    formatted_text += '</source>'
+    return "".join(parts)
+
+def classify_input(input_path):
+    """The <source> type an input path, URL, DOI or PMID is processed as."""
+    if "github.com" in input_path:
+        if "/pull/" in input_path:
+            return "github_pull_request"
+        if "/issues/" in input_path:
+            return "github_issue"
+        return "github_repository"
+    if urlparse(input_path).scheme in ["http", "https"]:
+        if "youtube.com" in input_path or "youtu.be" in input_path:
+            return "youtube_transcript"
+        if "arxiv.org" in input_path:
+            return "arxiv_paper"
+        return "web_documentation"
+    if input_path.startswith("10.") and "/" in input_path or input_path.isdigit():
+        return "sci_hub_paper"
+    return "local_directory"
+
+def route_input(input_path, processed_urls=None, max_workers=None, github_mode="contents", repo_context="touched",
+                context_budget=None, crawl_rate=DEFAULT_CRAWL_RATE, crawl_plan="auto", incremental_output=None, jobs=1,
+                use_ignore_files=True, max_tokens=None, priority=(), pack_order="listing"):
+    """Return the output fragments for any supported input, to be joined with newlines.
+
+    This is the one router behind the command line, batch mode and the web
+    app. Crawled URLs are appended to processed_urls when it is a list.
+    max_tokens packs the output into that many tokens with a TokenPacker
+    ranking files by the priority globs and pack_order.
+    """
+    source_type = classify_input(input_path)
+    packer = TokenPacker(max_tokens, priority, pack_order) if max_tokens else None
+    if source_type == "github_pull_request":
+        fragments = [process_github_pull_request(input_path, max_workers=max_workers, repo_mode=github_mode,
+                                                 context=repo_context, context_budget=context_budget, packer=packer)]
+    elif source_type == "github_issue":
+        fragments = [process_github_issue(input_path, max_workers=max_workers, repo_mode=github_mode,
+                                          context=repo_context, context_budget=context_budget, packer=packer)]
+    elif source_type == "github_repository":
+        fragments = iter_github_repo(input_path, max_workers=max_workers, mode=github_mode, packer=packer)
+    elif source_type == "youtube_transcript":
+        fragments = [fetch_youtube_transcript(input_path)]
+    elif source_type == "arxiv_paper":
+        fragments = [process_arxiv_pdf(input_path)]
+    elif source_type == "web_documentation":
+        fragments = iter_crawled_pages(input_path, max_depth=2, include_pdfs=True, ignore_epubs=True, processed_urls=processed_urls,
+                                       max_workers=max_workers, rate_limit=crawl_rate, plan=crawl_plan, packer=packer)
+    elif source_type == "sci_hub_paper":
+        fragments = [process_doi_or_pmid(input_path)]
+    else:
+        fragments = iter_local_folder(input_path, incremental_output=incremental_output, jobs=jobs,
+                                      use_ignore_files=use_ignore_files, packer=packer)
+    return packer.pack(fragments) if packer else fragments
+
+# Inputs of each source type processed at once in batch mode. Each GitHub
+# input already downloads with max_workers threads of its own, and crawls
+# and Sci-Hub lookups are kept few to stay polite to the hosts involved.
+BATCH_CONCURRENCY = {
+    "github_repository": 2,
+    "github_pull_request": 4,
+    "github_issue": 4,
+    "youtube_transcript": 4,
+    "arxiv_paper": 4,
+    "web_documentation": 2,
+    "sci_hub_paper": 1,
+    "local_directory": 2,
+}
+DEFAULT_BATCH_PARALLEL = 8
+
+def read_batch_inputs(source):
+    """The inputs listed one per line in the file source, or on stdin for "-".
+
+    Blank lines and lines starting with # are skipped.
+    """
+    if source == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+
+def batch_output_name(index, input_path):
+    """A file name for one batch input's output, numbered so a directory listing keeps input order."""
+    slug = re.sub(r"[^\w.-]+", "_", input_path.split("://", 1)[-1]).strip("_.")[:80]
+    return f"{index + 1:04}_{slug or 'input'}.txt"
+
+def process_batch(inputs, output_dir=None, combined_output=None, max_parallel=DEFAULT_BATCH_PARALLEL, concurrency=None,
+                  **route_options):
+    """Process many inputs in one run, each to its own file in output_dir and/or all into combined_output.
+
+    Inputs run concurrently, at most max_parallel at a time and at most
+    concurrency[source type] of each type (BATCH_CONCURRENCY by default),
+    sharing the HTTP session, disk cache and rate-limit scheduler. An input
+    is only started once its type has a free slot, so inputs held back by
+    their type never keep others waiting. An input
+    that fails is written as a <source> holding an <error> and does not stop
+    the others. combined_output joins the outputs in input order.
+    route_options are passed on to route_input. Returns one dict per input,
+    in input order, with its "input", "source_type", "output" file (None when
+    only combined_output is written), "tokens" and "error" (None on success).
+    """
+    limits = {**BATCH_CONCURRENCY, **(concurrency or {})}
+    work_dir = output_dir or tempfile.mkdtemp(prefix="onefilellm-batch-")
+    os.makedirs(work_dir, exist_ok=True)
+
+    def run(index, input_path, source_type):
+        path = os.path.join(work_dir, batch_output_name(index, input_path))
+        counter = TokenCounter()
+        error = None
+        try:
+            with OutputWriter(path, [counter]) as writer:
+                for fragment in route_input(input_path, **route_options):
+                    writer.write(fragment)
+        except Exception as e:
+            error = str(e)
+            counter = TokenCounter()
+            with OutputWriter(path, [counter]) as writer:
+                writer.write(f'<source type="{source_type}" url="{escape_xml(input_path)}">\n<error>{escape_xml(error)}</error>\n</source>')
+        print(f"{'Failed' if error else 'Processed'} {input_path}{f': {error}' if error else ''}")
+        return {"input": input_path, "source_type": source_type, "output": path, "tokens": counter.total, "error": error}
 
-    print(f"Issue {issue_number} and repository content processed successfully.")
+    try:
+        results = [None] * len(inputs)
+        waiting = [(index, input_path, classify_input(input_path)) for index, input_path in enumerate(inputs)]
+        running = dict.fromkeys(limits, 0)
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            while waiting or in_flight:
+                # Start, in input order, every waiting input whose type has a free slot.
+                for item in list(waiting):
+                    if len(in_flight) >= max_parallel:
+                        break
+                    index, input_path, source_type = item
+                    if running[source_type] < limits[source_type]:
+                        waiting.remove(item)
+                        running[source_type] += 1
+                        in_flight[executor.submit(run, *item)] = item
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, _, source_type = in_flight.pop(future)
+                    running[source_type] -= 1
+                    results[index] = future.result()
+        if combined_output:
+            # Copied in chunks, so large outputs are never held in memory.
+            with open(f"{combined_output}.tmp", "wb") as combined:
+                for index, result in enumerate(results):
+                    if index:
+                        combined.write(b"\n")
+                    with open(result["output"], "rb") as f:
+                        shutil.copyfileobj(f, combined)
+            os.replace(f"{combined_output}.tmp", combined_output)
+    finally:
+        if not output_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    if not output_dir:
+        for result in results:
+            result["output"] = None
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate a repository, folder, paper or site into one LLM-ready text file.")
+    parser.add_argument("input_path", nargs="?", help="Local path, URL, DOI or PMID to process")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="Process every input listed in FILE, one per line (- for stdin), in one run")
+    parser.add_argument("--output-dir", metavar="DIR",
+                        help="In batch mode, write each input's output to its own file in DIR (default: batch_output)")
+    parser.add_argument("--combined-output", metavar="FILE",
+                        help="In batch mode, also write all outputs into FILE, in input order")
+    parser.add_argument("--batch-parallel", type=int, default=DEFAULT_BATCH_PARALLEL, metavar="N",
+                        help=f"In batch mode, process at most N inputs at once (default: {DEFAULT_BATCH_PARALLEL})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help=f"Concurrent requests used when fetching GitHub repositories and crawling web pages (default: {DEFAULT_MAX_WORKERS})")
+    parser.add_argument("--crawl-rate", type=float, default=DEFAULT_CRAWL_RATE, metavar="N",
+                        help=f"Maximum requests per second to any one host while crawling; 0 for no limit (default: {DEFAULT_CRAWL_RATE})")
+    parser.add_argument("--crawl-plan", choices=CRAWL_PLANS, default="auto",
+                        help="Find pages to crawl from the site's sitemap, by following links, or auto: the sitemap when it has any (default: auto)")
+    parser.add_argument("--pdf-max-pages", type=int, default=0, metavar="N",
+                        help="Extract text from at most the first N pages of each PDF; 0 for all pages (default: 0)")
+    parser.add_argument("--pdf-backend", choices=["auto", *PDF_BACKENDS], default="auto",
+                        help="PDF text extraction library; auto picks the fastest installed (default: auto)")
+    parser.add_argument("--html-extractor", choices=["auto", *HTML_EXTRACTORS], default="auto",
+                        help="HTML parser used to extract text and links from crawled pages; auto picks the fastest installed (default: auto)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"Directory for the persistent download cache (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_MAX_BYTES // (1024 * 1024), metavar="MB",
+                        help="Maximum size of the download cache before least recently used entries are evicted")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the persistent download cache")
+    parser.add_argument("--incremental", action="store_true",
+                        help="For local folders, reuse unchanged files from the previous output using a manifest saved next to it")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="For local folders, read, convert and escape files in this many worker processes (default: 1)")
+    parser.add_argument("--include", action="append", metavar="GLOB",
+                        help="Only process files matching this glob (.gitignore syntax, repeatable); replaces the default extension list")
+    parser.add_argument("--exclude", action="append", metavar="GLOB",
+                        help="Skip files and directories matching this glob (.gitignore syntax, repeatable)")
+    parser.add_argument("--filetypes-config", default=DEFAULT_FILETYPES_CONFIG, metavar="PATH",
+                        help=f"JSON file extending the allowed file types (default: {DEFAULT_FILETYPES_CONFIG}, if present)")
+    parser.add_argument("--no-ignore-files", action="store_true",
+                        help="For local folders, do not honour .gitignore and .ignore files")
+    parser.add_argument("--github-mode", choices=list(GITHUB_REPO_MODES), default="contents",
+                        help="How GitHub repository files are listed and downloaded (default: contents)")
+    parser.add_argument("--repo-context", choices=REPO_CONTEXT_MODES, default="touched",
+                        help="Repository files included with a pull request or issue: the files it touches or links to, "
+                             "plus their directory siblings or imports, the whole repository, or none (default: touched)")
+    parser.add_argument("--context-budget", type=int, default=0, metavar="TOKENS",
+                        help="Stop adding repository context to a pull request or issue after this many tokens; 0 for no limit (default: 0)")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES, metavar="N",
+                        help=f"Retry rate-limited, 5xx and failed requests this many times with jittered backoff (default: {DEFAULT_MAX_RETRIES})")
+    parser.add_argument("--rate-limit-wait", type=int, default=DEFAULT_RATE_LIMIT_WAIT, metavar="SECONDS",
+                        help=f"Longest to wait for an exhausted rate limit to reset before stopping; a rerun resumes (default: {DEFAULT_RATE_LIMIT_WAIT})")
+    parser.add_argument("--max-file-size", type=int, default=DEFAULT_MAX_FILE_BYTES // (1024 * 1024), metavar="MB",
+                        help="Read at most this much of any one file; 0 for no limit (default: %(default)s)")
+    parser.add_argument("--max-total-size", type=int, default=0, metavar="MB",
+                        help="Stop reading files once this much has been read from one source; 0 for no limit (default: 0)")
+    parser.add_argument("--oversize", choices=OVERSIZE_POLICIES, default="truncate",
+                        help="Truncate files over the size limits, or skip them leaving a <skipped/> marker (default: truncate)")
+    parser.add_argument("--max-tokens", type=int, default=0, metavar="TOKENS",
+                        help="Pack the output into this many tokens, cutting off the file that overflows and fetching "
+                             "nothing after it; 0 for no limit (default: 0)")
+    parser.add_argument("--priority", action="append", metavar="GLOB",
+                        help="With --max-tokens, pack files matching this glob first (.gitignore syntax, repeatable, "
+                             "earlier globs first); READMEs and entry points follow")
+    parser.add_argument("--pack-order", choices=PACK_ORDERS, default="listing",
+                        help="With --max-tokens, order the remaining files as listed, smallest first, "
+                             "or most recently modified first (default: listing)")
+    parser.add_argument("--chunk-tokens", type=int, default=0, metavar="TOKENS",
+                        help="Also write the output as chunks of at most this many tokens, in JSONL shards for "
+                             "embedding; 0 for none (default: 0)")
+    parser.add_argument("--chunk-overlap", type=int, default=0, metavar="TOKENS",
+                        help="Start each chunk with up to this many tokens from the end of the one before (default: 0)")
+    parser.add_argument("--chunk-dir", default=DEFAULT_CHUNK_DIR, metavar="DIR",
+                        help=f"Directory the chunk shards are written to (default: {DEFAULT_CHUNK_DIR})")
+    parser.add_argument("--shard-records", type=int, default=DEFAULT_SHARD_RECORDS, metavar="N",
+                        help=f"Chunks per JSONL shard (default: {DEFAULT_SHARD_RECORDS})")
+    return parser.parse_args(argv)
+
+def route_options(args):
+    """The route_input keyword arguments selected by the command line flags."""
+    return {
+        "max_workers": args.workers,
+        "github_mode": args.github_mode,
+        "repo_context": args.repo_context,
+        "context_budget": args.context_budget or None,
+        "crawl_rate": args.crawl_rate or None,
+        "crawl_plan": args.crawl_plan,
+        "jobs": args.jobs,
+        "use_ignore_files": not args.no_ignore_files,
+        "max_tokens": args.max_tokens or None,
+        "priority": args.priority or (),
+        "pack_order": args.pack_order,
+    }
 
-    return formatted_text
+def run_batch(args, console):
+    """Process every input listed in args.batch and print a summary of the results."""
+    from rich.markup import escape as escape_markup
+
+    inputs = read_batch_inputs(args.batch)
+    output_dir = args.output_dir or (None if args.combined_output else "batch_output")
+    console.print(f"\n[bold bright_green]Processing {len(inputs)} inputs...[/bold bright_green]\n")
+    results = process_batch(inputs, output_dir=output_dir, combined_output=args.combined_output,
+                            max_parallel=args.batch_parallel, **route_options(args))
+    for result in results:
+        status = f"[bold red]{escape_markup(result['error'])}[/bold red]" if result["error"] else escape_markup(result["output"] or "")
+        console.print(f"  [bold bright_cyan]{result['tokens']:>10}[/bold bright_cyan]  {escape_markup(result['input'])}  {status}")
+    failed = sum(1 for result in results if result["error"])
+    console.print(f"\n[bright_green]{len(results) - failed} of {len(results)} inputs processed.[/bright_green]")
+    if output_dir:
+        console.print(f"Outputs are in [bold bright_blue]{output_dir}[/bold bright_blue].")
+    if args.combined_output:
+        console.print(f"All outputs were combined into [bold bright_blue]{args.combined_output}[/bold bright_blue].")
 
 def main():
+    from rich.console import Console
+    from rich.panel import Panel
+    from rich.text import Text
+    from rich.prompt import Prompt
+    from rich.progress import Progress, TextColumn, BarColumn, TimeRemainingColumn
+    from rich.markup import escape as escape_markup
+
+    args = parse_args()
+    configure_cache(args.cache_dir, args.cache_size * 1024 * 1024, enabled=not args.no_cache)
+    configure_filetypes(args.include, args.exclude, args.filetypes_config)
+    configure_scheduler(args.max_retries, args.rate_limit_wait)
+    configure_html_extractor(args.html_extractor)
+    configure_pdf(args.pdf_max_pages or None, backend=args.pdf_backend)
+    configure_read_limits(args.max_file_size * 1024 * 1024 or None, args.max_total_size * 1024 * 1024 or None, args.oversize)
     console = Console()
 
+    if args.batch:
+        run_batch(args, console)
+        return
+
     intro_text = Text("\nInput Paths or URLs Processed:\n", style="dodger_blue1")
     input_types = [
         ("• Local folder path (flattens all files into text)", "bright_white"),
@@ -609,8 +3079,8 @@ def main():
     )
     console.print(intro_panel)
 
-    if len(sys.argv) > 1:
-        input_path = sys.argv[1]
+    if args.input_path:
+        input_path = args.input_path
     else:
         input_path = Prompt.ask("\n[bold dodger_blue1]Enter the path or URL[/bold dodger_blue1]", console=console)
     
@@ -630,52 +3100,49 @@ def main():
         task = progress.add_task("[bright_blue]Processing...", total=100)
 
         try:
-            if "github.com" in input_path:
-                if "/pull/" in input_path:
-                    final_output = process_github_pull_request(input_path)
-                elif "/issues/" in input_path:
-                    final_output = process_github_issue(input_path)
-                else:
-                    final_output = process_github_repo(input_path)
-            elif urlparse(input_path).scheme in ["http", "https"]:
-                if "youtube.com" in input_path or "youtu.be" in input_path:
-                    final_output = fetch_youtube_transcript(input_path)
-                elif "arxiv.org" in input_path:
-                    final_output = process_arxiv_pdf(input_path)
-                else:
-                    crawl_result = crawl_and_extract_text(input_path, max_depth=2, include_pdfs=True, ignore_epubs=True)
-                    final_output = crawl_result['content']
-                    with open(urls_list_file, 'w', encoding='utf-8') as urls_file:
-                        urls_file.write('\n'.join(crawl_result['processed_urls']))
-            elif input_path.startswith("10.") and "/" in input_path or input_path.isdigit():
-                final_output = process_doi_or_pmid(input_path)
+            processed_urls = [] if classify_input(input_path) == "web_documentation" else None
+            fragments = route_input(input_path, processed_urls, incremental_output=output_file if args.incremental else None,
+                                    **route_options(args))
+
+            # Stream the uncompressed output to disk, counting tokens (and
+            # writing chunk shards and the compressed copy) as it goes.
+            # Newlines are left untranslated so the byte offsets recorded by
+            # --incremental stay valid on every platform.
+            if args.chunk_tokens:
+                uncompressed_counter = ChunkWriter(args.chunk_dir, args.chunk_tokens, args.chunk_overlap, args.shard_records)
             else:
-                final_output = process_local_folder(input_path)
-
-            progress.update(task, advance=50)
-
-            # Write the uncompressed output
-            with open(output_file, "w", encoding="utf-8") as file:
-                file.write(final_output)
+                uncompressed_counter = TokenCounter()
+            compressed_counter = TokenCounter()
+            compressed = CompressedOutputWriter(processed_file, [compressed_counter])
+            with OutputWriter(output_file, [uncompressed_counter, compressed]) as writer:
+                for fragment in fragments:
+                    writer.write(fragment)
 
+            if processed_urls is not None:
+                with open(urls_list_file, 'w', encoding='utf-8') as urls_file:
+                    urls_file.write('\n'.join(processed_urls))
 
-            # Process the compressed output
-            preprocess_text(output_file, processed_file)
+            progress.update(task, advance=100)
 
-            progress.update(task, advance=50)
-
-            compressed_text = safe_file_read(processed_file)
-            compressed_token_count = get_token_count(compressed_text)
+            compressed_token_count = compressed_counter.total
             console.print(f"\n[bright_green]Compressed Token Count:[/bright_green] [bold bright_cyan]{compressed_token_count}[/bold bright_cyan]")
 
-            uncompressed_text = safe_file_read(output_file)
-            uncompressed_token_count = get_token_count(uncompressed_text)
+            uncompressed_token_count = uncompressed_counter.total
             console.print(f"[bright_green]Uncompressed Token Count:[/bright_green] [bold bright_cyan]{uncompressed_token_count}[/bold bright_cyan]")
+            if len(uncompressed_counter.items) > 1:
+                console.print(f"\n[bright_green]Largest of {len(uncompressed_counter.items)} items by tokens:[/bright_green]")
+                for name, count in uncompressed_counter.largest(TOKEN_REPORT_LIMIT):
+                    console.print(f"  [bold bright_cyan]{count:>10}[/bold bright_cyan]  {escape_markup(name)}")
 
             console.print(f"\n[bold bright_yellow]{processed_file}[/bold bright_yellow] and [bold bright_blue]{output_file}[/bold bright_blue] have been created in the working directory.")
+            if args.chunk_tokens:
+                console.print(f"[bright_green]{uncompressed_counter.records} chunks were written to {len(uncompressed_counter.shards)} shards in[/bright_green] [bold bright_blue]{escape_markup(args.chunk_dir)}[/bold bright_blue].")
 
-            pyperclip.copy(uncompressed_text)
-            console.print(f"\n[bright_white]The contents of [bold bright_blue]{output_file}[/bold bright_blue] have been copied to the clipboard.[/bright_white]")
+            if writer.bytes_written <= CLIPBOARD_MAX_BYTES:
+                pyperclip.copy(safe_file_read(output_file))
+                console.print(f"\n[bright_white]The contents of [bold bright_blue]{output_file}[/bold bright_blue] have been copied to the clipboard.[/bright_white]")
+            else:
+                console.print(f"\n[bright_white][bold bright_blue]{output_file}[/bold bright_blue] is larger than {CLIPBOARD_MAX_BYTES // (1024 * 1024)} MB and was not copied to the clipboard.[/bright_white]")
 
         except Exception as e:
             console.print(f"\n[bold red]An error occurred:[/bold red] {str(e)}")
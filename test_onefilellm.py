@@ -2,8 +2,341 @@ import unittest
 import os
 import tempfile
 import shutil
+import time
+import random
+import io
+import json
+import hashlib
+import tarfile
+import threading
+import zipfile
+import gzip
+import re
+import subprocess
+import sys
+from collections import deque
+import tiktoken
+from PyPDF2 import PdfWriter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import onefilellm
 from onefilellm import process_github_repo, process_arxiv_pdf, process_local_folder, fetch_youtube_transcript, crawl_and_extract_text, process_doi_or_pmid, process_github_pull_request, process_github_issue
 
+# Dependencies that only some source types need, so importing onefilellm must not load them.
+DEFERRED_IMPORTS = ("requests", "bs4", "PyPDF2", "tiktoken", "nltk", "nbformat", "nbconvert",
+                    "youtube_transcript_api", "pyperclip", "tqdm", "rich.console", "lxml", "selectolax",
+                    "pypdfium2", "pdfminer", "urllib.request")
+
+def measure_import(statement="import onefilellm", env=None):
+    """Run statement in a fresh interpreter under -X importtime.
+
+    Returns (completed process, {module: cumulative microseconds}, total
+    microseconds of the top-level imports). Modules the interpreter loads at
+    startup, before statement runs, are excluded.
+    """
+    def parse(stderr):
+        return [(match.group(2), int(match.group(1)))
+                for match in re.finditer(r"^import time:\s+\d+ \|\s+(\d+) \|(.*)$", stderr, re.M)]
+
+    baseline = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"], capture_output=True, text=True, env=env)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True,
+                            env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    startup = {name.strip() for name, _ in parse(baseline.stderr)}
+    imports = [(name, micros) for name, micros in parse(result.stderr) if name.strip() not in startup]
+    # Nested imports are indented under the module that triggered them.
+    total = sum(micros for name, micros in imports if not name.startswith("  "))
+    return result, {name.strip(): micros for name, micros in imports}, total
+
+class FakeHTTPServer:
+    """A threaded local HTTP server for offline tests and benchmarks.
+
+    Subclasses implement route(path) -> (status, content_type, body[, headers]). Every
+    request path is recorded in `requests` (with its arrival time in
+    `request_times`), and `latency` adds a fixed delay to each response to
+    mimic a real round trip. Responses carry an ETag and honour If-None-Match
+    unless `etags` is set to False.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.etags = True
+        self.requests = []
+        self.request_times = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this, Nagle's
+            # algorithm stalls every keep-alive response by ~40 ms.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests.append(self.path)
+                    server.request_times.append(time.monotonic())
+                if server.latency:
+                    time.sleep(server.latency)
+                status, content_type, body, *extra = server.route(self.path)
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                if server.etags and status == 200 and self.headers.get("If-None-Match") == etag:
+                    status, body = 304, b""
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if server.etags and status in (200, 304):
+                    self.send_header("ETag", etag)
+                for name, value in (extra[0] if extra else {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def route(self, raw_path):
+        raise NotImplementedError
+
+    def json(self, payload):
+        return 200, "application/json", json.dumps(payload).encode("utf-8")
+
+class FakeGitHubServer(FakeHTTPServer):
+    """A local stand-in for the GitHub REST API, raw file host and archive endpoints.
+
+    Serves a single repository built from a {path: bytes} dict so repository
+    processing can be exercised and benchmarked without network access.
+    issues maps an issue number to {"title", "body", "comments"}, and pulls
+    maps a pull request number to its API fields plus "diff", "comments",
+    "review_comments", "reviews", "commits" and "files"; list endpoints are paginated
+    with Link headers like the real API. Point
+    onefilellm.GITHUB_API_URL and onefilellm.GITHUB_RAW_URL at `url` and
+    `raw_url` while it is running. Every request path is recorded in
+    `requests`, and `latency` adds a fixed delay to each response to mimic a
+    real round trip. Responses carry an ETag and honour If-None-Match.
+    """
+
+    def __init__(self, files, owner="octo", repo="demo", branch="main", latency=0.0, issues=None, pulls=None):
+        super().__init__(latency)
+        self.files = {path: data if isinstance(data, bytes) else data.encode("utf-8") for path, data in files.items()}
+        self.issues = issues or {}
+        self.pulls = pulls or {}
+        self.owner = owner
+        self.repo = repo
+        self.branch = branch
+        self.raw_url = f"{self.url}/raw"
+        self.repo_url = f"https://github.com/{owner}/{repo}"
+
+    @staticmethod
+    def blob_sha(data):
+        return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+    def commit_sha(self):
+        """A stand-in commit SHA that changes whenever the files do."""
+        return hashlib.sha1(repr(sorted(self.files.items())).encode()).hexdigest()
+
+    def route(self, raw_path):
+        parsed = urlparse(raw_path)
+        path = unquote(parsed.path)
+        repo_prefix = f"/repos/{self.owner}/{self.repo}"
+        if path == repo_prefix:
+            return self.json({"full_name": f"{self.owner}/{self.repo}", "default_branch": self.branch})
+        if path.startswith(f"{repo_prefix}/commits/"):
+            return self.json({"sha": self.commit_sha()})
+        if path == f"{repo_prefix}/contents" or path.startswith(f"{repo_prefix}/contents/"):
+            return self.contents(path[len(f"{repo_prefix}/contents"):].strip("/"))
+        if path.startswith(f"{repo_prefix}/git/trees/"):
+            return self.tree()
+        if path.startswith(f"{repo_prefix}/tarball"):
+            return 200, "application/x-gzip", self.tarball()
+        if path.startswith(f"{repo_prefix}/zipball"):
+            return 200, "application/zip", self.zipball()
+        match = re.fullmatch(rf"{repo_prefix}/(issues|pulls)/(\d+)(?:/(\w+))?", path)
+        if match:
+            return self.issue_or_pull(match.group(1), int(match.group(2)), match.group(3), parse_qs(parsed.query))
+        if path.startswith("/diff/") and int(path[len("/diff/"):]) in self.pulls:
+            return 200, "text/plain", self.pulls[int(path[len("/diff/"):])]["diff"].encode("utf-8")
+        raw_prefix = f"/raw/{self.owner}/{self.repo}/"
+        if path.startswith(raw_prefix):
+            file_path = path[len(raw_prefix):].split("/", 1)[-1]
+            if file_path in self.files:
+                return 200, "text/plain", self.files[file_path]
+        return 404, "application/json", b'{"message": "Not Found"}'
+
+    def issue_or_pull(self, kind, number, listing, query):
+        repo_prefix = f"/repos/{self.owner}/{self.repo}"
+        if kind == "issues" and listing == "comments":
+            record = self.issues.get(number) or self.pulls.get(number)
+        else:
+            record = (self.issues if kind == "issues" else self.pulls).get(number)
+        if record is None:
+            return 404, "application/json", b'{"message": "Not Found"}'
+        if listing is None:
+            data = {key: value for key, value in record.items()
+                    if key not in ("diff", "comments", "review_comments", "reviews", "commits", "files")}
+            data["comments_url"] = f"{self.url}{repo_prefix}/issues/{number}/comments"
+            if kind == "pulls":
+                data.update(diff_url=f"{self.url}/diff/{number}", review_comments_url=f"{self.url}{repo_prefix}/pulls/{number}/comments",
+                            commits=len(record.get("commits", [])))
+            return self.json(data)
+        key = "review_comments" if kind == "pulls" and listing == "comments" else listing
+        return self.paginate(record.get(key, []), f"{self.url}{repo_prefix}/{kind}/{number}/{listing}", query)
+
+    def paginate(self, items, url, query):
+        per_page = int(query.get("per_page", ["30"])[0])
+        page = int(query.get("page", ["1"])[0])
+        last = max(1, -(-len(items) // per_page))
+        links = []
+        if page < last:
+            links.append(f'<{url}?per_page={per_page}&page={page + 1}>; rel="next"')
+            links.append(f'<{url}?per_page={per_page}&page={last}>; rel="last"')
+        status, content_type, body = self.json(items[(page - 1) * per_page:page * per_page])
+        return status, content_type, body, {"Link": ", ".join(links)} if links else {}
+
+    def contents(self, directory):
+        prefix = f"{directory}/" if directory else ""
+        entries = {}
+        for path, data in self.files.items():
+            if not path.startswith(prefix):
+                continue
+            name, _, rest = path[len(prefix):].partition("/")
+            entry_path = prefix + name
+            if rest:
+                entries[name] = {"type": "dir", "name": name, "path": entry_path,
+                                 "url": f"{self.url}/repos/{self.owner}/{self.repo}/contents/{entry_path}"}
+            else:
+                entries[name] = {"type": "file", "name": name, "path": entry_path, "size": len(data),
+                                 "sha": self.blob_sha(data),
+                                 "url": f"{self.url}/repos/{self.owner}/{self.repo}/contents/{entry_path}",
+                                 "download_url": f"{self.raw_url}/{self.owner}/{self.repo}/{self.branch}/{entry_path}"}
+        if not entries:
+            return 404, "application/json", b'{"message": "Not Found"}'
+        return self.json([entries[name] for name in sorted(entries)])
+
+    def tree(self):
+        entries, seen_dirs = [], set()
+        for path in sorted(self.files):
+            parts = path.split("/")
+            for depth in range(1, len(parts)):
+                directory = "/".join(parts[:depth])
+                if directory not in seen_dirs:
+                    seen_dirs.add(directory)
+                    entries.append({"path": directory, "type": "tree", "sha": self.blob_sha(directory.encode())})
+            data = self.files[path]
+            entries.append({"path": path, "type": "blob", "sha": self.blob_sha(data), "size": len(data)})
+        return self.json({"sha": "0" * 40, "tree": entries, "truncated": False})
+
+    def tarball(self):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+            for path in sorted(self.files):
+                info = tarfile.TarInfo(f"{self.owner}-{self.repo}-0000000/{path}")
+                info.size = len(self.files[path])
+                archive.addfile(info, io.BytesIO(self.files[path]))
+        return buffer.getvalue()
+
+    def zipball(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for path in sorted(self.files):
+                archive.writestr(f"{self.owner}-{self.repo}-0000000/{path}", self.files[path])
+        return buffer.getvalue()
+
+    def patch(self):
+        """Return a context manager that routes onefilellm's GitHub calls to this server, with a test token."""
+        return mock.patch.multiple(onefilellm, GITHUB_API_URL=self.url, GITHUB_RAW_URL=self.raw_url, TOKEN="test-token")
+
+class FakeDocsSite(FakeHTTPServer):
+    """A local documentation site for crawler tests and benchmarks.
+
+    pages maps a path such as "/docs/intro.html" to its HTML (or to a
+    (content_type, bytes) pair); anything else is a 404. generate() builds
+    a site of a given size in which every page links to a few others.
+    """
+
+    def __init__(self, pages, latency=0.0):
+        super().__init__(latency)
+        self.pages = {}
+        for path, page in pages.items():
+            if isinstance(page, str):
+                page = ("text/html; charset=utf-8", page.encode("utf-8"))
+            self.pages[path] = page
+
+    @staticmethod
+    def generate(page_count, links_per_page=5, prefix="/docs"):
+        pages = {}
+        for i in range(page_count):
+            links = "".join(f'<li><a href="{prefix}/page_{(i * links_per_page + k) % page_count}.html#top">Page</a></li>'
+                            for k in range(1, links_per_page + 1))
+            pages[f"{prefix}/page_{i}.html"] = (
+                f"<html><head><title>Page {i}</title><style>body {{}}</style></head><body>"
+                f"<h1>Page {i}</h1><!-- navigation --><p>Documentation for topic {i}.</p>"
+                f"<script>var x = {i};</script><ul>{links}</ul></body></html>"
+            )
+        pages[f"{prefix}/"] = pages[f"{prefix}/page_0.html"]
+        return pages
+
+    def route(self, raw_path):
+        page = self.pages.get(unquote(urlparse(raw_path).path))
+        if page is None:
+            return 404, "text/html", b"<html><body>Not Found</body></html>"
+        return (200, *page)
+
+def make_test_pdf(texts):
+    """A minimal PDF with one line of Helvetica text per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in texts:
+        stream = f"BT /F1 12 Tf 10 10 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 50] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(texts)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+def make_test_diff(file_count, hunks_per_file=2, hunk_lines=20):
+    """A unified diff mixing repeated lines ("}", blank) with unique ones, and one review comment per hunk line.
+
+    Returns (diff, review_comments); each comment's body names the diff line
+    (0-based, across the whole diff) it belongs under.
+    """
+    lines, comments = [], []
+    for f in range(file_count):
+        path = f"src/module_{f}.c"
+        lines += [f"diff --git a/{path} b/{path}", "index 000..111 100644", f"--- a/{path}", f"+++ b/{path}"]
+        position = 0
+        for h in range(hunks_per_file):
+            lines.append(f"@@ -{h * 50 + 1},{hunk_lines} +{h * 50 + 1},{hunk_lines} @@")
+            if h:
+                position += 1
+            for i in range(hunk_lines):
+                lines.append(["}", "", "-- removed sql comment", f"+    return {len(lines)};", " int x;"][i % 5])
+                position += 1
+                comments.append({"user": {"login": "reviewer"}, "path": path, "position": position,
+                                 "original_line": i, "body": f"after line {len(lines) - 1}"})
+    return "\n".join(lines), comments
+
 class TestDataAggregation(unittest.TestCase):
     def setUp(self):
         self.temp_dir = tempfile.mkdtemp()
@@ -102,5 +435,1473 @@ class TestDataAggregation(unittest.TestCase):
         self.assertIn('<repository>', issue_content)
         print("GitHub issue processing test passed.")
 
+class TestConcurrentFetching(unittest.TestCase):
+    def test_ordered_map_preserves_order(self):
+        print("\nTesting ordered_map result ordering...")
+        def slow_square(n):
+            time.sleep(random.uniform(0, 0.01))
+            return n * n
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(onefilellm.ordered_map(executor, slow_square, range(50), window=4))
+        self.assertEqual(results, [n * n for n in range(50)])
+        print("ordered_map result ordering test passed.")
+
+    def test_list_github_contents_is_depth_first(self):
+        print("\nTesting concurrent GitHub listing order...")
+        listings = {
+            "root": [
+                {"type": "dir", "name": "a", "path": "a", "url": "a"},
+                {"type": "file", "name": "b.py", "path": "b.py"},
+                {"type": "dir", "name": "c", "path": "c", "url": "c"},
+            ],
+            "a": [
+                {"type": "file", "name": "x.md", "path": "a/x.md"},
+                {"type": "file", "name": "logo.png", "path": "a/logo.png"},
+            ],
+            "c": [{"type": "file", "name": "y.js", "path": "c/y.js"}],
+        }
+        def fake_get_json(url):
+            time.sleep(random.uniform(0, 0.01))
+            return listings[url]
+        with mock.patch.object(onefilellm, "github_get_json", fake_get_json), ThreadPoolExecutor(max_workers=4) as executor:
+            files = onefilellm.list_github_contents("root", executor)
+        self.assertEqual([f["path"] for f in files], ["a/x.md", "b.py", "c/y.js"])
+        print("Concurrent GitHub listing order test passed.")
+
+class TestGitHubRepoModes(unittest.TestCase):
+    files = {
+        "README.md": "# Demo\n",
+        "src/app.py": "print('a < b & c')\n",
+        "src/util/helpers.js": "export const x = 1;\n",
+        "src/logo.png": b"\x89PNG\r\n",
+        "docs/guide.md": "Guide\n",
+    }
+
+    def setUp(self):
+        onefilellm.configure_cache(enabled=False)
+
+    def test_modes_produce_same_files(self):
+        print("\nTesting GitHub repository modes against the fake server...")
+        outputs = {}
+        with FakeGitHubServer(self.files) as server, server.patch():
+            for mode in onefilellm.GITHUB_REPO_MODES:
+                outputs[mode] = process_github_repo(server.repo_url, mode=mode)
+                file_names = [line for line in outputs[mode].split("\n") if line.startswith("<file ")]
+                self.assertEqual(sorted(file_names), [
+                    '<file name="README.md">', '<file name="docs/guide.md">', '<file name="src/app.py">',
+                    '<file name="src/util/helpers.js">'])
+                self.assertIn("print('a &lt; b &amp; c')", outputs[mode])
+        print("GitHub repository modes test passed.")
+
+    def test_single_listing_request(self):
+        print("\nTesting request counts for tree and tarball modes...")
+        with FakeGitHubServer(self.files) as server, server.patch():
+            process_github_repo(server.repo_url, mode="tree")
+            listing_requests = [path for path in server.requests if "/contents" in path or "/git/trees/" in path]
+            self.assertEqual(len(listing_requests), 1)
+            server.requests.clear()
+            process_github_repo(f"{server.repo_url}/tree/main/src", mode="tarball")
+            self.assertEqual(len(server.requests), 1)
+        print("Tree and tarball request count test passed.")
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        onefilellm.configure_cache(enabled=False)
+        shutil.rmtree(self.cache_dir)
+
+    def test_warm_cache_skips_downloads(self):
+        print("\nTesting repository re-flatten with a warm cache...")
+        onefilellm.configure_cache(self.cache_dir)
+        files = {"a.py": "a = 1\n", "pkg/b.md": "# b\n", "pkg/c.txt": "c\n"}
+        with FakeGitHubServer(files) as server, server.patch():
+            first = process_github_repo(server.repo_url)
+            server.requests.clear()
+            second = process_github_repo(server.repo_url)
+            self.assertEqual(first, second)
+            self.assertFalse([path for path in server.requests if path.startswith("/raw/")])
+            self.assertEqual(len(server.requests), 3)  # a conditional commit lookup and two directory listings
+        print("Warm cache re-flatten test passed.")
+
+    def test_moved_branch_is_not_cached_under_listed_sha(self):
+        print("\nTesting that a download not matching its listed SHA is not cached...")
+        cache = onefilellm.configure_cache(self.cache_dir)
+        listed_sha = FakeGitHubServer.blob_sha(b"old = 1\n")
+        with FakeGitHubServer({"a.py": "new = 2\n"}) as server, server.patch():
+            file = {"path": "a.py", "sha": listed_sha, "size": 8, "download_url": f"{server.raw_url}/octo/demo/main/a.py"}
+            self.assertIn("new = 2", onefilellm.fetch_github_file(file))
+            self.assertIsNone(cache.get_blob(listed_sha))
+            current_sha = FakeGitHubServer.blob_sha(b"new = 2\n")
+            onefilellm.fetch_github_file(dict(file, sha=current_sha))
+            self.assertEqual(cache.get_blob(current_sha), b"new = 2\n")
+        print("Blob SHA check test passed.")
+
+    def test_lru_eviction(self):
+        print("\nTesting cache LRU eviction...")
+        cache = onefilellm.DiskCache(self.cache_dir, max_bytes=300)
+        for sha in ("aa01", "bb02", "cc03"):
+            cache.put_blob(sha, b"x" * 100)
+            time.sleep(0.01)
+        self.assertIsNotNone(cache.get_blob("aa01"))  # touch, so bb02 is now the oldest
+        cache.put_blob("dd04", b"x" * 100)
+        self.assertIsNone(cache.get_blob("bb02"))
+        self.assertIsNotNone(cache.get_blob("aa01"))
+        self.assertIsNotNone(cache.get_blob("dd04"))
+        print("Cache LRU eviction test passed.")
+
+    def test_overwritten_entries_are_not_counted_twice(self):
+        print("\nTesting the cache size after overwriting entries...")
+        cache = onefilellm.DiskCache(self.cache_dir, max_bytes=300)
+        for sha in ("aa01", "bb02"):
+            cache.put_blob(sha, b"x" * 100)
+        for _ in range(5):
+            cache.put_response("https://example.com/page", {"etag": '"v1"'}, b"y" * 40)
+        cache.put_blob("aa01", b"x" * 50)
+        self.assertIsNotNone(cache.get_blob("aa01"))
+        self.assertIsNotNone(cache.get_blob("bb02"))
+        self.assertEqual(cache._size, sum(size for _, size, _ in cache._entries()))
+        print("Cache overwrite size test passed.")
+
+class TestIncrementalLocalFolder(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.folder = os.path.join(self.temp_dir, "project")
+        self.output_file = os.path.join(self.temp_dir, "uncompressed_output.txt")
+        for relative_path, text in {"a.py": "x = 1 < 2\n", "docs/b.md": "# B\n", "docs/c.txt": "caf\u00e9\n"}.items():
+            self.write(relative_path, text)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, relative_path, text):
+        path = os.path.join(self.folder, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def flatten(self):
+        output = process_local_folder(self.folder, incremental_output=self.output_file)
+        with open(self.output_file, "w", encoding="utf-8", newline="") as f:
+            f.write(output)
+        return output
+
+    def test_incremental_matches_full_run(self):
+        print("\nTesting incremental local folder re-flatten...")
+        self.flatten()
+        self.write("docs/b.md", "# B, edited\n")
+        self.write("new.js", "let y = 2;\n")
+        with mock.patch.object(onefilellm, "render_local_file", wraps=onefilellm.render_local_file) as render:
+            incremental = self.flatten()
+        self.assertEqual(sorted(call.args[1] for call in render.call_args_list), [os.path.join("docs", "b.md"), "new.js"])
+        self.assertEqual(incremental, process_local_folder(self.folder))
+        self.assertEqual(self.flatten(), incremental)
+        print("Incremental local folder re-flatten test passed.")
+
+class TestStreamingOutput(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_writer_matches_joined_output(self):
+        print("\nTesting streamed output against the joined document...")
+        local_path = os.path.dirname(os.path.abspath(__file__))
+        output_file = os.path.join(self.temp_dir, "uncompressed_output.txt")
+        fed = []
+
+        class Recorder:
+            def feed(self, text):
+                fed.append(text)
+            def close(self):
+                pass
+
+        with onefilellm.OutputWriter(output_file, [Recorder()]) as writer:
+            for fragment in onefilellm.iter_local_folder(local_path):
+                writer.write(fragment)
+        expected = process_local_folder(local_path)
+        with open(output_file, "r", encoding="utf-8", newline="") as f:
+            self.assertEqual(f.read(), expected)
+        self.assertEqual("".join(fed), expected)
+        self.assertEqual(writer.bytes_written, len(expected.encode("utf-8")))
+        self.assertFalse(os.path.exists(output_file + ".tmp"))
+        print("Streamed output test passed.")
+
+class TestParallelLocalFolder(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        notebook = {"cells": [{"cell_type": "code", "execution_count": None, "metadata": {}, "outputs": [],
+                               "source": ["print(1 < 2)"]}],
+                    "metadata": {}, "nbformat": 4, "nbformat_minor": 5}
+        for i in range(20):
+            os.makedirs(os.path.join(self.temp_dir, f"dir{i % 4}"), exist_ok=True)
+            with open(os.path.join(self.temp_dir, f"dir{i % 4}", f"file{i}.py"), "w", encoding="utf-8") as f:
+                f.write(f"value = {i} & {i + 1}\n" * (i + 1))
+        with open(os.path.join(self.temp_dir, "analysis.ipynb"), "w", encoding="utf-8") as f:
+            json.dump(notebook, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_jobs_output_is_identical(self):
+        print("\nTesting parallel local folder processing...")
+        serial = process_local_folder(self.temp_dir)
+        parallel = process_local_folder(self.temp_dir, jobs=3)
+        self.assertEqual(parallel, serial)
+        self.assertIn("print(1 &lt; 2)", parallel)
+        print("Parallel local folder processing test passed.")
+
+class TestLocalWalker(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        for relative_path, text in {
+            "main.py": "main\n",
+            "debug.log.txt": "log\n",
+            ".gitignore": "*.log.txt\n/generated/\n",
+            "generated/out.py": "generated\n",
+            "node_modules/pkg/index.js": "dependency\n",
+            "src/app.ts": "app\n",
+            "src/.ignore": "secret.ts\n",
+            "src/secret.ts": "secret\n",
+            "src/lib/generated/util.py": "nested generated dir is not anchored\n",
+            "docs/guide.md": "guide\n",
+        }.items():
+            path = os.path.join(self.temp_dir, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+
+    def tearDown(self):
+        onefilellm.configure_filetypes()
+        shutil.rmtree(self.temp_dir)
+
+    def walk(self, **kwargs):
+        return [relative.replace(os.sep, "/") for _, relative in onefilellm.walk_local_files(self.temp_dir, **kwargs)]
+
+    def test_prunes_and_honours_ignore_files(self):
+        print("\nTesting local walker pruning and ignore files...")
+        with mock.patch.object(onefilellm.IgnoreMatcher, "is_ignored", autospec=True,
+                               side_effect=onefilellm.IgnoreMatcher.is_ignored) as is_ignored:
+            files = self.walk()
+        self.assertEqual(files, ["main.py", "docs/guide.md", "src/app.ts", "src/lib/generated/util.py"])
+        self.assertFalse([call for call in is_ignored.call_args_list if call.args[1].startswith("node_modules/")])
+        self.assertIn("src/secret.ts", self.walk(use_ignore_files=False))
+        print("Local walker pruning test passed.")
+
+    def test_include_and_exclude_globs(self):
+        print("\nTesting include and exclude globs...")
+        onefilellm.configure_filetypes(include=["*.ts", "docs/**"], exclude=["secret.*"])
+        self.assertEqual(self.walk(use_ignore_files=False), ["docs/guide.md", "src/app.ts"])
+        self.assertTrue(onefilellm.is_allowed_path("src/app.ts"))
+        self.assertFalse(onefilellm.is_allowed_path("src/secret.ts"))
+        self.assertFalse(onefilellm.is_allowed_path("main.py"))
+        print("Include and exclude globs test passed.")
+
+class TestFileTypeClassifier(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        onefilellm.configure_filetypes(config_path=None)
+        shutil.rmtree(self.temp_dir)
+
+    def test_matches_legacy_extension_scan(self):
+        print("\nTesting classifier against the legacy extension scan...")
+        classifier = onefilellm.FileTypeClassifier()
+        names = ["a.py", "b.PY", "c.d.ts", ".localhost", "dir/x.example", "noext", "x.pyc", "archive.tar.gz",
+                 "trailing.", "dir.md/file", "types.tsx", "script.sh.bak", "data.json"]
+        for name in names:
+            legacy = any(name.endswith(ext) for ext in onefilellm.ALLOWED_EXTENSIONS)
+            self.assertEqual(classifier.matches(name), legacy, name)
+        print("Classifier legacy equivalence test passed.")
+
+    def test_config_file_and_binary_sniffing(self):
+        print("\nTesting classifier config file and binary sniffing...")
+        config_path = os.path.join(self.temp_dir, "filetypes.json")
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump({"extensions": [".rs", ".d.ts"], "exclude_extensions": [".txt"], "names": ["Makefile"]}, f)
+        onefilellm.configure_filetypes(config_path=config_path)
+        self.assertTrue(onefilellm.is_allowed_filetype("src/main.rs"))
+        self.assertTrue(onefilellm.is_allowed_filetype("Makefile"))
+        self.assertTrue(onefilellm.is_allowed_filetype("index.d.ts"))
+        self.assertFalse(onefilellm.is_allowed_filetype("notes.txt"))
+
+        folder = os.path.join(self.temp_dir, "project")
+        os.makedirs(folder)
+        with open(os.path.join(folder, "image.rs"), "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n\x00\x00")
+        with open(os.path.join(folder, "lib.rs"), "w", encoding="utf-8") as f:
+            f.write("fn main() {}\n")
+        output = process_local_folder(folder)
+        self.assertIn('<file name="lib.rs">', output)
+        self.assertNotIn("image.rs", output)
+        print("Classifier config and binary sniffing test passed.")
+
+class TestReadLimits(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        onefilellm.configure_cache(enabled=False)
+        self.files = {"small.py": "x = 1\n", "big.py": "y = 2\n" * 1000, "later.py": "z = 3\n"}
+        for name, text in self.files.items():
+            with open(os.path.join(self.temp_dir, name), "w", encoding="utf-8") as f:
+                f.write(text)
+
+    def tearDown(self):
+        onefilellm.configure_read_limits()
+        shutil.rmtree(self.temp_dir)
+
+    def test_truncate_and_skip_local(self):
+        print("\nTesting per-file and total size limits on a local folder...")
+        onefilellm.configure_read_limits(max_file_bytes=100)
+        output = process_local_folder(self.temp_dir)
+        self.assertIn('<truncated bytes="6000" kept_bytes="100"/>', output)
+        self.assertIn("x = 1", output)
+
+        onefilellm.configure_read_limits(max_file_bytes=100, oversize="skip")
+        output = process_local_folder(self.temp_dir)
+        self.assertIn('<skipped name="big.py" bytes="6000" reason="exceeds per-file size limit"/>', output)
+        self.assertNotIn("y = 2", output)
+
+        onefilellm.configure_read_limits(max_file_bytes=None, max_total_bytes=106, oversize="truncate")
+        output = process_local_folder(self.temp_dir)
+        self.assertEqual(output.count("y = 2"), 17)
+        self.assertIn('reason="total size limit reached"', output)
+        print("Local size limit test passed.")
+
+    def test_limits_apply_to_every_github_mode(self):
+        print("\nTesting size limits across GitHub repository modes...")
+        onefilellm.configure_read_limits(max_file_bytes=100)
+        with FakeGitHubServer(self.files) as server, server.patch():
+            outputs = [process_github_repo(server.repo_url, mode=mode) for mode in onefilellm.GITHUB_REPO_MODES]
+        for output in outputs:
+            self.assertIn('<truncated bytes="6000" kept_bytes="100"/>', output)
+            self.assertIn("z = 3", output)
+        self.assertEqual(len(set(outputs)), 1)
+        print("GitHub size limit test passed.")
+
+    def test_mmap_read(self):
+        print("\nTesting memory-mapped reads of large files...")
+        path = os.path.join(self.temp_dir, "huge.txt")
+        with open(path, "wb") as f:
+            f.write(b"a" * (onefilellm.MMAP_THRESHOLD + 10))
+        data, size = onefilellm.read_file_bytes(path, 5)
+        self.assertEqual((data, size), (b"aaaaa", onefilellm.MMAP_THRESHOLD + 10))
+        with open(path, "rb") as f:
+            self.assertEqual(onefilellm.hash_file(path), hashlib.sha256(f.read()).hexdigest())
+        print("Memory-mapped read test passed.")
+
+def make_test_encoding():
+    """A small byte-level BPE with the cl100k pre-tokenizer, which needs no download."""
+    ranks = {bytes([i]): i for i in range(256)}
+    for merge in (b"  ", b"\n\n", b" a", b"    ", b"ab"):
+        ranks[merge] = len(ranks)
+    return tiktoken.Encoding(
+        "onefilellm-test",
+        pat_str=r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+""",
+        mergeable_ranks=ranks,
+        special_tokens={},
+    )
+
+class TestTokenCounting(unittest.TestCase):
+    def setUp(self):
+        self.encoding = onefilellm._encoding = make_test_encoding()
+
+    def tearDown(self):
+        onefilellm._encoding = None
+
+    def test_chunked_count_matches_whole_text(self):
+        print("\nTesting chunked token counts against encoding the whole text...")
+        random.seed(7)
+        words = ["ab", " a", "x", "\n\n", "    ", "<file name=\"a b.py\">", "</file>", "a b ab", "\t"]
+        text = "".join(random.choice(words) for _ in range(5000))
+        expected = len(self.encoding.encode_ordinary(onefilellm.TAG_PATTERN.sub("", text)))
+        for chunk_size in (64, 256, 1000):
+            self.assertEqual("".join(onefilellm.split_token_chunks(text, chunk_size)), text)
+            self.assertEqual(onefilellm.get_token_count(text, chunk_size=chunk_size), expected)
+        with mock.patch.object(onefilellm, "PARALLEL_TOKEN_CHARS", 0):
+            self.assertEqual(onefilellm.get_token_count(text, chunk_size=64), expected)
+        print("Chunked token count test passed.")
+
+    def test_chunks_never_split_punctuation_from_its_newlines(self):
+        print("\nTesting chunked token counts after punctuation and newlines...")
+        text = "word word word.\n\nnext " * 400 + "a, b;\r\n\tc:\n  d 123 456.\n" * 100
+        expected = len(self.encoding.encode_ordinary(text))
+        for chunk_size in (16, 64, 1000, 65536):
+            pieces = list(onefilellm.split_token_chunks(text, chunk_size))
+            self.assertEqual("".join(pieces), text)
+            self.assertFalse([piece for piece in pieces[:-1] if piece.endswith((".", ",", ";", ":"))])
+            self.assertEqual(onefilellm.get_token_count(text, chunk_size=chunk_size), expected)
+        writer = onefilellm.ChunkWriter(tempfile.mkdtemp(), max_tokens=20)
+        self.addCleanup(shutil.rmtree, writer.directory)
+        units = list(writer._units(text))
+        self.assertEqual("".join(piece for piece, _ in units), text)
+        self.assertEqual(sum(tokens for _, tokens in units), expected)
+        writer.abort()
+        print("Punctuation boundary test passed.")
+
+    def test_per_item_counts(self):
+        print("\nTesting per-file token counts...")
+        counter = onefilellm.TokenCounter()
+        fragments = ['<source type="local_directory" path="x">', '<file name="a.py">\nab ab\n</file>',
+                     '<page url="http://x/">\nabc\n</page>', '</source>']
+        for i, fragment in enumerate(fragments):
+            counter.feed(fragment if i == 0 else "\n" + fragment)
+        self.assertEqual(set(counter.items), {"a.py", "http://x/"})
+        self.assertEqual(counter.total, sum(counter.items.values()) + 1)
+        self.assertEqual(counter.largest(1)[0][0], "a.py")
+        print("Per-file token count test passed.")
+
+class TestTextCompressor(unittest.TestCase):
+    def compress(self, text, chunk_size):
+        parts = []
+        compressor = onefilellm.TextCompressor(parts.append)
+        for i in range(0, len(text), chunk_size):
+            compressor.feed(text[i:i + chunk_size])
+        compressor.close()
+        return "".join(parts)
+
+    def test_chunking_does_not_change_output(self):
+        print("\nTesting the streaming compressor...")
+        document = ('<source type="local_directory" path="x">\n'
+                    '<file name="a.py">\nThe Quick  brown\n\nfox &amp; the &lt;Dog&gt; \u00e9t\u00e9\n</file>\n'
+                    '<file name="b.md">\nIt is a very long line of words\n</file>\n</source>')
+        expected = ('<source type="local_directory" path="x"><file name="a.py">quick brown fox &amp; &lt;dog&gt;</file>'
+                    '<file name="b.md">long line words</file></source>')
+        for chunk_size in (1, 3, 7, 64, len(document)):
+            self.assertEqual(self.compress(document, chunk_size), expected)
+        print("Streaming compressor test passed.")
+
+    def test_preprocess_text_file(self):
+        print("\nTesting preprocess_text on a file...")
+        temp_dir = tempfile.mkdtemp()
+        try:
+            source, target = os.path.join(temp_dir, "in.txt"), os.path.join(temp_dir, "out.txt")
+            with open(source, "w", encoding="utf-8") as f:
+                f.write('<source type="x">\n<page url="http://x/?a=1&amp;b=2">\nHello   World\n</page>\n</source>')
+            with mock.patch.object(onefilellm, "COMPRESS_CHUNK_CHARS", 5):
+                onefilellm.preprocess_text(source, target)
+            with open(target, encoding="utf-8") as f:
+                self.assertEqual(f.read(), "<?xml version='1.0' encoding='utf-8'?>\n"
+                                           '<source type="x"><page url="http://x/?a=1&amp;b=2">hello world</page></source>')
+        finally:
+            shutil.rmtree(temp_dir)
+        print("preprocess_text test passed.")
+
+    def test_compressed_output_is_written_in_the_same_pass(self):
+        print("\nTesting the compressed output consumer...")
+        onefilellm._encoding = make_test_encoding()
+        self.addCleanup(setattr, onefilellm, "_encoding", None)
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        output, compressed, expected = (os.path.join(temp_dir, name) for name in ("out.txt", "compressed.txt", "expected.txt"))
+        fragments = ['<source type="local_directory" path="x">', '<file name="a.py">\nThe Quick  brown\n\nfox &amp; the Dog\n</file>',
+                     '<file name="b.md">\nIt is a very long line of words\n</file>', '</source>']
+        counter = onefilellm.TokenCounter()
+        with onefilellm.OutputWriter(output, [onefilellm.CompressedOutputWriter(compressed, [counter])]) as writer:
+            for fragment in fragments:
+                writer.write(fragment)
+        onefilellm.preprocess_text(output, expected)
+        with open(compressed, encoding="utf-8") as f, open(expected, encoding="utf-8") as g:
+            text = f.read()
+            self.assertEqual(text, g.read())
+        # Counted fragment by fragment, like the uncompressed output, so words either side of a fragment boundary are not merged.
+        self.assertAlmostEqual(counter.total, onefilellm.get_token_count(text), delta=len(fragments))
+        self.assertGreater(counter.total, 0)
+        self.assertEqual(sorted(os.listdir(temp_dir)), ["compressed.txt", "expected.txt", "out.txt"])
+        print("Compressed output consumer test passed.")
+
+class TestCrawler(unittest.TestCase):
+    def setUp(self):
+        onefilellm.configure_cache(enabled=False)
+
+    def serial_crawl_order(self, pages, start, max_depth):
+        """The page order of the original one-page-at-a-time breadth-first crawl."""
+        order, queue, seen = [], deque([(start, 0)]), set()
+        while queue:
+            path, depth = queue.popleft()
+            if path in seen or path not in pages:
+                continue
+            seen.add(path)
+            order.append(path)
+            if depth < max_depth:
+                for href in re.findall(r'href="([^"#]+)', pages[path]):
+                    queue.append((href, depth + 1))
+        return order
+
+    def test_concurrent_crawl_matches_serial_order(self):
+        print("\nTesting the concurrent crawler against a local site...")
+        pages = FakeDocsSite.generate(60, links_per_page=4)
+        with FakeDocsSite(pages, latency=0.005) as site:
+            result = crawl_and_extract_text(f"{site.url}/docs/", 2, False, True, max_workers=8, rate_limit=None)
+            expected = [f"{site.url}{path}" for path in self.serial_crawl_order(pages, "/docs/", 2)]
+            self.assertEqual(result["processed_urls"], expected)
+            self.assertEqual(len(site.requests), len(set(site.requests)))
+        self.assertIn("Documentation for topic 0.", result["content"])
+        self.assertNotIn("var x", result["content"])
+        self.assertNotIn("navigation", result["content"])
+        print("Concurrent crawler test passed.")
+
+    def test_per_host_rate_limit(self):
+        print("\nTesting the per-host crawl rate limit...")
+        with FakeDocsSite(FakeDocsSite.generate(10, links_per_page=3)) as site:
+            crawl_and_extract_text(f"{site.url}/docs/", 3, False, True, max_workers=8, rate_limit=50)
+            times = sorted(t for path, t in zip(site.requests, site.request_times) if path.startswith("/docs/"))
+        self.assertGreater(len(times), 5)
+        # Requests are scheduled 20 ms apart; allow for jitter in when they arrive.
+        self.assertGreaterEqual((times[-1] - times[0]) / (len(times) - 1), 0.018)
+        print("Crawl rate limit test passed.")
+
+class TestCrawlPlanning(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        onefilellm.configure_cache(self.cache_dir)
+
+    def tearDown(self):
+        onefilellm.configure_cache(enabled=False)
+        shutil.rmtree(self.cache_dir)
+
+    def sitemap(self, site, entries):
+        urls = "".join(f"<url><loc>{site.url}{path}</loc><lastmod>{lastmod}</lastmod></url>" for path, lastmod in entries)
+        return ("application/xml", f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'.encode("utf-8"))
+
+    def test_sitemap_seeds_frontier_and_lastmod_skips_refetch(self):
+        print("\nTesting sitemap and robots.txt crawl planning...")
+        pages = FakeDocsSite.generate(20, links_per_page=1)
+        with FakeDocsSite(pages) as site:
+            # Pages only link to their neighbour, so link discovery at depth 1 finds two pages.
+            site.pages["/robots.txt"] = ("text/plain", f"User-agent: *\nDisallow: /docs/page_3.html\nSitemap: {site.url}/maps/index.xml\n".encode())
+            site.pages["/maps/index.xml"] = ("application/xml", (
+                '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                f"<sitemap><loc>{site.url}/maps/docs.xml.gz</loc></sitemap></sitemapindex>").encode())
+            content_type, body = self.sitemap(site, [(f"/docs/page_{i}.html", "2000-01-01") for i in range(20)] + [("/blog/", "2000-01-01")])
+            site.pages["/maps/docs.xml.gz"] = ("application/gzip", gzip.compress(body))
+
+            linked = crawl_and_extract_text(f"{site.url}/docs/", 1, False, True, rate_limit=None, plan="links")
+            self.assertEqual(len(linked["processed_urls"]), 2)
+
+            site.requests.clear()
+            planned = crawl_and_extract_text(f"{site.url}/docs/", 1, False, True, rate_limit=None)
+            expected = [f"{site.url}/docs/"] + [f"{site.url}/docs/page_{i}.html" for i in range(20) if i != 3]
+            self.assertEqual(planned["processed_urls"], expected)
+            self.assertNotIn("/docs/page_3.html", site.requests)
+
+            # Everything is now cached after its 2000-01-01 lastmod, so only the plan is fetched again.
+            site.requests.clear()
+            again = crawl_and_extract_text(f"{site.url}/docs/", 1, False, True, rate_limit=None)
+            self.assertEqual(again, planned)
+            self.assertEqual(sorted(site.requests), ["/docs/", "/maps/docs.xml.gz", "/maps/index.xml", "/robots.txt"])
+        print("Crawl planning test passed.")
+
+    def test_lastmod_skips_refetch_without_validators(self):
+        print("\nTesting sitemap lastmod on a server that sends no validators...")
+        with FakeDocsSite(FakeDocsSite.generate(5, links_per_page=1)) as site:
+            site.etags = False
+            site.pages["/robots.txt"] = ("text/plain", f"Sitemap: {site.url}/sitemap.xml\n".encode())
+            site.pages["/sitemap.xml"] = self.sitemap(site, [(f"/docs/page_{i}.html", "2000-01-01") for i in range(5)])
+            first = crawl_and_extract_text(f"{site.url}/docs/", 1, False, True, rate_limit=None, plan="sitemap")
+            site.requests.clear()
+            again = crawl_and_extract_text(f"{site.url}/docs/", 1, False, True, rate_limit=None, plan="sitemap")
+            self.assertEqual(again, first)
+            self.assertFalse([path for path in site.requests if path.startswith("/docs/page_")])
+        print("Validator-less lastmod test passed.")
+
+class TestHTMLExtractors(unittest.TestCase):
+    def setUp(self):
+        onefilellm.configure_cache(enabled=False)
+
+    def tearDown(self):
+        onefilellm.configure_html_extractor()
+
+    def test_extractors_agree_with_beautifulsoup(self):
+        print("\nTesting HTML extractor backends against BeautifulSoup...")
+        pages = list(FakeDocsSite.generate(3).values()) + [
+            "<!DOCTYPE html><html><head><meta charset='utf-8'><title>T</title>"
+            "<script>var a = '<p>not text</p>';</script></head>"
+            "<body><p>Fish &amp; chips &lt;3</p><!-- hidden --><a href='/x'>Link</a><a name='anchor'>No href</a>"
+            "<style>p { color: red }</style><div>  caf\u00e9  <br/>two\n  lines </div></body></html>",
+        ]
+        for page in pages:
+            expected = onefilellm.extract_html_bs4(page.encode("utf-8"), "utf-8")
+            for name in onefilellm.available_html_extractors():
+                self.assertEqual(onefilellm.HTML_EXTRACTORS[name](page.encode("utf-8"), "utf-8"), expected, name)
+        print("HTML extractor test passed.")
+
+    def test_content_type_sniffing(self):
+        print("\nTesting content-type sniffing while crawling...")
+        pdf = io.BytesIO()
+        writer = PdfWriter()
+        writer.add_blank_page(width=72, height=72)
+        writer.write(pdf)
+        pages = {
+            "/docs/": '<a href="manual.pdf">PDF</a> <a href="notes.txt">Notes</a> <a href="logo">Logo</a> <a href="raw">Raw</a>',
+            "/docs/manual.pdf": ("application/pdf", pdf.getvalue()),
+            "/docs/notes.txt": ("text/plain", b"plain <notes>"),
+            "/docs/logo": ("image/png", b"\x89PNG\r\n\x1a\n\x00\x00"),
+            "/docs/raw": ("application/octet-stream", b"<html><body><p>Sniffed page</p></body></html>"),
+        }
+        with FakeDocsSite(pages) as site:
+            result = crawl_and_extract_text(f"{site.url}/docs/", 1, True, True, rate_limit=None)
+            self.assertEqual(sorted(site.requests), ["/docs/", "/docs/logo", "/docs/manual.pdf", "/docs/notes.txt", "/docs/raw",
+                                                     "/robots.txt", "/sitemap.xml"])
+            self.assertNotIn(f"{site.url}/docs/logo", result["processed_urls"])
+        self.assertIn("plain &lt;notes&gt;", result["content"])
+        self.assertIn("Sniffed page", result["content"])
+        self.assertIn(f'<page url="{site.url}/docs/manual.pdf">', result["content"])
+        print("Content-type sniffing test passed.")
+
+class TestPDFExtraction(unittest.TestCase):
+    def setUp(self):
+        onefilellm.configure_cache(enabled=False)
+
+    def test_page_budget_and_process_pool(self):
+        print("\nTesting in-memory PDF extraction...")
+        texts = [f"Page {i}" for i in range(onefilellm.PDF_PARALLEL_MIN_PAGES + 5)]
+        data = make_test_pdf(texts)
+        self.assertEqual(onefilellm.extract_pdf_text(data, max_pages=3), "Page 0 Page 1 Page 2")
+        serial = onefilellm.extract_pdf_text(data, jobs=1)
+        self.assertEqual(serial, " ".join(texts))
+        self.assertEqual(onefilellm.extract_pdf_text(data, jobs=3), serial)
+        print("PDF extraction test passed.")
+
+    def test_worker_threads_extract_serially(self):
+        print("\nTesting PDF extraction off the main thread...")
+        data = make_test_pdf([f"Page {i}" for i in range(onefilellm.PDF_PARALLEL_MIN_PAGES + 5)])
+        with mock.patch.object(onefilellm, "ProcessPoolExecutor", side_effect=AssertionError("pool started")):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                texts = list(executor.map(lambda _: onefilellm.extract_pdf_text(data, jobs=4), range(2)))
+        self.assertEqual(texts[0], onefilellm.extract_pdf_text(data, jobs=1))
+        self.assertEqual(texts[0], texts[1])
+        print("Worker thread PDF extraction test passed.")
+
+    def test_pdfium_is_used_by_one_thread_at_a_time(self):
+        print("\nTesting that PDFium calls never overlap...")
+        active, overlaps, lock = [0], [], threading.Lock()
+
+        def pdfium_call(result):
+            def call(*args):
+                with lock:
+                    active[0] += 1
+                    overlaps.append(active[0] > 1)
+                time.sleep(0.002)
+                with lock:
+                    active[0] -= 1
+                return result(*args)
+            return call
+
+        document = mock.Mock()
+        document.close.side_effect = pdfium_call(lambda: None)
+        with mock.patch.object(onefilellm, "_open_pdf", pdfium_call(lambda data, backend: document)), \
+             mock.patch.object(onefilellm, "_pdf_page_count", pdfium_call(lambda document, backend: 20)), \
+             mock.patch.object(onefilellm, "_pdf_page_texts", pdfium_call(lambda document, backend, start, stop: ["x"] * (stop - start))):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                texts = list(executor.map(lambda _: onefilellm.extract_pdf_text(b"", jobs=1, backend="pypdfium2"), range(8)))
+        self.assertEqual(texts, [" ".join(["x"] * 20)] * 8)
+        self.assertEqual(document.close.call_count, 8)
+        self.assertFalse(any(overlaps))
+        print("PDFium lock test passed.")
+
+    def test_arxiv_uses_no_temp_files(self):
+        print("\nTesting arXiv processing without temp files...")
+        with FakeDocsSite({"/pdf/1234.5678.pdf": ("application/pdf", make_test_pdf(["Attention", "Results"]))}) as site:
+            cwd = os.getcwd()
+            temp_dir = tempfile.mkdtemp()
+            try:
+                os.chdir(temp_dir)
+                output = process_arxiv_pdf(f"{site.url}/abs/1234.5678")
+                self.assertEqual(os.listdir(temp_dir), [])
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(temp_dir)
+        self.assertIn("<paper>\nAttention Results\n</paper>", output)
+        print("arXiv temp file test passed.")
+
+class TestPullRequestDiff(unittest.TestCase):
+    def test_comments_follow_their_diff_lines(self):
+        print("\nTesting review comment placement in pull request diffs...")
+        diff, comments = make_test_diff(3)
+        outdated = {"user": {"login": "reviewer"}, "path": "src/module_0.c", "position": None, "original_line": 7, "body": "outdated"}
+        random.seed(3)
+        shuffled = random.sample(comments, len(comments)) + [outdated]
+        rendered = "".join(onefilellm.render_pull_request_diff(diff, shuffled, []))
+
+        line_number = -1
+        placed = 0
+        for chunk in re.split(r"(<review_comment>\n.*?</review_comment>\n)", rendered, flags=re.S):
+            if chunk.startswith("<review_comment>"):
+                body = re.search(r"<content>(.*)</content>", chunk).group(1)
+                if body == "outdated":
+                    self.assertEqual(placed, len(comments))
+                else:
+                    self.assertEqual(body, f"after line {line_number}")
+                placed += 1
+            else:
+                line_number += chunk.count("\n")
+        self.assertEqual(placed, len(comments) + 1)
+        print("Review comment placement test passed.")
+
+class TestGitHubIssuesAndPulls(unittest.TestCase):
+    def setUp(self):
+        onefilellm.configure_cache(enabled=False)
+        self.files = {"app.py": "line 1\nline 2\nline 3\nline 4\n"}
+
+    def comment(self, i, body=None):
+        return {"id": i, "user": {"login": f"user{i % 7}"}, "body": body or f"Comment number {i}"}
+
+    def test_issue_comments_are_paginated_and_snippets_fetched_once(self):
+        print("\nTesting paginated issue comments and code snippets...")
+        snippet = "See https://github.com/octo/demo/blob/main/app.py#L2-L3 and https://github.com/octo/demo/blob/main/app.py#L4"
+        comments = [self.comment(i, snippet if i % 100 == 5 else None) for i in range(250)]
+        issues = {7: {"title": "Broken", "body": "It broke", "comments": comments}}
+        with FakeGitHubServer(self.files, issues=issues) as server, server.patch():
+            output = process_github_issue(f"{server.repo_url}/issues/7")
+            issue_requests = [path for path in server.requests if "/issues/" in path]
+            raw_requests = [path for path in server.requests if path.startswith("/raw/")]
+        self.assertEqual(output.count("<comment>"), 250)
+        self.assertIn("Comment number 249", output)
+        self.assertEqual(output.count("<![CDATA[line 2\nline 3]]>"), 3)
+        self.assertEqual(output.count("<![CDATA[line 4]]>"), 3)
+        # The issue and three pages of comments; app.py is downloaded once for the snippets, once with the repository.
+        self.assertEqual(len(issue_requests), 4)
+        self.assertEqual(len(raw_requests), 2)
+        print("Issue pagination test passed.")
+
+    def test_pull_request_lists_are_paginated(self):
+        print("\nTesting paginated pull request comments, reviews and commits...")
+        diff, review_comments = make_test_diff(2, hunk_lines=60)
+        pulls = {3: {
+            "title": "Speed things up", "body": "Faster", "user": {"login": "author"},
+            "base": {"ref": "main"}, "head": {"label": "author:fast"}, "diff": diff,
+            "comments": [self.comment(i) for i in range(130)],
+            "review_comments": review_comments,
+            "reviews": [{"user": {"login": "lead"}, "state": "APPROVED", "body": "Ship it"}, {"user": {"login": "bot"}, "state": "COMMENTED", "body": ""}],
+            "commits": [{"sha": f"{i:040x}", "commit": {"message": f"Step {i}"}} for i in range(3)],
+        }}
+        with FakeGitHubServer(self.files, pulls=pulls) as server, server.patch():
+            output = process_github_pull_request(f"{server.repo_url}/pull/3")
+        self.assertEqual(output.count("<review_comment>"), len(review_comments))
+        self.assertEqual(output.count("<comment>"), 130)
+        self.assertIn('<review state="APPROVED">', output)
+        self.assertNotIn('COMMENTED', output)
+        self.assertIn("wants to merge 3 commit", output)
+        self.assertIn(f'<commit sha="{2:040x}">Step 2</commit>', output)
+        print("Pull request pagination test passed.")
+
+class TestRepositoryContext(unittest.TestCase):
+    def setUp(self):
+        onefilellm.configure_cache(enabled=False)
+        self.files = {
+            "pkg/__init__.py": "",
+            "pkg/core.py": "from .util import helper\nimport pkg.models\n\ndef run():\n    return helper()\n",
+            "pkg/util.py": "def helper():\n    return 1\n",
+            "pkg/models.py": "class Model:\n    pass\n",
+            "docs/guide.md": "# Guide\n",
+            "README.md": "# Demo\n",
+        }
+
+    def pull(self, **fields):
+        pull = {
+            "title": "Refactor core", "body": "Tidy", "user": {"login": "author"},
+            "base": {"ref": "main"}, "head": {"label": "author:tidy", "sha": "f" * 40, "repo": {"full_name": "octo/demo"}},
+            "diff": "", "files": [{"filename": "pkg/core.py", "status": "modified"}, {"filename": "old.py", "status": "removed"}],
+        }
+        pull.update(fields)
+        return {3: pull}
+
+    def file_names(self, output):
+        return re.findall(r'<file name="([^"]+)">', output)
+
+    def test_pull_request_context_modes(self):
+        print("\nTesting repository context modes for a pull request...")
+        expected = {
+            "touched": ["pkg/core.py"],
+            "siblings": ["pkg/core.py", "pkg/__init__.py", "pkg/models.py", "pkg/util.py"],
+            "imports": ["pkg/core.py", "pkg/util.py", "pkg/models.py"],
+            "full": sorted(self.files),
+            "none": [],
+        }
+        with FakeGitHubServer(self.files, pulls=self.pull()) as server, server.patch():
+            for mode, names in expected.items():
+                output = process_github_pull_request(f"{server.repo_url}/pull/3", context=mode)
+                if mode == "full":
+                    self.assertEqual(sorted(self.file_names(output)), names)
+                else:
+                    self.assertEqual(self.file_names(output), names, mode)
+                self.assertEqual("<repository>" in output, mode != "none")
+                if mode in ("touched", "siblings", "imports"):
+                    self.assertIn(f'ref="{"f" * 40}" context="{mode}"', output)
+        print("Pull request context mode test passed.")
+
+    def test_issue_context_is_linked_files(self):
+        print("\nTesting repository context for an issue...")
+        issues = {7: {"title": "Bug", "body": "Fails in https://github.com/octo/demo/blob/main/pkg/util.py#L2",
+                      "comments": [{"id": 1, "user": {"login": "a"}, "body": "Also https://github.com/other/repo/blob/main/x.py"}]}}
+        with FakeGitHubServer(self.files, issues=issues) as server, server.patch():
+            output = process_github_issue(f"{server.repo_url}/issues/7")
+        self.assertEqual(self.file_names(output), ["pkg/util.py"])
+        self.assertIn('ref="main" context="touched"', output)
+        print("Issue context test passed.")
+
+    def test_imports_are_resolved_against_the_tree(self):
+        print("\nTesting import resolution...")
+        repo_paths = {"web/lib.ts", "shared/util/index.js", "pkg/sub/__init__.py", "pkg/base.py", "top.py"}
+        javascript = "import lib from './lib';\nconst util = require('../shared/util');\nimport React from 'react';\n"
+        self.assertEqual(onefilellm.find_imported_paths("web/app.js", javascript, repo_paths), ["web/lib.ts", "shared/util/index.js"])
+        python = "from ..base import Base\nfrom . import sub\nimport top\nimport os\n"
+        self.assertEqual(onefilellm.find_imported_paths("pkg/sub/mod.py", python, repo_paths), ["pkg/base.py", "pkg/sub/__init__.py", "top.py"])
+        print("Import resolution test passed.")
+
+    def test_context_budget_stops_downloads(self):
+        print("\nTesting the repository context token budget...")
+        files = {f"src/module_{i:02}.py": f"value_{i} = {i}\n" * 40 for i in range(20)}
+        pulls = self.pull(files=[{"filename": path, "status": "added"} for path in sorted(files)[:2]])
+        onefilellm._encoding = make_test_encoding()
+        try:
+            block_tokens = onefilellm.get_token_count(f'<file name="src/module_00.py">\n{files["src/module_00.py"]}\n</file>')
+            with FakeGitHubServer(files, pulls=pulls) as server, server.patch():
+                output = process_github_pull_request(f"{server.repo_url}/pull/3", context="siblings",
+                                                     context_budget=block_tokens * 5, max_workers=2)
+                raw_requests = [path for path in server.requests if path.startswith("/raw/")]
+        finally:
+            onefilellm._encoding = None
+        self.assertEqual(self.file_names(output), sorted(files)[:5])
+        self.assertEqual(output.count('reason="context budget"/>'), 15)
+        self.assertLess(len(raw_requests), len(files))
+        print("Context budget test passed.")
+
+    def test_context_budget_limits_touched_file_downloads(self):
+        print("\nTesting the context budget on a pull request touching many files...")
+        files = {f"src/module_{i:02}.py": f"value_{i} = {i}\n" * 40 for i in range(30)}
+        pulls = self.pull(files=[{"filename": path, "status": "modified"} for path in sorted(files)])
+        onefilellm._encoding = make_test_encoding()
+        self.addCleanup(setattr, onefilellm, "_encoding", None)
+        block_tokens = onefilellm.get_token_count(f'<file name="src/module_00.py">\n{files["src/module_00.py"]}\n</file>')
+        with FakeGitHubServer(files, pulls=pulls) as server, server.patch():
+            output = process_github_pull_request(f"{server.repo_url}/pull/3", context_budget=block_tokens * 3, max_workers=2)
+            raw_requests = [path for path in server.requests if path.startswith("/raw/")]
+        self.assertEqual(self.file_names(output), sorted(files)[:3])
+        self.assertEqual(output.count('reason="context budget"/>'), 27)
+        self.assertLessEqual(len(raw_requests), 3 + 1 + 2 * 2)
+        print("Touched file budget test passed.")
+
+    def test_context_budget_applies_to_the_full_repository(self):
+        print("\nTesting the context budget with the full repository as context...")
+        files = {f"src/module_{i:02}.py": f"value_{i} = {i}\n" * 40 for i in range(20)}
+        onefilellm._encoding = make_test_encoding()
+        self.addCleanup(setattr, onefilellm, "_encoding", None)
+        block_tokens = onefilellm.get_token_count(f'<file name="src/module_00.py">\n{files["src/module_00.py"]}\n</file>')
+        with FakeGitHubServer(files, pulls=self.pull()) as server, server.patch():
+            output = process_github_pull_request(f"{server.repo_url}/pull/3", context="full", context_budget=block_tokens * 3, max_workers=2)
+            raw_requests = [path for path in server.requests if path.startswith("/raw/")]
+        repository = output[output.index("<repository>"):]
+        self.assertLessEqual(onefilellm.get_token_count(repository), block_tokens * 3)
+        self.assertIn('reason="token budget"/>', repository)
+        self.assertLessEqual(len(self.file_names(repository)), 3)
+        self.assertLess(len(raw_requests), len(files))
+        print("Full repository context budget test passed.")
+
+    def test_max_tokens_bounds_a_pull_request_larger_than_the_budget(self):
+        print("\nTesting --max-tokens on a pull request whose body alone is over budget...")
+        pulls = self.pull(body="Explains the refactor at length. " * 200)
+        onefilellm._encoding = make_test_encoding()
+        self.addCleanup(setattr, onefilellm, "_encoding", None)
+        with FakeGitHubServer(self.files, pulls=pulls) as server, server.patch():
+            output = "\n".join(onefilellm.route_input(f"{server.repo_url}/pull/3", max_tokens=100))
+            raw_requests = [path for path in server.requests if path.startswith("/raw/")]
+        self.assertLessEqual(onefilellm.get_token_count(output), 100)
+        self.assertIn('kept_tokens="', output)
+        self.assertTrue(output.rstrip().endswith("</source>"))
+        self.assertEqual(raw_requests, [])
+        print("Oversized pull request budget test passed.")
+
+    def test_max_tokens_stops_full_repository_downloads(self):
+        print("\nTesting --max-tokens with the full repository as context...")
+        files = {f"src/module_{i:02}.py": f"value_{i} = {i}\n" * 40 for i in range(20)}
+        files["src/core.py"] = "core = 1\n" * 40
+        onefilellm._encoding = make_test_encoding()
+        self.addCleanup(setattr, onefilellm, "_encoding", None)
+        with FakeGitHubServer(files, pulls=self.pull()) as server, server.patch():
+            output = "\n".join(onefilellm.route_input(f"{server.repo_url}/pull/3", repo_context="full", max_tokens=1000,
+                                                      priority=["src/core.py"], max_workers=2))
+            raw_requests = [path for path in server.requests if path.startswith("/raw/")]
+        self.assertLessEqual(onefilellm.get_token_count(output), 1000)
+        self.assertEqual(self.file_names(output)[0], "src/core.py")
+        self.assertIn('reason="token budget"/>', output)
+        self.assertLess(len(raw_requests), len(files) // 2)
+        print("Full repository --max-tokens test passed.")
+
+class ScriptedServer(FakeHTTPServer):
+    """Answers each path from a queue of (status, headers) responses, then with 200 "ok"."""
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = {path: deque(queue) for path, queue in responses.items()}
+
+    def route(self, raw_path):
+        queue = self.responses.get(raw_path)
+        if queue:
+            status, headers = queue.popleft()
+            return status, "text/plain", b"error", headers
+        return 200, "text/plain", b"ok"
+
+class TestRequestScheduler(unittest.TestCase):
+    def setUp(self):
+        onefilellm.configure_cache(enabled=False)
+        self.scheduler = onefilellm.RequestScheduler(max_retries=3, max_wait=5, backoff=0.01)
+
+    def test_retries_rate_limits_and_server_errors(self):
+        print("\nTesting request retries...")
+        responses = {
+            "/flaky": [(429, {"Retry-After": "0"}), (503, {})],
+            "/limited": [(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()))})],
+            "/forbidden": [(403, {})],
+            "/down": [(500, {})] * 4,
+        }
+        with ScriptedServer(responses) as server:
+            self.assertEqual(self.scheduler.get(f"{server.url}/flaky").text, "ok")
+            self.assertEqual(self.scheduler.get(f"{server.url}/limited").status_code, 200)
+            self.assertEqual(self.scheduler.get(f"{server.url}/forbidden").status_code, 403)
+            self.assertEqual(self.scheduler.get(f"{server.url}/down").status_code, 500)
+            counts = {path: server.requests.count(path) for path in responses}
+        self.assertEqual(counts, {"/flaky": 3, "/limited": 2, "/forbidden": 1, "/down": 4})
+        print("Request retry test passed.")
+
+    def test_waits_for_exhausted_rate_limit(self):
+        print("\nTesting rate limit pacing...")
+        self.scheduler.max_wait = 120
+        reset = time.time() + 60
+        headers = {"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": str(onefilellm.RATE_LIMIT_RESERVE), "X-RateLimit-Reset": str(reset)}
+        far_reset = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(time.time() + 3600)}
+        with ScriptedServer({"/low": [(200, headers)], "/out": [(403, far_reset)]}) as server, \
+                mock.patch.object(onefilellm, "sleep") as fake_sleep:
+            self.scheduler.get(f"{server.url}/low")
+            self.scheduler.get(f"{server.url}/next")
+            self.assertAlmostEqual(fake_sleep.call_args[0][0], reset - time.time() + 1, delta=1)
+            with self.assertRaises(onefilellm.RateLimitExceeded):
+                self.scheduler.get(f"{server.url}/out")
+        print("Rate limit pacing test passed.")
+
+    def test_interrupted_repository_flatten_resumes(self):
+        print("\nTesting resuming an interrupted repository flatten...")
+        files = {f"src/module_{i:02}.py": f"value = {i}\n" for i in range(12)}
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        onefilellm.configure_cache(cache_dir)
+        onefilellm.configure_scheduler(max_retries=1, backoff=0)
+        self.addCleanup(onefilellm.configure_scheduler)
+        with FakeGitHubServer(files) as server, server.patch():
+            broken = "/raw/octo/demo/main/src/module_07.py"
+            original_route = server.route
+            server.route = lambda path: (500, "text/plain", b"error") if path == broken else original_route(path)
+            with self.assertRaises(Exception):
+                process_github_repo(server.repo_url, max_workers=2)
+            downloaded = {path for path in server.requests if path.startswith("/raw/") and path != broken}
+
+            server.route = original_route
+            del server.requests[:]
+            output = process_github_repo(server.repo_url, max_workers=2)
+            resumed = list(server.requests)
+
+            del server.requests[:]
+            process_github_repo(server.repo_url, max_workers=2)
+            rerun = list(server.requests)
+        self.assertEqual(len(re.findall(r'<file name=', output)), len(files))
+        self.assertFalse([path for path in resumed if "/contents" in path])
+        self.assertIn(broken, resumed)
+        self.assertFalse(downloaded & set(resumed))
+        # The checkpoint is removed once the flatten completes.
+        self.assertTrue([path for path in rerun if "/contents" in path])
+        print("Resume test passed.")
+
+    def test_checkpoint_is_not_reused_for_a_moved_branch_or_other_filters(self):
+        print("\nTesting that a listing checkpoint only resumes the same commit and filters...")
+        files = {f"src/module_{i:02}.py": f"value = {i}\n" for i in range(6)}
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        onefilellm.configure_cache(cache_dir)
+        onefilellm.configure_scheduler(max_retries=0, backoff=0)
+        self.addCleanup(onefilellm.configure_scheduler)
+        self.addCleanup(onefilellm.configure_filetypes)
+        with FakeGitHubServer(files) as server, server.patch():
+            original_route = server.route
+
+            def broken_route(path):
+                # Tree mode downloads at the commit SHA, so match any ref.
+                if path.startswith("/raw/") and path.endswith("/src/module_03.py"):
+                    return 500, "text/plain", b"error"
+                return original_route(path)
+
+            server.route = broken_route
+
+            def interrupted_then_rerun(mode):
+                # A fresh cache, so no blob from an earlier run lets the download succeed.
+                onefilellm.configure_cache(tempfile.mkdtemp(dir=cache_dir))
+                with self.assertRaises(Exception):
+                    process_github_repo(server.repo_url, max_workers=1, mode=mode)
+                server.files["src/new.py"] = b"new = 1\n"
+                del server.requests[:]
+                server.route = original_route
+                output = process_github_repo(server.repo_url, max_workers=1, mode=mode)
+                server.route = broken_route
+                del server.files["src/new.py"]
+                return output
+
+            for mode in ("contents", "tree"):
+                output = interrupted_then_rerun(mode)
+                self.assertIn('<file name="src/new.py">', output, mode)
+                self.assertTrue([path for path in server.requests if "/contents" in path or "/git/trees/" in path], mode)
+
+            onefilellm.configure_cache(tempfile.mkdtemp(dir=cache_dir))
+            with self.assertRaises(Exception):
+                process_github_repo(server.repo_url, max_workers=1)
+            server.route = original_route
+            onefilellm.configure_filetypes(exclude=["module_05.py"])
+            del server.requests[:]
+            output = process_github_repo(server.repo_url, max_workers=1)
+        self.assertTrue([path for path in server.requests if "/contents" in path])
+        self.assertNotIn("module_05.py", output)
+        print("Checkpoint key test passed.")
+
+class TestBatchMode(unittest.TestCase):
+    def setUp(self):
+        onefilellm.configure_cache(enabled=False)
+        onefilellm._encoding = make_test_encoding()
+        self.addCleanup(setattr, onefilellm, "_encoding", None)
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.folders = []
+        for i in range(4):
+            folder = os.path.join(self.temp_dir, f"folder{i}")
+            os.makedirs(folder)
+            with open(os.path.join(folder, "notes.md"), "w", encoding="utf-8") as f:
+                f.write(f"# Folder {i}\n")
+            self.folders.append(folder)
+
+    def test_inputs_are_read_from_a_list(self):
+        print("\nTesting the batch input list...")
+        list_file = os.path.join(self.temp_dir, "inputs.txt")
+        with open(list_file, "w", encoding="utf-8") as f:
+            f.write("# repositories\nhttps://github.com/octo/demo\n\n  10.1000/xyz  \n")
+        self.assertEqual(onefilellm.read_batch_inputs(list_file), ["https://github.com/octo/demo", "10.1000/xyz"])
+        with mock.patch("sys.stdin", io.StringIO("12345\n")):
+            self.assertEqual(onefilellm.read_batch_inputs("-"), ["12345"])
+        self.assertEqual([onefilellm.classify_input(value) for value in ("https://github.com/o/r/pull/1", "https://arxiv.org/abs/1", "12345", self.temp_dir)],
+                         ["github_pull_request", "arxiv_paper", "sci_hub_paper", "local_directory"])
+        print("Batch input list test passed.")
+
+    def test_batch_writes_per_input_and_combined_outputs(self):
+        print("\nTesting batch outputs...")
+        output_dir = os.path.join(self.temp_dir, "out")
+        combined = os.path.join(self.temp_dir, "combined.txt")
+        missing = "https://github.com/octo/missing"
+        with FakeGitHubServer({"app.py": "print('hi')\n"}) as server, server.patch():
+            inputs = [server.repo_url, self.folders[0], missing, self.folders[1]]
+            results = onefilellm.process_batch(inputs, output_dir=output_dir, combined_output=combined, max_workers=2)
+            expected = [process_github_repo(server.repo_url), process_local_folder(self.folders[0]), None, process_local_folder(self.folders[1])]
+        self.assertEqual([result["input"] for result in results], inputs)
+        self.assertEqual([result["source_type"] for result in results], ["github_repository", "local_directory", "github_repository", "local_directory"])
+        outputs = []
+        for result, text in zip(results, expected):
+            with open(result["output"], "r", encoding="utf-8", newline="") as f:
+                outputs.append(f.read())
+            if text is None:
+                self.assertIsNotNone(result["error"])
+                self.assertIn("<error>", outputs[-1])
+            else:
+                self.assertIsNone(result["error"])
+                self.assertEqual(outputs[-1], text)
+        self.assertEqual(sorted(os.listdir(output_dir)), [os.path.basename(result["output"]) for result in results])
+        with open(combined, "r", encoding="utf-8", newline="") as f:
+            self.assertEqual(f.read(), "\n".join(outputs))
+        print("Batch output test passed.")
+
+    def test_concurrency_is_limited_per_source_type(self):
+        print("\nTesting per-source-type batch concurrency...")
+        active, peak = [0], [0]
+        lock = threading.Lock()
+        original = onefilellm.iter_local_folder
+
+        def tracked(*args, **kwargs):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            try:
+                yield from original(*args, **kwargs)
+            finally:
+                with lock:
+                    active[0] -= 1
+
+        combined = os.path.join(self.temp_dir, "combined.txt")
+        with mock.patch.object(onefilellm, "iter_local_folder", tracked):
+            results = onefilellm.process_batch(self.folders, combined_output=combined, concurrency={"local_directory": 2})
+        self.assertEqual(peak[0], 2)
+        self.assertTrue(all(result["output"] is None and result["error"] is None for result in results))
+        with open(combined, "r", encoding="utf-8") as f:
+            self.assertEqual(f.read().count("<source"), len(self.folders))
+        print("Batch concurrency test passed.")
+
+    def test_inputs_held_back_by_their_type_do_not_block_others(self):
+        print("\nTesting that a full source type does not hold up other inputs...")
+        events, lock = [], threading.Lock()
+        original = onefilellm.iter_local_folder
+
+        def slow_folder(*args, **kwargs):
+            time.sleep(0.1)
+            yield from original(*args, **kwargs)
+            with lock:
+                events.append("folder done")
+
+        def paper(input_path):
+            with lock:
+                events.append("paper started")
+            return f'<source type="sci_hub_paper" url="{input_path}">\n</source>'
+
+        with mock.patch.object(onefilellm, "iter_local_folder", slow_folder), \
+             mock.patch.object(onefilellm, "process_doi_or_pmid", paper):
+            results = onefilellm.process_batch(self.folders + ["12345"], max_parallel=3, concurrency={"local_directory": 1})
+        self.assertEqual(events[0], "paper started")
+        self.assertTrue(all(result["error"] is None for result in results))
+        self.assertEqual([result["source_type"] for result in results], ["local_directory"] * 4 + ["sci_hub_paper"])
+        print("Batch head-of-line test passed.")
+
+    def test_batch_reads_folders_without_a_process_pool(self):
+        print("\nTesting --jobs in batch mode...")
+        with mock.patch.object(onefilellm, "ProcessPoolExecutor", side_effect=AssertionError("pool started")):
+            results = onefilellm.process_batch(self.folders, max_parallel=2, jobs=4)
+        self.assertEqual([result["error"] for result in results], [None] * len(self.folders))
+        self.assertTrue(all(result["tokens"] > 0 for result in results))
+        print("Batch --jobs test passed.")
+
+class TestTokenPacking(unittest.TestCase):
+    def setUp(self):
+        onefilellm.configure_cache(enabled=False)
+        onefilellm._encoding = make_test_encoding()
+        self.addCleanup(setattr, onefilellm, "_encoding", None)
+
+    def file_names(self, output):
+        return re.findall(r'<file name="([^"]+)">', output)
+
+    def test_ranking(self):
+        print("\nTesting the packing order of listed files...")
+        entries = [("src/big.py", 900, 1), ("docs/README.md", 50, 2), ("src/small.py", 10, 3), ("tests/test_x.py", 20, 4),
+                   ("README.md", 500, 5), ("src/new.py", 300, 9), ("pyproject.toml", 40, 6)]
+        describe = lambda entry: entry
+        packer = onefilellm.TokenPacker(1000)
+        self.assertEqual([path for path, _, _ in packer.rank(entries, describe)],
+                         ["README.md", "pyproject.toml", "docs/README.md", "src/big.py", "src/small.py", "tests/test_x.py", "src/new.py"])
+        packer = onefilellm.TokenPacker(1000, priority=["tests/", "*.md"], order="size")
+        self.assertEqual([path for path, _, _ in packer.rank(entries, describe)],
+                         ["tests/test_x.py", "README.md", "docs/README.md", "pyproject.toml", "src/small.py", "src/new.py", "src/big.py"])
+        packer = onefilellm.TokenPacker(1000, order="recency")
+        self.assertEqual([path for path, _, _ in packer.rank(entries, describe)][3:],
+                         ["src/new.py", "tests/test_x.py", "src/small.py", "src/big.py"])
+        with self.assertRaises(ValueError):
+            onefilellm.TokenPacker(1000, order="alphabetical")
+        print("Packing order test passed.")
+
+    def test_truncate_item(self):
+        print("\nTesting token truncation of a file block...")
+        content = "a &amp; b\n" * 50
+        block = f'<file name="a.py">\n{content}<truncated bytes="9000" kept_bytes="500"/>\n</file>'
+        total = onefilellm.get_token_count(content.strip("\n"))
+        for max_tokens in range(1, 40):
+            cut = onefilellm.truncate_item(block, max_tokens)
+            self.assertTrue(cut.startswith('<file name="a.py">\n') and cut.endswith(f'<truncated tokens="{total}" kept_tokens="{max_tokens}"/>\n</file>'))
+            # Plus the newlines either side of the content.
+            self.assertLessEqual(onefilellm.get_token_count(cut), max_tokens + 2)
+            self.assertNotRegex(cut, r"&[#\w]*\n<truncated")
+        print("Token truncation test passed.")
+
+    def test_local_folder_is_packed_in_rank_order(self):
+        print("\nTesting --max-tokens packing of a local folder...")
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        files = {"README.md": "# Demo\n" * 20, "a.py": "x = 1\n" * 100, "b.py": "y = 2\n" * 400, "c.py": "z = 3\n" * 100, "main.py": "run()\n" * 20}
+        for name, text in files.items():
+            with open(os.path.join(temp_dir, name), "w", encoding="utf-8") as f:
+                f.write(text)
+        full = "\n".join(onefilellm.route_input(temp_dir))
+        budget = onefilellm.get_token_count(full) // 2
+        output = "\n".join(onefilellm.route_input(temp_dir, max_tokens=budget, priority=["c.py"]))
+        self.assertEqual(self.file_names(output), ["c.py", "README.md", "main.py", "a.py", "b.py"])
+        self.assertRegex(output, r'<truncated tokens="\d+" kept_tokens="\d+"/>\n</file>\n</source>$')
+        self.assertLessEqual(onefilellm.get_token_count(output), budget)
+        self.assertGreater(onefilellm.get_token_count(output), budget - onefilellm.MIN_PACKED_TOKENS)
+
+        small = "\n".join(onefilellm.route_input(temp_dir, max_tokens=budget // 4, pack_order="size"))
+        self.assertEqual(self.file_names(small)[:2], ["main.py", "README.md"])
+        self.assertNotIn("b.py", small)
+        self.assertRegex(small, r'<skipped items="[1-3]" reason="token budget"/>\n</source>$')
+        self.assertLessEqual(onefilellm.get_token_count(small), budget // 4)
+        print("Local folder packing test passed.")
+
+    def test_spent_budget_stops_github_downloads(self):
+        print("\nTesting that a spent token budget stops GitHub downloads...")
+        files = {f"src/module_{i:02}.py": f"value_{i} = {i}\n" * 40 for i in range(30)}
+        files["README.md"] = "# Demo\n"
+        block_tokens = onefilellm.get_token_count(f'<file name="src/module_00.py">\n{files["src/module_00.py"]}\n</file>')
+        with FakeGitHubServer(files) as server, server.patch():
+            for mode in ("contents", "tree"):
+                server.requests.clear()
+                output = "\n".join(onefilellm.route_input(server.repo_url, max_workers=2, github_mode=mode, max_tokens=block_tokens * 4))
+                raw_requests = [path for path in server.requests if path.startswith("/raw/")]
+                names = self.file_names(output)
+                self.assertEqual(names[0], "README.md", mode)
+                self.assertEqual(len(names), 5, mode)
+                self.assertIn(f'<skipped items="{len(files) - 5}" reason="token budget"/>\n</source>', output)
+                self.assertLess(len(raw_requests), len(files) // 2, mode)
+                self.assertLessEqual(onefilellm.get_token_count(output), block_tokens * 4)
+        print("GitHub packing test passed.")
+
+    def test_total_size_cap_keeps_the_highest_ranked_files(self):
+        print("\nTesting the total size cap under packing...")
+        files = {f"src/module_{i:02}.py": f"value_{i} = {i}\n" * 40 for i in range(10)}
+        size = len(files["src/module_00.py"])
+        onefilellm.configure_read_limits(max_file_bytes=None, max_total_bytes=size * 2, oversize="skip")
+        self.addCleanup(onefilellm.configure_read_limits)
+        with FakeGitHubServer(files) as server, server.patch():
+            for _ in range(3):
+                output = "\n".join(onefilellm.route_input(server.repo_url, max_workers=4, max_tokens=100000, priority=["src/module_07.py"]))
+                self.assertEqual(self.file_names(output), ["src/module_07.py", "src/module_00.py"])
+        print("Size cap under packing test passed.")
+
+class TestChunkedOutput(unittest.TestCase):
+    def setUp(self):
+        onefilellm._encoding = make_test_encoding()
+        self.addCleanup(setattr, onefilellm, "_encoding", None)
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.chunk_dir = os.path.join(self.temp_dir, "chunks")
+
+    def write_output(self, fragments, **options):
+        counter = onefilellm.TokenCounter()
+        writer = onefilellm.ChunkWriter(self.chunk_dir, **options)
+        with onefilellm.OutputWriter(os.path.join(self.temp_dir, "out.txt"), [counter, writer]) as output:
+            for fragment in fragments:
+                output.write(fragment)
+        records = []
+        for shard in writer.shards:
+            with open(shard, "r", encoding="utf-8") as f:
+                records += [json.loads(line) for line in f]
+        return counter, writer, records
+
+    def test_chunks_are_token_bounded_and_overlap(self):
+        print("\nTesting token-bounded chunks with overlap...")
+        paragraphs = [f"Paragraph {i} says ab & a.\nIt has a second line {i}." for i in range(40)]
+        guide_text = onefilellm.escape_xml("\n\n".join(paragraphs))
+        fragments = [
+            '<source type="local_directory" path="proj">',
+            f'<file name="docs/guide.md">\n{guide_text}\n</file>',
+            '<file name="min.js">\n' + "ab" * 3000 + '\n</file>',
+            '<file name="empty.py">\n\n</file>',
+            '<skipped name="big.bin" bytes="9" reason="exceeds per-file size limit"/>',
+            '</source>',
+        ]
+        counter, writer, records = self.write_output(fragments, max_tokens=120, overlap=60, shard_records=5)
+        self.assertEqual(writer.total, counter.total)
+        self.assertEqual(writer.items, counter.items)
+        self.assertEqual(sorted(os.listdir(self.chunk_dir)), [os.path.basename(shard) for shard in writer.shards])
+        self.assertEqual(len(writer.shards), -(-len(records) // 5))
+        self.assertEqual([record["id"] for record in records], list(range(len(records))))
+
+        guide = [record for record in records if record["path"] == "docs/guide.md"]
+        self.assertEqual([record["chunk"] for record in guide], list(range(len(guide))))
+        self.assertTrue(all(record["tokens"] <= 120 for record in records))
+        self.assertEqual({record["source"] for record in records}, {"proj"})
+        self.assertEqual({record["path"] for record in records}, {"docs/guide.md", "min.js"})
+        self.assertIn("says ab & a.", guide[0]["text"])
+        for previous, record in zip(guide, guide[1:]):
+            # Each chunk opens with the last paragraph of the one before.
+            self.assertTrue(previous["text"].endswith(record["text"].split("\n\n")[0]))
+        self.assertEqual({p for record in guide for p in record["text"].split("\n\n")}, set(paragraphs))
+        self.assertEqual("".join(record["text"] for record in records if record["path"] == "min.js"), "ab" * 3000)
+        print("Chunk bounds and overlap test passed.")
+
+    def test_whole_documents_and_stale_shards(self):
+        print("\nTesting chunks of a whole-document source...")
+        os.makedirs(self.chunk_dir)
+        for name in ("chunks-00007.jsonl", "notes.txt"):
+            with open(os.path.join(self.chunk_dir, name), "w") as f:
+                f.write("{}\n")
+        transcript = '<source type="youtube_transcript" url="https://youtu.be/x">\n' + "a b\n" * 100 + '</source>'
+        _, writer, records = self.write_output([transcript], max_tokens=50)
+        self.assertEqual(sorted(os.listdir(self.chunk_dir)), ["chunks-00000.jsonl", "notes.txt"])
+        self.assertEqual({(record["source_type"], record["source"], record["path"]) for record in records},
+                         {("youtube_transcript", "https://youtu.be/x", None)})
+        self.assertEqual(sum(record["tokens"] for record in records), writer.total)
+        with self.assertRaises(ValueError):
+            onefilellm.ChunkWriter(self.chunk_dir, max_tokens=10, overlap=10)
+        print("Whole-document chunk test passed.")
+
+    def test_pull_request_context_files_are_chunked_per_file(self):
+        print("\nTesting chunks of a pull request with repository context...")
+        files = {"a.py": "alpha = 1\n" * 30, "b.py": "beta = 2\n" * 30}
+        pulls = TestRepositoryContext().pull(body="Tidy both modules.",
+                                             files=[{"filename": path, "status": "modified"} for path in files])
+        onefilellm.configure_cache(enabled=False)
+        with FakeGitHubServer(files, pulls=pulls) as server, server.patch():
+            output = process_github_pull_request(f"{server.repo_url}/pull/3")
+        counter, writer, records = self.write_output([output], max_tokens=1000)
+        self.assertEqual(writer.total, counter.total)
+        self.assertEqual([record["path"] for record in records], [None, "a.py", "b.py"])
+        self.assertIn("Tidy both modules.", records[0]["text"])
+        self.assertNotIn("alpha", records[0]["text"])
+        for record in records[1:]:
+            self.assertEqual(record["text"].strip(), files[record["path"]].strip())
+        print("Pull request chunk test passed.")
+
+class TestStartup(unittest.TestCase):
+    def test_import_loads_no_source_dependencies(self):
+        print("\nTesting import time...")
+        env = {name: value for name, value in os.environ.items() if name != "GITHUB_TOKEN"}
+        result, modules, _ = measure_import(env=env)
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        loaded = [name for name in modules if name.split(".")[0] in DEFERRED_IMPORTS or name in DEFERRED_IMPORTS]
+        self.assertEqual(loaded, [])
+        self.assertLess(modules["onefilellm"], 1_000_000)
+        print(f"Import time test passed ({modules['onefilellm'] / 1000:.0f} ms).")
+
+    def test_github_token_is_checked_on_use(self):
+        print("\nTesting the deferred GitHub token check...")
+        with mock.patch.object(onefilellm, "TOKEN", "default_token_here"):
+            with self.assertRaises(EnvironmentError):
+                process_github_repo("https://github.com/octo/demo")
+        self.assertIn("the", onefilellm.stop_words)
+        self.assertEqual(onefilellm.compress_words("The cat sat on the mat"), ["cat", "sat", "mat"])
+        print("Deferred token check test passed.")
+
+    def test_local_sources_run_without_a_token(self):
+        print("\nTesting a local folder flatten with GITHUB_TOKEN unset...")
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        with open(os.path.join(temp_dir, "app.py"), "w", encoding="utf-8") as f:
+            f.write("print('hello')\n")
+        env = {name: value for name, value in os.environ.items() if name != "GITHUB_TOKEN"}
+        script = f"import onefilellm; print(onefilellm.process_local_folder({temp_dir!r}))"
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        self.assertIn('<file name="app.py">', result.stdout)
+        print("Tokenless local flatten test passed.")
+
+class TestWebAppJobs(unittest.TestCase):
+    def setUp(self):
+        import web_app
+        onefilellm.configure_cache(enabled=False)
+        onefilellm._encoding = make_test_encoding()
+        self.addCleanup(setattr, onefilellm, "_encoding", None)
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.folders = []
+        for i in range(3):
+            folder = os.path.join(self.temp_dir, f"project{i}")
+            os.makedirs(folder)
+            with open(os.path.join(folder, "main.py"), "w", encoding="utf-8") as f:
+                f.write(f"print('project {i}')\n")
+            self.folders.append(folder)
+        self.web_app = web_app
+        self.queue = web_app.JobQueue(os.path.join(self.temp_dir, "jobs"), workers=2)
+        patcher = mock.patch.object(web_app, "jobs", self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = web_app.app.test_client()
+
+    def wait_for(self, job_id, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status = self.client.get(f"/jobs/{job_id}").get_json()
+            if status["status"] in ("done", "failed"):
+                return status
+            time.sleep(0.05)
+        self.fail(f"job {job_id} did not finish")
+
+    def test_jobs_run_in_the_background_with_separate_outputs(self):
+        print("\nTesting web app jobs...")
+        job_ids = []
+        for folder in self.folders:
+            response = self.client.post("/jobs", json={"input_path": folder})
+            self.assertEqual(response.status_code, 202)
+            job_ids.append(response.get_json()["id"])
+        self.assertEqual(len(set(job_ids)), len(self.folders))
+        for job_id, folder in zip(job_ids, self.folders):
+            status = self.wait_for(job_id)
+            self.assertEqual(status["status"], "done", status["error"])
+            self.assertGreater(status["uncompressed_token_count"], 0)
+            output = self.client.get(status["downloads"]["uncompressed"])
+            self.assertEqual(output.data.decode("utf-8"), process_local_folder(folder))
+            output.close()
+        page = self.client.get(f"/?job={job_ids[0]}")
+        self.assertIn(b"Processed Output", page.data)
+        self.assertEqual(self.client.post("/jobs", json={}).status_code, 400)
+        self.assertEqual(self.client.get("/jobs/unknown").status_code, 404)
+        print("Web app job test passed.")
+
+    def test_large_outputs_are_streamed_and_previewed_in_pages(self):
+        print("\nTesting streamed downloads and paged previews...")
+        folder = os.path.join(self.temp_dir, "large")
+        os.makedirs(folder)
+        for i in range(6):
+            with open(os.path.join(folder, f"part{i}.md"), "w", encoding="utf-8") as f:
+                f.write(f"Section {i} \u00e9t\u00e9 text\n" * (4000 * (i + 1)))
+        job_id = self.client.post("/jobs", json={"input_path": folder}).get_json()["id"]
+        status = self.wait_for(job_id)
+        expected = process_local_folder(folder)
+        self.assertGreater(len(expected.encode("utf-8")), 8 * self.web_app.PREVIEW_PAGE_BYTES)
+
+        plain = self.client.get(status["downloads"]["uncompressed"])
+        self.assertTrue(plain.is_streamed)
+        self.assertNotIn("Content-Length", plain.headers)
+        self.assertEqual(plain.data.decode("utf-8"), expected)
+        plain.close()
+        compressed = self.client.get(status["downloads"]["uncompressed"], headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(compressed.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(compressed.data).decode("utf-8"), expected)
+        compressed.close()
+
+        first = self.client.get(f"/jobs/{job_id}/preview").get_json()
+        self.assertGreater(first["pages"], 8)
+        pages = [first["text"]] + [self.client.get(f"/jobs/{job_id}/preview?page={page}").get_json()["text"]
+                                   for page in range(2, first["pages"] + 1)]
+        self.assertTrue(all(len(text.encode("utf-8")) <= self.web_app.PREVIEW_PAGE_BYTES for text in pages))
+        # Only characters split across a page boundary are left out.
+        self.assertGreaterEqual(len("".join(pages)), len(expected) - len(pages))
+        self.assertTrue(expected.startswith(pages[0][:-1]))
+        page = self.client.get(f"/?job={job_id}&page=2").data.decode("utf-8")
+        self.assertIn(f"Page 2 of {first['pages']}", page)
+        self.assertLess(len(page), 2 * self.web_app.PREVIEW_PAGE_BYTES)
+
+        summary = [(item["name"], item["tokens"]) for item in status["token_summary"]]
+        self.assertEqual(summary[0][0], "part5.md")
+        self.assertEqual([tokens for _, tokens in summary], sorted((tokens for _, tokens in summary), reverse=True))
+        tokens = self.client.get(status["downloads"]["tokens"])
+        self.assertEqual(len(json.loads(tokens.data)), 6)
+        tokens.close()
+        print("Streamed download and preview test passed.")
+
+    def test_form_submission_redirects_to_job_page(self):
+        print("\nTesting the web app form...")
+        response = self.client.post("/", data={"input_path": self.folders[0]})
+        self.assertEqual(response.status_code, 302)
+        job_id = parse_qs(urlparse(response.headers["Location"]).query)["job"][0]
+        self.wait_for(job_id)
+        self.assertIn(b"project 0", self.client.get(response.headers["Location"]).data)
+        print("Web app form test passed.")
+
+    def test_finished_jobs_expire(self):
+        print("\nTesting web app job expiry...")
+        self.queue.ttl = 0
+        job_id = self.client.post("/jobs", json={"input_path": self.folders[0]}).get_json()["id"]
+        job = self.queue._jobs[job_id]
+        while job.finished_at is None:
+            time.sleep(0.05)
+        time.sleep(0.01)
+        self.assertEqual(self.client.get(f"/jobs/{job_id}").status_code, 404)
+        self.assertFalse(os.path.exists(job.directory))
+        self.queue.max_pending = 0
+        self.assertEqual(self.client.post("/jobs", json={"input_path": self.folders[0]}).status_code, 503)
+        print("Web app job expiry test passed.")
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,23 +1,160 @@
-from flask import Flask, request, render_template_string, send_file
+from flask import Flask, Response, request, render_template_string, jsonify, redirect, url_for, abort, stream_with_context
 import os
-import sys
+import json
+import math
+import zlib
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-# Import functions from onefilellm.py. 
+# Import functions from onefilellm.py.
 # Ensure onefilellm.py is accessible in the same directory.
-from onefilellm import process_github_repo, process_github_pull_request, process_github_issue
-from onefilellm import process_arxiv_pdf, process_local_folder, fetch_youtube_transcript
-from onefilellm import crawl_and_extract_text, process_doi_or_pmid, get_token_count, preprocess_text, safe_file_read
-from pathlib import Path
-import pyperclip
+from onefilellm import classify_input, route_input
+from onefilellm import OutputWriter, CompressedOutputWriter, TokenCounter, LazyModule, module_available
+
+# Optional zstd compression for downloads.
+zstandard = LazyModule("zstandard")
 
 app = Flask(__name__)
 
+# Jobs run on a small pool of background threads so a long flatten never
+# ties up a request thread. Each job writes into its own directory, which
+# is deleted JOB_TTL seconds after the job finishes.
+JOB_WORKERS = int(os.getenv("ONEFILELLM_JOB_WORKERS", "2"))
+MAX_PENDING_JOBS = 100
+JOB_TTL = int(os.getenv("ONEFILELLM_JOB_TTL", "3600"))
+JOBS_DIR = os.getenv("ONEFILELLM_JOBS_DIR", os.path.join(tempfile.gettempdir(), "onefilellm-jobs"))
+OUTPUT_FILES = {"uncompressed": "uncompressed_output.txt", "compressed": "compressed_output.txt", "urls": "processed_urls.txt",
+                "tokens": "token_summary.json"}
+# Outputs are never rendered whole: pages show at most this much of one,
+# and downloads are streamed in chunks of STREAM_CHUNK_BYTES.
+PREVIEW_PAGE_BYTES = 64 * 1024
+STREAM_CHUNK_BYTES = 256 * 1024
+# Files and pages listed in a job's token summary, largest first.
+TOKEN_SUMMARY_LIMIT = 50
+
+class Job:
+    """One input being processed in the background, and where its outputs go."""
+
+    def __init__(self, input_path, directory):
+        self.id = os.path.basename(directory)
+        self.input_path = input_path
+        self.directory = directory
+        self.status = "queued"
+        self.phase = None
+        self.items = 0
+        self.error = None
+        self.uncompressed_token_count = None
+        self.compressed_token_count = None
+        self.token_summary = []
+        self.item_count = 0
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def path(self, kind):
+        return os.path.join(self.directory, OUTPUT_FILES[kind])
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "input_path": self.input_path,
+            "status": self.status,
+            "phase": self.phase,
+            "items": self.items,
+            "error": self.error,
+            "uncompressed_token_count": self.uncompressed_token_count,
+            "compressed_token_count": self.compressed_token_count,
+            "token_summary": [{"name": name, "tokens": tokens} for name, tokens in self.token_summary],
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "downloads": {kind: url_for("download", job_id=self.id, kind=kind)
+                          for kind in OUTPUT_FILES if os.path.exists(self.path(kind))} if self.status == "done" else {},
+        }
+
+class JobQueue:
+    """An in-process job queue: a bounded worker pool plus a table of jobs by id.
+
+    Finished jobs and their output directories are removed once they are
+    older than ttl; expired jobs are swept whenever a job is submitted or
+    looked up.
+    """
+
+    def __init__(self, jobs_dir=JOBS_DIR, workers=JOB_WORKERS, max_pending=MAX_PENDING_JOBS, ttl=JOB_TTL):
+        self.jobs_dir = jobs_dir
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="onefilellm-job")
+
+    def submit(self, input_path):
+        """Queue input_path and return its Job, or None when too many jobs are already waiting."""
+        self.cleanup()
+        with self._lock:
+            if sum(job.status in ("queued", "running") for job in self._jobs.values()) >= self.max_pending:
+                return None
+            directory = os.path.join(self.jobs_dir, uuid.uuid4().hex)
+            os.makedirs(directory)
+            job = Job(input_path, directory)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        self.cleanup()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cleanup(self):
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.finished_at is not None and now - job.finished_at > self.ttl]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            shutil.rmtree(job.directory, ignore_errors=True)
+
+    def _run(self, job):
+        job.status = "running"
+        try:
+            processed_urls = [] if classify_input(job.input_path) == "web_documentation" else None
+            job.phase = "fetching"
+            counter, compressed_counter = TokenCounter(), TokenCounter()
+            compressed = CompressedOutputWriter(job.path("compressed"), [compressed_counter])
+            with OutputWriter(job.path("uncompressed"), [counter, compressed]) as writer:
+                for fragment in route_input(job.input_path, processed_urls):
+                    writer.write(fragment)
+                    job.items += 1
+            if processed_urls is not None:
+                with open(job.path("urls"), "w", encoding="utf-8") as urls_file:
+                    urls_file.write("\n".join(processed_urls))
+
+            job.uncompressed_token_count = counter.total
+            job.token_summary = counter.largest(TOKEN_SUMMARY_LIMIT)
+            job.item_count = len(counter.items)
+            with open(job.path("tokens"), "w", encoding="utf-8") as summary_file:
+                json.dump(dict(sorted(counter.items.items(), key=lambda item: -item[1])), summary_file, indent=1)
+            job.compressed_token_count = compressed_counter.total
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.phase = None
+            job.finished_at = time.time()
+
+jobs = JobQueue()
+
 # Simple HTML template using inline rendering for demonstration.
 template = """
 <!DOCTYPE html>
 <html>
 <head>
     <title>1FileLLM Web Interface</title>
+    {% if job and job.status in ("queued", "running") %}<meta http-equiv="refresh" content="2">{% endif %}
     <style>
     body { font-family: sans-serif; margin: 2em; }
     input[type="text"] { width: 80%; padding: 0.5em; }
@@ -34,19 +171,40 @@ template = """
         <button type="submit">Process</button>
     </form>
 
-    {% if output %}
+    {% if error %}
+    <p>Error: {{ error }}</p>
+    {% endif %}
+
+    {% if job %}
     <div class="output-container">
+        <h2>{{ job.input_path }}</h2>
+        {% if job.status in ("queued", "running") %}
+        <p>Status: {{ job.status }}{% if job.phase %} ({{ job.phase }}, {{ job.items }} items so far){% endif %}. This page refreshes until the job is done.</p>
+        {% elif job.status == "failed" %}
+        <p>Error: {{ job.error }}</p>
+        {% else %}
         <h2>Processed Output</h2>
-        <pre>{{ output }}</pre>
-        
+        <p>Page {{ preview.page }} of {{ preview.pages }}
+        {% if preview.page > 1 %}| <a href="{{ url_for('index', job=job.id, page=preview.page - 1) }}">Previous</a>{% endif %}
+        {% if preview.page < preview.pages %}| <a href="{{ url_for('index', job=job.id, page=preview.page + 1) }}">Next</a>{% endif %}</p>
+        <pre>{{ preview.text }}</pre>
+
         <h3>Token Counts</h3>
-        <p>Uncompressed Tokens: {{ uncompressed_token_count }}<br>
-        Compressed Tokens: {{ compressed_token_count }}</p>
+        <p>Uncompressed Tokens: {{ job.uncompressed_token_count }}<br>
+        Compressed Tokens: {{ job.compressed_token_count }}</p>
+        {% if job.token_summary %}
+        <table>
+            <tr><th>Tokens</th><th>{{ job.token_summary|length }} largest of {{ job.item_count }} files and pages</th></tr>
+            {% for name, tokens in job.token_summary %}<tr><td>{{ tokens }}</td><td>{{ name }}</td></tr>{% endfor %}
+        </table>
+        {% endif %}
 
         <div class="file-links">
-            <a href="/download?filename=uncompressed_output.txt">Download Uncompressed Output</a> |
-            <a href="/download?filename=compressed_output.txt">Download Compressed Output</a>
+            <a href="{{ url_for('download', job_id=job.id, kind='uncompressed') }}">Download Uncompressed Output</a> |
+            <a href="{{ url_for('download', job_id=job.id, kind='compressed') }}">Download Compressed Output</a> |
+            <a href="{{ url_for('download', job_id=job.id, kind='tokens') }}">Download Token Summary</a>
         </div>
+        {% endif %}
     </div>
     {% endif %}
 </body>
@@ -57,71 +215,99 @@ template = """
 def index():
     if request.method == "POST":
         input_path = request.form.get("input_path", "").strip()
+        job = jobs.submit(input_path)
+        if job is None:
+            return render_template_string(template, error="Too many jobs are waiting; please try again later."), 503
+        return redirect(url_for("index", job=job.id))
 
-        # Prepare filenames
-        output_file = "uncompressed_output.txt"
-        processed_file = "compressed_output.txt"
-        urls_list_file = "processed_urls.txt"
+    job_id = request.args.get("job")
+    if not job_id:
+        return render_template_string(template)
+    job = jobs.get(job_id)
+    if job is None:
+        return render_template_string(template, error="Unknown or expired job."), 404
+    preview = read_preview(job.path("uncompressed"), request.args.get("page", 1, type=int)) if job.status == "done" else None
+    return render_template_string(template, job=job, preview=preview)
 
-        # Determine input type and process accordingly (mirroring logic from onefilellm.py main)
-        try:
-            from urllib.parse import urlparse
-            parsed = urlparse(input_path)
-
-            if "github.com" in input_path:
-                if "/pull/" in input_path:
-                    final_output = process_github_pull_request(input_path)
-                elif "/issues/" in input_path:
-                    final_output = process_github_issue(input_path)
-                else:
-                    final_output = process_github_repo(input_path)
-            elif parsed.scheme in ["http", "https"]:
-                if "youtube.com" in input_path or "youtu.be" in input_path:
-                    final_output = fetch_youtube_transcript(input_path)
-                elif "arxiv.org" in input_path:
-                    final_output = process_arxiv_pdf(input_path)
-                else:
-                    crawl_result = crawl_and_extract_text(input_path, max_depth=2, include_pdfs=True, ignore_epubs=True)
-                    final_output = crawl_result['content']
-                    with open(urls_list_file, 'w', encoding='utf-8') as urls_file:
-                        urls_file.write('\n'.join(crawl_result['processed_urls']))
-            elif (input_path.startswith("10.") and "/" in input_path) or input_path.isdigit():
-                final_output = process_doi_or_pmid(input_path)
-            else:
-                final_output = process_local_folder(input_path)
-
-            # Write the uncompressed output
-            with open(output_file, "w", encoding="utf-8") as file:
-                file.write(final_output)
-
-            # Process the compressed output
-            preprocess_text(output_file, processed_file)
-
-            compressed_text = safe_file_read(processed_file)
-            compressed_token_count = get_token_count(compressed_text)
-
-            uncompressed_text = safe_file_read(output_file)
-            uncompressed_token_count = get_token_count(uncompressed_text)
-
-            # Copy to clipboard
-            pyperclip.copy(uncompressed_text)
-
-            return render_template_string(template,
-                                          output=final_output,
-                                          uncompressed_token_count=uncompressed_token_count,
-                                          compressed_token_count=compressed_token_count)
-        except Exception as e:
-            return render_template_string(template, output=f"Error: {str(e)}")
+def read_preview(path, page):
+    """One PREVIEW_PAGE_BYTES page of an output file, read without loading the rest of it.
+
+    Pages are cut at byte offsets; a character split across two pages is
+    dropped from both rather than shown garbled.
+    """
+    pages = max(1, math.ceil(os.path.getsize(path) / PREVIEW_PAGE_BYTES))
+    page = min(max(page, 1), pages)
+    with open(path, "rb") as f:
+        f.seek((page - 1) * PREVIEW_PAGE_BYTES)
+        data = f.read(PREVIEW_PAGE_BYTES)
+    return {"page": page, "pages": pages, "text": data.decode("utf-8", errors="ignore")}
+
+def negotiate_encoding(accept_encodings):
+    """The Content-Encoding to stream a download with: zstd (when installed), gzip or None."""
+    offered = ["zstd", "gzip"] if module_available("zstandard") else ["gzip"]
+    return accept_encodings.best_match(offered)
+
+def iter_file_chunks(path, encoding=None):
+    """Yield the contents of path in STREAM_CHUNK_BYTES chunks, compressed with encoding if given."""
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor().compressobj()
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = None
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            if compressor:
+                chunk = compressor.compress(chunk)
+            # An empty chunk would end a chunked response early.
+            if chunk:
+                yield chunk
+    if compressor:
+        yield compressor.flush()
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """Queue an input; the response carries the job id and its status URL."""
+    payload = request.get_json(silent=True) or request.form
+    input_path = (payload.get("input_path") or "").strip()
+    if not input_path:
+        return jsonify(error="input_path is required"), 400
+    job = jobs.submit(input_path)
+    if job is None:
+        return jsonify(error="Too many jobs are waiting"), 503
+    return jsonify(id=job.id, status_url=url_for("job_status", job_id=job.id)), 202
 
-    return render_template_string(template)
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown or expired job"), 404
+    return jsonify(job.to_dict())
 
+@app.route("/jobs/<job_id>/preview")
+def job_preview(job_id):
+    job = jobs.get(job_id)
+    if job is None or job.status != "done":
+        abort(404)
+    return jsonify(read_preview(job.path("uncompressed"), request.args.get("page", 1, type=int)))
 
-@app.route("/download")
-def download():
-    filename = request.args.get("filename")
-    if filename and os.path.exists(filename):
-        return send_file(filename, as_attachment=True)
-    return "File not found", 404
+@app.route("/jobs/<job_id>/<kind>")
+def download(job_id, kind):
+    """Stream an output with chunked transfer, gzip- or zstd-encoded when the client accepts it."""
+    job = jobs.get(job_id)
+    if job is None or job.status != "done" or kind not in OUTPUT_FILES or not os.path.exists(job.path(kind)):
+        abort(404)
+    encoding = negotiate_encoding(request.accept_encodings)
+    response = Response(stream_with_context(iter_file_chunks(job.path(kind), encoding)),
+                        mimetype="application/json" if kind == "tokens" else "text/plain")
+    response.headers["Content-Disposition"] = f'attachment; filename="{OUTPUT_FILES[kind]}"'
+    response.headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return response
 
 if __name__ == "__main__":
     # Run the app in debug mode for local development